@@ -0,0 +1,252 @@
+# app/core/checkpoints.py
+from __future__ import annotations
+
+import json
+import os
+import zlib
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from app.storage.models import (
+    Case,
+    Checkpoint,
+    Document,
+    DocumentStatus,
+    DocumentVersion,
+    EvidenceItem,
+    EvidenceStatus,
+)
+
+# Каждый N-й чекпоинт - полный снимок: восстановление читает не больше N дельт
+CHECKPOINT_KEYFRAME_INTERVAL = int(os.getenv("CHECKPOINT_KEYFRAME_INTERVAL", "10"))
+# Дельта почти как полный снимок - дешевле сразу записать полный
+CHECKPOINT_KEYFRAME_RATIO = float(os.getenv("CHECKPOINT_KEYFRAME_RATIO", "0.5"))
+
+# Snapshot: {section: {key: value}}. Maps keyed by exhibit code / document title, so a
+# delta holds only the entries that changed. Document texts are not copied: versions are
+# immutable rows, the snapshot points at them by id.
+SECTIONS = ("case", "memo", "evidence", "documents")
+_EVIDENCE_FIELDS = ("title", "description", "criterion_tags", "strength", "status", "file_ids")
+
+
+@dataclass
+class CheckpointInfo:
+    id: int
+    label: str
+    keyframe: bool
+    size_bytes: int
+    changes: int
+
+
+@dataclass
+class RestoreResult:
+    checkpoint_id: int
+    safety_checkpoint_id: int
+    evidence_restored: int = 0
+    evidence_removed: int = 0
+    documents_restored: int = 0
+    # Документы, удаленные после чекпоинта (их версий больше нет) и появившиеся после него
+    documents_missing: List[str] = field(default_factory=list)
+    documents_kept: List[str] = field(default_factory=list)
+
+
+# -------------------- snapshot / delta --------------------
+
+def capture_snapshot(session: Session, case: Case) -> Dict[str, Dict[str, Any]]:
+    evidence = session.execute(
+        select(EvidenceItem.exhibit_code, *(getattr(EvidenceItem, f) for f in _EVIDENCE_FIELDS))
+        .where(EvidenceItem.case_id == case.id)
+    ).all()
+    documents = session.execute(
+        select(Document.title, Document.doc_type, Document.status, Document.current_version_id)
+        .where(Document.case_id == case.id)
+    ).all()
+    snapshot = {
+        "case": {"lock_mode": case.lock_mode},
+        "memo": dict(case.memo_json or {}),
+        "evidence": {
+            r.exhibit_code: {f: getattr(r, f) for f in _EVIDENCE_FIELDS} | {"status": r.status.value}
+            for r in evidence
+        },
+        "documents": {
+            r.title: {"doc_type": r.doc_type, "status": r.status.value, "current_version_id": r.current_version_id}
+            for r in documents
+        },
+    }
+    # Через JSON: сравнение с восстановленным снимком идет по тем же типам
+    return json.loads(json.dumps(snapshot, ensure_ascii=False))
+
+
+def diff_snapshots(old: Dict[str, Dict[str, Any]], new: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    {section: {"set": {key: value}, "del": [key, ...]}} for the sections that changed.
+    """
+    delta: Dict[str, Dict[str, Any]] = {}
+    for section in SECTIONS:
+        a, b = old.get(section, {}), new.get(section, {})
+        changed = {k: v for k, v in b.items() if k not in a or a[k] != v}
+        removed = sorted(k for k in a if k not in b)
+        if changed or removed:
+            delta[section] = {"set": changed, "del": removed}
+    return delta
+
+
+def apply_delta(snapshot: Dict[str, Dict[str, Any]], delta: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    out = {section: dict(snapshot.get(section, {})) for section in SECTIONS}
+    for section, change in delta.items():
+        out[section].update(change.get("set", {}))
+        for key in change.get("del", []):
+            out[section].pop(key, None)
+    return out
+
+
+def count_changes(delta: Dict[str, Dict[str, Any]]) -> int:
+    return sum(len(c.get("set", {})) + len(c.get("del", [])) for c in delta.values())
+
+
+def encode_delta(delta: Dict[str, Dict[str, Any]]) -> bytes:
+    raw = json.dumps(delta, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(raw, 9)
+
+
+def decode_delta(blob: bytes) -> Dict[str, Dict[str, Any]]:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+# -------------------- storage --------------------
+
+def load_snapshot(session: Session, checkpoint_id: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Rebuilds a checkpoint: one recursive query for its chain back to the keyframe,
+    then the deltas are applied oldest first.
+    """
+    chain = (
+        select(Checkpoint.id, Checkpoint.base_id, Checkpoint.delta, Checkpoint.snapshot_json)
+        .where(Checkpoint.id == checkpoint_id)
+        .cte("chain", recursive=True)
+    )
+    chain = chain.union_all(
+        select(Checkpoint.id, Checkpoint.base_id, Checkpoint.delta, Checkpoint.snapshot_json)
+        .join(chain, Checkpoint.id == chain.c.base_id)
+    )
+    rows = session.execute(select(chain.c.delta, chain.c.snapshot_json).order_by(chain.c.id)).all()
+    if not rows:
+        raise ValueError(f"Checkpoint #{checkpoint_id} not found")
+
+    snapshot: Dict[str, Dict[str, Any]] = {section: {} for section in SECTIONS}
+    for blob, legacy in rows:
+        if blob is None:
+            # Старый формат: полный снимок в snapshot_json
+            snapshot = apply_delta({}, {s: {"set": legacy.get(s) or {}} for s in SECTIONS})
+        else:
+            snapshot = apply_delta(snapshot, decode_delta(blob))
+    return snapshot
+
+
+def latest_checkpoint(session: Session, case_id: int) -> Optional[Checkpoint]:
+    return session.execute(
+        select(Checkpoint)
+        .where(Checkpoint.case_id == case_id)
+        .order_by(Checkpoint.created_at.desc(), Checkpoint.id.desc())
+        .limit(1)
+    ).scalar_one_or_none()
+
+
+def create_checkpoint(session: Session, case_id: int, label: str) -> CheckpointInfo:
+    """
+    Stores the case state as a compressed delta against the case's latest checkpoint.
+    A keyframe (full snapshot) is written every CHECKPOINT_KEYFRAME_INTERVAL checkpoints,
+    or when the delta would not be much smaller than one.
+    """
+    case = session.get(Case, case_id, with_for_update=True)
+    if not case:
+        raise ValueError(f"Case {case_id} not found")
+
+    current = capture_snapshot(session, case)
+    keyframe = diff_snapshots({}, current)
+    full = encode_delta(keyframe)
+    base = latest_checkpoint(session, case_id)
+
+    blob, base_id, depth, changes = full, None, 0, count_changes(keyframe)
+    if base is not None and base.depth + 1 < CHECKPOINT_KEYFRAME_INTERVAL:
+        delta = diff_snapshots(load_snapshot(session, base.id), current)
+        encoded = encode_delta(delta)
+        if len(encoded) < len(full) * CHECKPOINT_KEYFRAME_RATIO:
+            blob, base_id, depth, changes = encoded, base.id, base.depth + 1, count_changes(delta)
+
+    cp = Checkpoint(case_id=case_id, label=label[:240], snapshot_json={},
+                    base_id=base_id, depth=depth, delta=blob, size_bytes=len(blob))
+    session.add(cp)
+    session.flush()
+    return CheckpointInfo(id=cp.id, label=cp.label, keyframe=base_id is None, size_bytes=len(blob), changes=changes)
+
+
+def list_checkpoints(session: Session, case_id: int, limit: int = 10) -> List[Row]:
+    # Без колонки delta: для списка она не нужна
+    return list(session.execute(
+        select(Checkpoint.id, Checkpoint.label, Checkpoint.base_id, Checkpoint.size_bytes, Checkpoint.created_at)
+        .where(Checkpoint.case_id == case_id)
+        .order_by(Checkpoint.created_at.desc(), Checkpoint.id.desc())
+        .limit(limit)
+    ).all())
+
+
+def restore_checkpoint(session: Session, case_id: int, checkpoint_id: int) -> RestoreResult:
+    """
+    Brings memo, lock mode, the evidence registry and document statuses/current versions
+    back to the checkpoint. The current state is checkpointed first, so a restore can be undone.
+    Documents created after the checkpoint are kept.
+    """
+    cp = session.get(Checkpoint, checkpoint_id)
+    if not cp or cp.case_id != case_id:
+        raise ValueError(f"Checkpoint #{checkpoint_id} not found in the active case")
+    snapshot = load_snapshot(session, checkpoint_id)
+
+    safety = create_checkpoint(session, case_id, f"auto: before restore to #{checkpoint_id}")
+    case = session.get(Case, case_id)
+    result = RestoreResult(checkpoint_id=checkpoint_id, safety_checkpoint_id=safety.id)
+
+    case.memo_json = snapshot["memo"]
+    case.lock_mode = bool(snapshot["case"].get("lock_mode", case.lock_mode))
+
+    items = {e.exhibit_code: e for e in session.query(EvidenceItem).filter(EvidenceItem.case_id == case_id)}
+    for code, data in snapshot["evidence"].items():
+        item = items.pop(code, None)
+        if item is None:
+            item = EvidenceItem(case_id=case_id, exhibit_code=code)
+            session.add(item)
+        values = {f: data.get(f) for f in _EVIDENCE_FIELDS if f in data}
+        values["status"] = EvidenceStatus(values.get("status", EvidenceStatus.draft.value))
+        changed = False
+        for f, v in values.items():
+            if getattr(item, f) != v:
+                setattr(item, f, v)
+                changed = True
+        result.evidence_restored += changed
+    for item in items.values():
+        session.delete(item)
+        result.evidence_removed += 1
+
+    docs = {d.title: d for d in session.query(Document).filter(Document.case_id == case_id)}
+    versions = set(session.execute(
+        select(DocumentVersion.id, DocumentVersion.document_id)
+        .where(DocumentVersion.document_id.in_([d.id for d in docs.values()]))
+    ).all())
+    for title, data in snapshot["documents"].items():
+        doc = docs.pop(title, None)
+        version_id = data["current_version_id"]
+        # Документ удален (или пересоздан с тем же названием) - версии из снимка у него нет
+        if doc is None or (version_id is not None and (version_id, doc.id) not in versions):
+            result.documents_missing.append(title)
+            continue
+        status = DocumentStatus(data["status"])
+        if (doc.doc_type, doc.status, doc.current_version_id) != (data["doc_type"], status, version_id):
+            doc.doc_type, doc.status, doc.current_version_id = data["doc_type"], status, version_id
+            result.documents_restored += 1
+    result.documents_kept = sorted(docs)
+    session.flush()
+    return result
@@ -1,13 +1,26 @@
 # app/core/context_builder.py
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+import os
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
 
+from sqlalchemy import Integer, cast, func, literal, select
+from sqlalchemy.dialects.postgresql import JSONB, array
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
 
+from app.core.criteria import detect_criteria, mentioned_exhibits
 from app.storage.models import Case, EvidenceItem, Document, DocumentVersion
 
+# Сколько экспонатов попадает в сводку для LLM (самые релевантные, а не первые по алфавиту)
+EVIDENCE_SUMMARY_LIMIT = int(os.getenv("EVIDENCE_SUMMARY_LIMIT", "40"))
+# Потолок памяти кеша ContextPack на процесс (тексты документов - основная часть)
+CONTEXT_CACHE_MAX_BYTES = int(os.getenv("CONTEXT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
 
 @dataclass
 class ContextPack:
@@ -20,40 +33,89 @@ class ContextPack:
     extra: Dict[str, Any]
 
 
-def _summarize_evidence(evidence_items: List[EvidenceItem], max_items: int = 40) -> str:
+def select_evidence(
+    session: Session,
+    case_id: int,
+    *,
+    tags: Sequence[str] = (),
+    exhibit_codes: Sequence[str] = (),
+    limit: int = EVIDENCE_SUMMARY_LIMIT,
+) -> Tuple[List[Row], int, Optional[str]]:
+    """
+    Top `limit` exhibits of the case, ranked in SQL: exhibits cited in the document first,
+    then by criterion-tag overlap, then strength. Only the summary columns are read.
+    Returns (rows, total exhibits in the case, max updated_at as text).
+    """
+    if tags:
+        t = func.jsonb_array_elements_text(cast(EvidenceItem.criterion_tags, JSONB)).table_valued("value").alias("t")
+        overlap = (
+            select(func.count())
+            .select_from(t)
+            .where(t.c.value == func.any(array(list(tags))))
+            .scalar_subquery()
+        )
+    else:
+        overlap = literal(0)
+    overlap = cast(overlap, Integer).label("overlap")
+
+    # Константы в ORDER BY не ставим: psycopg2 подставит литерал, и Postgres примет его за номер колонки
+    order_by = []
+    if exhibit_codes:
+        # "C12" в тексте == "C-12" в реестре
+        code = func.replace(func.upper(EvidenceItem.exhibit_code), "-", "")
+        order_by.append(cast(code.in_([c.replace("-", "") for c in exhibit_codes]), Integer).desc())
+    if tags:
+        order_by.append(overlap.desc())
+    order_by += [EvidenceItem.strength.desc(), EvidenceItem.exhibit_code.asc()]
+
+    rows = session.execute(
+        select(
+            EvidenceItem.exhibit_code,
+            EvidenceItem.title,
+            EvidenceItem.criterion_tags,
+            EvidenceItem.status,
+            EvidenceItem.strength,
+            overlap,
+            func.count().over().label("total"),
+            func.max(EvidenceItem.updated_at).over().label("max_updated_at"),
+        )
+        .where(EvidenceItem.case_id == case_id)
+        .order_by(*order_by)
+        .limit(limit)
+    ).all()
+    if not rows:
+        return [], 0, None
+    return rows, rows[0].total, str(rows[0].max_updated_at)
+
+
+def _summarize_evidence(rows: List[Row], total: int) -> str:
     """
     Keep it short to avoid token bloat; the point is consistent referencing.
     """
     lines = []
-    for e in evidence_items[:max_items]:
+    for e in rows:
         tags = ", ".join(e.criterion_tags or [])
         lines.append(f"- {e.exhibit_code}: {e.title} | tags=[{tags}] | status={e.status.value} | strength={e.strength}")
-    if len(evidence_items) > max_items:
-        lines.append(f"... ({len(evidence_items) - max_items} more exhibits not shown)")
+    if total > len(rows):
+        lines.append(f"... ({total - len(rows)} more exhibits not shown)")
     return "\n".join(lines).strip()
 
 
-def build_context_pack(
+def _build_context_pack(
     session: Session,
     case_id: int,
     *,
     document_id: Optional[int] = None,
     document_version_id: Optional[int] = None,
     include_document_text: bool = True,
+    query: Optional[str] = None,
 ) -> ContextPack:
     case: Case | None = session.get(Case, case_id)
     if not case:
         raise ValueError(f"Case {case_id} not found")
 
-    evidence_items = (
-        session.query(EvidenceItem)
-        .filter(EvidenceItem.case_id == case_id)
-        .order_by(EvidenceItem.exhibit_code.asc())
-        .all()
-    )
-    evidence_summary = _summarize_evidence(evidence_items)
-
     doc_text: Optional[str] = None
+    extra: Dict[str, Any] = {}
     if include_document_text and (document_id or document_version_id):
         dv: DocumentVersion | None = None
         if document_version_id:
@@ -64,13 +126,147 @@ def build_context_pack(
                 dv = session.get(DocumentVersion, doc.current_version_id)
         if dv:
             doc_text = dv.text_extract or ""
+            extra["document_id"] = dv.document_id
+            extra["document_version_id"] = dv.id
+
+    # Релевантность: критерии, о которых говорят задача/документ (иначе - мемо), и явные ссылки на экспонаты
+    relevance_text = "\n".join(filter(None, [query, doc_text]))
+    memo = case.memo_json or {}
+    memo_criteria = [c for c in (memo.get("criteria") or []) if isinstance(c, str)]
+    tags = detect_criteria(relevance_text) or memo_criteria or detect_criteria(
+        str(memo.get("en") or memo.get("memo_en") or ""))
+    rows, total, max_updated = select_evidence(
+        session, case_id, tags=tags, exhibit_codes=mentioned_exhibits(relevance_text),
+    )
+    # Меняется при любой правке реестра (в отличие от сводки, которая зависит от документа)
+    extra["evidence_fingerprint"] = f"{total}:{max_updated}"
 
     return ContextPack(
         case_id=case.id,
         case_name=case.name,
         lock_mode=case.lock_mode,
-        memo_json=case.memo_json or {},
-        evidence_summary=evidence_summary,
+        memo_json=memo,
+        evidence_summary=_summarize_evidence(rows, total),
         document_text=doc_text,
-        extra={},
+        extra=extra,
     )
+
+
+# -------------------- cache --------------------
+
+class ContextCache:
+    """
+    In-process LRU of built ContextPacks, capped by approximate memory.
+    An entry is served only while its stamp (Case.updated_at, evidence count/max
+    updated_at, document version) still matches the database.
+    """
+
+    def __init__(self, max_bytes: int = CONTEXT_CACHE_MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, Tuple[Tuple, ContextPack, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(ctx: ContextPack) -> int:
+        return sys.getsizeof(ctx.document_text or "") + sys.getsizeof(ctx.evidence_summary) + 2048
+
+    def get(self, key: Hashable, stamp: Tuple) -> Optional[ContextPack]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] != stamp:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            # Вызывающие дописывают в extra (ссылки на экспонаты и т.п.) - отдаем копию
+            return replace(entry[1], extra=dict(entry[1].extra))
+
+    def put(self, key: Hashable, stamp: Tuple, ctx: ContextPack) -> None:
+        size = self._size(ctx)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self._data[key] = (stamp, replace(ctx, extra=dict(ctx.extra)), size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, _, evicted) = self._data.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+
+_context_cache = ContextCache()
+
+
+def _context_stamp(session: Session, case_id: int, document_id: Optional[int]) -> Optional[Tuple]:
+    """
+    One cheap round trip: (Case.updated_at, evidence fingerprint, current version of document_id).
+    """
+    evidence = select(func.count(), func.max(EvidenceItem.updated_at)).where(EvidenceItem.case_id == case_id)
+    row = session.execute(
+        select(
+            Case.updated_at,
+            evidence.with_only_columns(func.count()).scalar_subquery(),
+            evidence.with_only_columns(func.max(EvidenceItem.updated_at)).scalar_subquery(),
+            select(Document.current_version_id).where(Document.id == document_id).scalar_subquery()
+            if document_id else literal(None),
+        ).where(Case.id == case_id)
+    ).first()
+    if row is None:
+        return None
+    case_updated_at, total, max_updated, current_version_id = row
+    # Тот же формат, что extra["evidence_fingerprint"] в _build_context_pack
+    return case_updated_at, f"{total}:{max_updated if total else None}", current_version_id
+
+
+def build_context_pack(
+    session: Session,
+    case_id: int,
+    *,
+    document_id: Optional[int] = None,
+    document_version_id: Optional[int] = None,
+    include_document_text: bool = True,
+    query: Optional[str] = None,
+    use_cache: bool = True,
+) -> ContextPack:
+    """
+    Cached by (case, document version, query); a warm hit costs one small validation
+    query instead of loading the case, the evidence registry and the document text.
+    """
+    if not use_cache:
+        return _build_context_pack(session, case_id, document_id=document_id,
+                                   document_version_id=document_version_id,
+                                   include_document_text=include_document_text, query=query)
+
+    stamp = _context_stamp(session, case_id, document_id if include_document_text else None)
+    if stamp is None:
+        raise ValueError(f"Case {case_id} not found")
+    case_updated_at, evidence_fingerprint, current_version_id = stamp
+    version_id = (document_version_id or current_version_id) if include_document_text else None
+    key = (case_id, version_id, query)
+    validity = (case_updated_at, evidence_fingerprint, version_id)
+
+    ctx = _context_cache.get(key, validity)
+    if ctx is not None:
+        return ctx
+    ctx = _build_context_pack(session, case_id, document_id=document_id, document_version_id=document_version_id,
+                              include_document_text=include_document_text, query=query)
+    _context_cache.put(key, validity, ctx)
+    return ctx
+
+
+def cache_stats() -> str:
+    c = _context_cache
+    return (f"Context cache (this process): hits={c.hits} misses={c.misses} entries={len(c._data)} "
+            f"{c.bytes / 1024 / 1024:.1f}/{c.max_bytes / 1024 / 1024:.0f} MB evictions={c.evictions}")
@@ -0,0 +1,64 @@
+# app/core/criteria.py
+from __future__ import annotations
+
+import re
+from collections import Counter
+from typing import List, Optional
+
+# Порядок и имена - как в 8 CFR 204.5(h)(3)(i)-(x) и EvidenceItem.criterion_tags
+CRITERIA = [
+    "awards", "membership", "published_material", "judging", "original_contributions",
+    "scholarly_articles", "exhibitions", "critical_role", "high_salary", "commercial_success",
+]
+_CRITERION_PATTERNS = [
+    ("general", r"introduc|background|overview|final merits|conclusion|summary|введение|заключение|итог"),
+    ("awards", r"award|prize|премии|премия|наград"),
+    ("membership", r"membership|associations?\b|членств"),
+    ("published_material", r"published material|media|press|coverage|публикации о|сми|пресс"),
+    ("judging", r"judg|peer review|reviewer|жюри|рецензир|судейств"),
+    ("original_contributions", r"original contribution|major significance|вклад"),
+    ("scholarly_articles", r"scholarly|authorship|journal|научн.{0,10}стат"),
+    ("exhibitions", r"exhibition|showcase|выставк"),
+    ("critical_role", r"leading|critical role|ведущ|ключев"),
+    ("high_salary", r"salary|remuneration|compensation|зарплат|вознагражд"),
+    ("commercial_success", r"commercial success|box office|коммерческ"),
+]
+_CRITERION_RES = [(name, re.compile(p, re.I)) for name, p in _CRITERION_PATTERNS]
+_CRITERION_NUM_RE = re.compile(r"\b(?:criterion|критерий)\s*(?:#|no\.?|№)?\s*(10|[1-9]|[ivx]{1,4})\b", re.I)
+_ROMAN = {"i": 1, "ii": 2, "iii": 3, "iv": 4, "v": 5, "vi": 6, "vii": 7, "viii": 8, "ix": 9, "x": 10}
+
+
+def criterion_for(title: str) -> Optional[str]:
+    m = _CRITERION_NUM_RE.search(title)
+    if m:
+        raw = m.group(1).lower()
+        n = int(raw) if raw.isdigit() else _ROMAN.get(raw, 0)
+        if 1 <= n <= len(CRITERIA):
+            return CRITERIA[n - 1]
+    for name, rx in _CRITERION_RES:
+        if rx.search(title):
+            return name
+    return None
+
+
+_EXHIBIT_REF_RE = re.compile(r"\b(?:exhibits?|exh\.?|приложени[еяю])\s+([A-ZА-Я]{1,3}-?\d{1,3})\b", re.I)
+
+
+def detect_criteria(text: str, *, limit: int = 4) -> List[str]:
+    """
+    Criteria the text talks about, most mentioned first ("general" excluded).
+    """
+    counts = Counter()
+    for name, rx in _CRITERION_RES:
+        if name != "general":
+            n = len(rx.findall(text or ""))
+            if n:
+                counts[name] = n
+    return [name for name, _ in counts.most_common(limit)]
+
+
+def mentioned_exhibits(text: str) -> List[str]:
+    """
+    Exhibit codes cited in the text ("Exhibit B-5", "Exh. C12"), in order of first mention.
+    """
+    return list(dict.fromkeys(m.upper() for m in _EXHIBIT_REF_RE.findall(text or "")))
@@ -0,0 +1,209 @@
+# app/core/exhibit_links.py
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import Integer, cast, column, func, or_, select, true, update, values
+from sqlalchemy.orm import Session
+
+from app.core.context_builder import ContextPack
+from app.core.criteria import CRITERIA, detect_criteria, mentioned_exhibits
+from app.rag.indexer import embed_texts
+from app.storage.db import db_session
+from app.storage.models import EvidenceItem
+
+EMBED_DIM = 1536
+EXHIBIT_LINK_TOP_K = int(os.getenv("EXHIBIT_LINK_TOP_K", "3"))
+# Косинусное расстояние: дальше - уже не "подтверждающий экспонат", а шум
+EXHIBIT_LINK_MAX_DISTANCE = float(os.getenv("EXHIBIT_LINK_MAX_DISTANCE", "0.55"))
+EXHIBIT_LINK_MAX_CLAIMS = int(os.getenv("EXHIBIT_LINK_MAX_CLAIMS", "30"))
+EVIDENCE_SYNC_BATCH = int(os.getenv("EVIDENCE_SYNC_BATCH", "256"))
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[A-ZА-ЯЁ\"«(])|\n+")
+_DIGIT_RE = re.compile(r"\d")
+
+
+def evidence_text(title: str, description: str) -> str:
+    return f"{title}\n{description or ''}"
+
+
+def evidence_hash(title: str, description: str) -> str:
+    # Та же формула, что в _stale() на стороне SQL
+    return hashlib.md5(evidence_text(title, description).encode("utf-8")).hexdigest()
+
+
+def _stale():
+    sql_hash = func.md5(EvidenceItem.title + "\n" + func.coalesce(EvidenceItem.description, ""))
+    return or_(EvidenceItem.embedding.is_(None), EvidenceItem.embedding_hash.is_distinct_from(sql_hash))
+
+
+# -------------------- sync --------------------
+
+def stale_evidence(session: Session, *, case_id: Optional[int] = None,
+                   limit: int = EVIDENCE_SYNC_BATCH) -> List[Tuple[int, str, str]]:
+    stmt = select(EvidenceItem.id, EvidenceItem.title, EvidenceItem.description).where(_stale())
+    if case_id is not None:
+        stmt = stmt.where(EvidenceItem.case_id == case_id)
+    return [tuple(r) for r in session.execute(stmt.order_by(EvidenceItem.id).limit(limit)).all()]
+
+
+def store_evidence_embeddings(session: Session, rows: Sequence[Tuple[int, str, str]],
+                              vectors: Sequence[List[float]]) -> int:
+    """
+    Optimistic write: a row edited while we were embedding keeps its new text's hash
+    mismatched, so it stays stale and is picked up again.
+    """
+    stored = 0
+    for (item_id, title, description), vec in zip(rows, vectors):
+        h = evidence_hash(title, description)
+        res = session.execute(
+            update(EvidenceItem)
+            .where(
+                EvidenceItem.id == item_id,
+                func.md5(EvidenceItem.title + "\n" + func.coalesce(EvidenceItem.description, "")) == h,
+            )
+            # updated_at не трогаем: это не правка экспоната, и отпечаток реестра не должен меняться
+            .values(embedding=vec, embedding_hash=h, updated_at=EvidenceItem.updated_at)
+            .execution_options(synchronize_session=False)
+        )
+        stored += res.rowcount
+    return stored
+
+
+def sync_evidence_embeddings(*, case_id: Optional[int] = None, batch_size: int = EVIDENCE_SYNC_BATCH,
+                             max_batches: Optional[int] = None) -> int:
+    """
+    Embeds new/edited exhibits. No transaction is open during the embedding calls.
+    """
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        with db_session() as session:
+            rows = stale_evidence(session, case_id=case_id, limit=batch_size)
+        if not rows:
+            break
+        vectors = embed_texts([evidence_text(t, d) for _, t, d in rows])
+        with db_session() as session:
+            stored = store_evidence_embeddings(session, rows, vectors)
+        total += stored
+        batches += 1
+        if len(rows) < batch_size:
+            break
+    return total
+
+
+# -------------------- claims -> exhibits --------------------
+
+def extract_claims(text: str, *, max_claims: int = EXHIBIT_LINK_MAX_CLAIMS) -> List[str]:
+    """
+    Sentences that assert something checkable (numbers, criterion vocabulary) and don't
+    cite an exhibit yet - the "missing evidence link" candidates. Document order is kept.
+    """
+    scored = []
+    for i, sentence in enumerate(_SENTENCE_RE.split(text or "")):
+        s = " ".join(sentence.split())
+        if not 40 <= len(s) <= 600 or mentioned_exhibits(s):
+            continue
+        score = (1 if _DIGIT_RE.search(s) else 0) + len(detect_criteria(s, limit=len(CRITERIA)))
+        if score:
+            scored.append((score, i, s))
+    top = sorted(scored, key=lambda x: (-x[0], x[1]))[:max_claims]
+    return [s for _, _, s in sorted(top, key=lambda x: x[1])]
+
+
+@dataclass
+class ExhibitCandidate:
+    exhibit_code: str
+    title: str
+    similarity: float
+
+
+def find_exhibit_candidates(
+    session: Session,
+    case_id: int,
+    claim_vectors: Sequence[List[float]],
+    *,
+    top_k: int = EXHIBIT_LINK_TOP_K,
+    max_distance: float = EXHIBIT_LINK_MAX_DISTANCE,
+) -> Dict[int, List[ExhibitCandidate]]:
+    """
+    All claims in one query: VALUES (claim#, vector) joined LATERAL to the k nearest
+    exhibits of the case. The case's exhibits are materialized first, so the search is an
+    exact scan of one registry (hundreds of rows) instead of the global HNSW index, which
+    filters by case only after its scan and misses small cases in a large table.
+    """
+    if not claim_vectors:
+        return {}
+    claims = values(column("ord", Integer), column("emb", Vector(EMBED_DIM)), name="claims").data(
+        [(i, vec) for i, vec in enumerate(claim_vectors)]
+    )
+    case_evidence = (
+        select(EvidenceItem.exhibit_code, EvidenceItem.title, EvidenceItem.embedding)
+        .where(EvidenceItem.case_id == case_id, EvidenceItem.embedding.is_not(None))
+        .cte("case_evidence")
+        .prefix_with("MATERIALIZED")
+    )
+    # В VALUES параметр без типа (text) - приводим к vector явно
+    distance = case_evidence.c.embedding.cosine_distance(cast(claims.c.emb, Vector(EMBED_DIM)))
+    nearest = (
+        select(case_evidence.c.exhibit_code, case_evidence.c.title, distance.label("distance"))
+        .order_by(distance)
+        .limit(top_k)
+        .lateral("nearest")
+    )
+    rows = session.execute(
+        select(claims.c.ord, nearest.c.exhibit_code, nearest.c.title, nearest.c.distance)
+        .select_from(claims)
+        .join(nearest, true())
+        .where(nearest.c.distance <= max_distance)
+        .order_by(claims.c.ord, nearest.c.distance)
+    ).all()
+
+    out: Dict[int, List[ExhibitCandidate]] = {}
+    for ord_, code, title, dist in rows:
+        out.setdefault(ord_, []).append(ExhibitCandidate(code, title, round(1.0 - float(dist), 3)))
+    return out
+
+
+def render_links(claims: List[str], candidates: Dict[int, List[ExhibitCandidate]], *,
+                 claim_chars: int = 160) -> str:
+    lines = []
+    for i, claim in enumerate(claims):
+        found = candidates.get(i)
+        if not found:
+            continue
+        short = claim if len(claim) <= claim_chars else claim[:claim_chars - 1] + "…"
+        exhibits = ", ".join(f"{c.exhibit_code} ({c.similarity:.2f})" for c in found)
+        lines.append(f'- "{short}" -> {exhibits}')
+    return "\n".join(lines)
+
+
+def attach_exhibit_links(ctx: ContextPack) -> ContextPack:
+    """
+    Precomputes candidate exhibits for the document's uncited claims and puts them into
+    ctx.extra["exhibit_links"] (rendered by the orchestrator prompt). Stale exhibit
+    embeddings of the case are refreshed in the same embedding request.
+    """
+    claims = extract_claims(ctx.document_text or "")
+    if not claims:
+        return ctx
+
+    with db_session() as session:
+        stale = stale_evidence(session, case_id=ctx.case_id)
+    vectors = embed_texts([evidence_text(t, d) for _, t, d in stale] + claims)
+    evidence_vectors, claim_vectors = vectors[:len(stale)], vectors[len(stale):]
+
+    with db_session() as session:
+        if stale:
+            store_evidence_embeddings(session, stale, evidence_vectors)
+            session.flush()
+        candidates = find_exhibit_candidates(session, ctx.case_id, claim_vectors)
+
+    ctx.extra["exhibit_links"] = render_links(claims, candidates)
+    ctx.extra["exhibit_links_claims"] = len(claims)
+    return ctx
@@ -0,0 +1,140 @@
+# app/core/history.py
+from __future__ import annotations
+
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import String, case, func, literal, null, select, tuple_, union_all
+from sqlalchemy.orm import Session
+
+from app.storage.models import ArchivedRun, Case, Run, RunRisk
+from app.storage.run_archive import fetch_run
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "8"))
+# Для прогонов без разобранного вердикта (до структурированного судьи) - начало judge_output
+HISTORY_VERDICT_CHARS = 160
+
+_MD_RE = re.compile(r"[*_`#>]+")
+
+# (created_at, id) последней строки страницы: следующая страница - строго "старше"
+Cursor = Tuple[datetime, int]
+
+
+@dataclass
+class RunSummary:
+    id: int
+    mode: str
+    created_at: datetime
+    verdict: str
+    confidence: Optional[float]
+    archived: bool
+
+
+def _first_line(text: str) -> str:
+    for line in (text or "").splitlines():
+        line = _MD_RE.sub("", line).strip()
+        if line:
+            return line
+    return ""
+
+
+def history_page(session: Session, case_id: int, *, before: Optional[Cursor] = None,
+                 limit: int = HISTORY_PAGE_SIZE) -> Tuple[List[RunSummary], Optional[Cursor]]:
+    """
+    Keyset pagination over the case's runs, newest first: each branch is a backward range
+    scan of its (case_id, created_at) index starting at the cursor, so page N costs the same
+    as page 1. Archived runs (app/storage/run_archive.py) continue the list after the hot ones.
+    Returns the page and the cursor of the next one (None on the last page).
+    """
+    hot = select(
+        Run.id.label("id"),
+        Run.mode.label("mode"),
+        Run.created_at.label("created_at"),
+        Run.verdict.label("verdict"),
+        Run.confidence.label("confidence"),
+        # judge_output читается только у старых прогонов без колонки verdict
+        case((Run.verdict.is_(None), func.left(Run.judge_output, HISTORY_VERDICT_CHARS)),
+             else_=null()).label("preview"),
+        literal(False).label("archived"),
+    ).where(Run.case_id == case_id)
+    cold = select(
+        ArchivedRun.run_id,
+        ArchivedRun.mode,
+        ArchivedRun.created_at,
+        ArchivedRun.verdict,
+        ArchivedRun.confidence,
+        null().cast(String),
+        literal(True),
+    ).where(ArchivedRun.case_id == case_id)
+    if before is not None:
+        ts, run_id = before
+        # created_at <= ts ограничивает скан индекса, сравнение кортежей разводит совпадения по id
+        hot = hot.where(Run.created_at <= ts, tuple_(Run.created_at, Run.id) < tuple_(ts, run_id))
+        cold = cold.where(ArchivedRun.created_at <= ts,
+                          tuple_(ArchivedRun.created_at, ArchivedRun.run_id) < tuple_(ts, run_id))
+
+    # LIMIT в каждой ветке: ни одна не читает больше страницы
+    page = union_all(
+        hot.order_by(Run.created_at.desc(), Run.id.desc()).limit(limit + 1),
+        cold.order_by(ArchivedRun.created_at.desc(), ArchivedRun.run_id.desc()).limit(limit + 1),
+    ).subquery()
+    rows = session.execute(
+        select(page).order_by(page.c.created_at.desc(), page.c.id.desc()).limit(limit + 1)
+    ).all()
+
+    items = [
+        RunSummary(id=r.id, mode=r.mode.value, created_at=r.created_at,
+                   verdict=(r.verdict or "").replace("_", " ") or _first_line(r.preview),
+                   confidence=r.confidence, archived=r.archived)
+        for r in rows[:limit]
+    ]
+    next_cursor = (items[-1].created_at, items[-1].id) if len(rows) > limit else None
+    return items, next_cursor
+
+
+def open_run(session: Session, case_id: int, run_id: int) -> Optional[Dict[str, Any]]:
+    """
+    The full run (judge output included), only if it belongs to the case.
+    """
+    record = fetch_run(session, run_id)
+    if record is None or record["case_id"] != case_id:
+        return None
+    return record
+
+
+@dataclass
+class VerdictRow:
+    case_id: int
+    case_name: str
+    run_id: int
+    created_at: datetime
+    confidence: Optional[float]
+    high_risks: int
+
+
+def cases_by_verdict(session: Session, verdict: str, since: datetime) -> List[VerdictRow]:
+    """
+    Cases with a `verdict` run since `since` (latest such run per case), e.g. "NEEDS_WORK
+    this week": a range on ix_run_verdict_created, no judge text is read.
+    """
+    latest = (
+        select(Run.id, Run.case_id, Run.created_at, Run.confidence)
+        .where(Run.verdict == verdict, Run.created_at >= since)
+        .order_by(Run.case_id, Run.created_at.desc(), Run.id.desc())
+        .distinct(Run.case_id)
+        .subquery()
+    )
+    high = (
+        select(func.count())
+        .where(RunRisk.run_id == latest.c.id, RunRisk.severity == "high")
+        .scalar_subquery()
+    )
+    rows = session.execute(
+        select(latest.c.case_id, Case.name, latest.c.id, latest.c.created_at, latest.c.confidence, high)
+        .join(Case, Case.id == latest.c.case_id)
+        .order_by(latest.c.created_at.desc())
+    ).all()
+    return [VerdictRow(*r) for r in rows]
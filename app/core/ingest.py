@@ -0,0 +1,140 @@
+# app/core/ingest.py
+from __future__ import annotations
+
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+
+from app.storage.db import db_session
+from app.storage.files import BlobRef, register_file
+from app.storage.models import Document, DocumentVersion
+from app.utils.text_extract import ExtractResult, submit_extraction
+
+
+@dataclass
+class IngestResult:
+    title: str
+    document_id: int
+    version_id: int
+    # FileObject загруженного файла (общий для всех кейсов с тем же содержимым)
+    file_id: Optional[int] = None
+    pages: int = 0
+    chars: int = 0
+    truncated: bool = False
+    # Файл уже был загружен: id существующей версии, извлечение пропущено
+    duplicate: bool = False
+
+
+def find_duplicate(session: Session, case_id: int, file_id: int,
+                   content_hash: str) -> Optional[Tuple[int, int, str]]:
+    """
+    (document_id, version_id, title) of a version in this case with the same stored file.
+    """
+    row = session.execute(
+        select(Document.id, DocumentVersion.id, Document.title)
+        .join(Document, Document.id == DocumentVersion.document_id)
+        # content_hash - для версий без FileObject (сохранены не через файловое хранилище)
+        .where(Document.case_id == case_id,
+               or_(DocumentVersion.file_id == file_id, DocumentVersion.content_hash == content_hash))
+        .order_by(DocumentVersion.id.desc())
+        .limit(1)
+    ).first()
+    return tuple(row) if row else None
+
+
+def save_version(
+    session: Session,
+    *,
+    case_id: int,
+    title: str,
+    storage_url: str,
+    content_hash: str,
+    text: str,
+    created_by: str,
+    file_id: Optional[int] = None,
+    doc_type: str = "upload",
+) -> Tuple[int, int]:
+    """
+    New DocumentVersion (the document is created on first upload) and make it current.
+    """
+    doc = session.execute(
+        select(Document).where(Document.case_id == case_id, Document.title == title)
+    ).scalar_one_or_none()
+    if doc is None:
+        doc = Document(case_id=case_id, title=title, doc_type=doc_type)
+        session.add(doc)
+        session.flush()
+
+    version = DocumentVersion(
+        document_id=doc.id,
+        file_id=file_id,
+        storage_url=storage_url,
+        content_hash=content_hash,
+        text_extract=text,
+        created_by=created_by,
+    )
+    session.add(version)
+    session.flush()
+    doc.current_version_id = version.id
+    return doc.id, version.id
+
+
+def ingest_blob(
+    *,
+    case_id: int,
+    title: str,
+    ref: BlobRef,
+    filename: str,
+    created_by: str,
+    content_type: str = "",
+) -> "Future[IngestResult]":
+    """
+    Register the FileObject and dedupe by it, then extract in the process pool and store the version.
+    The returned Future resolves when the version is committed; the caller's thread is not blocked.
+    `ref` is a blob already in the file store (see app.storage.files); the pool reads it via mmap.
+    """
+    out: Future = Future()
+
+    # FileObject не зависит от кейса: регистрируем сразу, даже если версия окажется дублем
+    with db_session() as session:
+        file_id = register_file(session, ref, original_name=filename, content_type=content_type)
+        dup = find_duplicate(session, case_id, file_id, ref.sha256)
+    if dup is not None:
+        # Blob не удаляем: его могут использовать другие кейсы
+        doc_id, version_id, dup_title = dup
+        out.set_result(IngestResult(title=dup_title, document_id=doc_id, version_id=version_id,
+                                    file_id=file_id, duplicate=True))
+        return out
+
+    def _on_extracted(f: "Future[ExtractResult]") -> None:
+        try:
+            res = f.result()
+            with db_session() as session:
+                # Тот же файл мог прийти параллельно и уже сохраниться, пока шло извлечение
+                dup = find_duplicate(session, case_id, file_id, ref.sha256)
+                if dup is not None:
+                    out.set_result(IngestResult(title=dup[2], document_id=dup[0], version_id=dup[1],
+                                                file_id=file_id, duplicate=True))
+                    return
+                doc_id, version_id = save_version(
+                    session,
+                    case_id=case_id,
+                    title=title,
+                    storage_url=ref.url,
+                    content_hash=ref.sha256,
+                    text=res.text,
+                    created_by=created_by,
+                    file_id=file_id,
+                )
+            out.set_result(IngestResult(
+                title=title, document_id=doc_id, version_id=version_id, file_id=file_id,
+                pages=res.pages, chars=len(res.text), truncated=res.truncated,
+            ))
+        except Exception as e:
+            out.set_exception(e)
+
+    submit_extraction(ref.sha256, filename).add_done_callback(_on_extracted)
+    return out
@@ -0,0 +1,359 @@
+# app/core/jobs.py
+from __future__ import annotations
+
+import os
+import socket
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, update, func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.storage.db import db_session
+from app.storage.models import Job, JobStatus, JobSubscriber
+
+_ACTIVE = [JobStatus.queued, JobStatus.running]
+
+# Джоб без heartbeat дольше этого считается брошенным (воркер упал) и возвращается в очередь
+JOB_STALE_AFTER_S = int(os.getenv("JOB_STALE_AFTER_S", "300"))
+JOB_HEARTBEAT_S = int(os.getenv("JOB_HEARTBEAT_S", "30"))
+# Лимиты постановки: активных джобов на чат и всего в очереди
+JOB_MAX_ACTIVE_PER_CHAT = int(os.getenv("JOB_MAX_ACTIVE_PER_CHAT", "2"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "200"))
+
+
+@dataclass
+class ClaimedJob:
+    id: int
+    kind: str
+    chat_id: str
+    case_id: Optional[int]
+    payload: Dict[str, Any]
+    attempts: int
+    max_attempts: int
+
+
+@dataclass
+class JobOutcome:
+    text: str
+    run_id: Optional[int] = None
+
+
+@dataclass
+class Subscriber:
+    chat_id: str
+    status_message_id: Optional[int] = None
+
+
+# handler(job, progress) -> JobOutcome; progress(text) pushes a status line to every subscribed chat
+JobHandler = Callable[[ClaimedJob, Callable[[str], None]], JobOutcome]
+
+
+# -------------------- queue operations --------------------
+
+def enqueue_job(
+    session: Session,
+    *,
+    kind: str,
+    chat_id: str,
+    case_id: Optional[int],
+    payload: Dict[str, Any],
+    dedupe_key: Optional[str] = None,
+    max_attempts: int = 3,
+    status_message_id: Optional[int] = None,
+) -> Tuple[int, bool]:
+    """
+    Returns (job_id, created). With a dedupe_key, an already queued/running job
+    with the same key is returned instead of creating a duplicate, and chat_id
+    is subscribed to it (single-flight: one execution, every requester gets the result).
+    """
+    stmt = (
+        pg_insert(Job)
+        .values(
+            kind=kind,
+            chat_id=chat_id,
+            case_id=case_id,
+            payload=payload,
+            dedupe_key=dedupe_key,
+            status=JobStatus.queued,
+            max_attempts=max_attempts,
+        )
+        .returning(Job.id)
+    )
+    if dedupe_key:
+        stmt = stmt.on_conflict_do_nothing(
+            index_elements=["dedupe_key"],
+            # Должно совпадать с предикатом частичного индекса uq_job_dedupe_active
+            index_where=text("status IN ('queued', 'running')"),
+        )
+    job_id = session.execute(stmt).scalar_one_or_none()
+    if job_id is not None:
+        subscribe(session, job_id, chat_id, status_message_id)
+        return job_id, True
+
+    # FOR UPDATE: воркер не может завершить джоб (и разослать результат), пока мы подписываемся
+    existing = session.execute(
+        select(Job.id).where(Job.dedupe_key == dedupe_key, Job.status.in_(_ACTIVE)).with_for_update()
+    ).scalar_one_or_none()
+    if existing is None:
+        # Активный джоб успел завершиться между INSERT и SELECT - ставим заново
+        return enqueue_job(session, kind=kind, chat_id=chat_id, case_id=case_id,
+                           payload=payload, dedupe_key=dedupe_key, max_attempts=max_attempts,
+                           status_message_id=status_message_id)
+    subscribe(session, existing, chat_id, status_message_id)
+    return existing, False
+
+
+def subscribe(session: Session, job_id: int, chat_id: str, status_message_id: Optional[int]) -> None:
+    stmt = pg_insert(JobSubscriber).values(job_id=job_id, chat_id=chat_id, status_message_id=status_message_id)
+    # Повторный запрос из того же чата: прогресс пишем в новое статус-сообщение
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_job_subscriber",
+        set_={"status_message_id": stmt.excluded.status_message_id},
+    )
+    session.execute(stmt)
+
+
+def job_subscribers(session: Session, job: ClaimedJob) -> List[Subscriber]:
+    rows = session.execute(
+        select(JobSubscriber.chat_id, JobSubscriber.status_message_id)
+        .where(JobSubscriber.job_id == job.id)
+        .order_by(JobSubscriber.id.asc())
+    ).all()
+    return [Subscriber(r.chat_id, r.status_message_id) for r in rows] or [Subscriber(job.chat_id)]
+
+
+def find_active(session: Session, dedupe_key: str) -> Optional[int]:
+    return session.execute(
+        select(Job.id).where(Job.dedupe_key == dedupe_key, Job.status.in_(_ACTIVE))
+    ).scalar_one_or_none()
+
+
+def active_job_count(session: Session, *, chat_id: Optional[str] = None) -> int:
+    """
+    Queued/running jobs overall, or those a chat is subscribed to.
+    """
+    stmt = select(func.count(Job.id)).where(Job.status.in_(_ACTIVE))
+    if chat_id is not None:
+        stmt = stmt.join(JobSubscriber, JobSubscriber.job_id == Job.id).where(JobSubscriber.chat_id == chat_id)
+    return session.execute(stmt).scalar_one()
+
+
+def queue_position(session: Session, job_id: int) -> int:
+    """
+    1-based position among queued jobs (0 if the job is not queued anymore).
+    """
+    status = session.execute(select(Job.status).where(Job.id == job_id)).scalar_one_or_none()
+    if status != JobStatus.queued:
+        return 0
+    ahead = session.execute(
+        select(func.count(Job.id)).where(Job.status == JobStatus.queued, Job.id < job_id)
+    ).scalar_one()
+    return ahead + 1
+
+
+def claim_job(session: Session, worker_id: str, kinds: Optional[List[str]] = None) -> Optional[ClaimedJob]:
+    now = datetime.utcnow()
+    stmt = (
+        select(Job)
+        .where(Job.status == JobStatus.queued, Job.run_after <= now)
+        .order_by(Job.id.asc())
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    if kinds:
+        stmt = stmt.where(Job.kind.in_(kinds))
+    job = session.execute(stmt).scalar_one_or_none()
+    if job is None:
+        return None
+
+    job.status = JobStatus.running
+    job.attempts += 1
+    job.locked_by = worker_id
+    job.heartbeat_at = now
+    claimed = ClaimedJob(
+        id=job.id, kind=job.kind, chat_id=job.chat_id, case_id=job.case_id,
+        payload=dict(job.payload or {}), attempts=job.attempts, max_attempts=job.max_attempts,
+    )
+    session.commit()
+    return claimed
+
+
+def heartbeat(session: Session, job_id: int, worker_id: str) -> None:
+    session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.locked_by == worker_id, Job.status == JobStatus.running)
+        .values(heartbeat_at=datetime.utcnow())
+    )
+
+
+def complete_job(session: Session, job: ClaimedJob, worker_id: str, *, run_id: Optional[int]) -> bool:
+    """
+    Returns False if the job is no longer ours (requeued as stale and possibly claimed
+    by another worker) - its state is left to the current owner.
+    """
+    res = session.execute(
+        update(Job)
+        .where(Job.id == job.id, Job.locked_by == worker_id, Job.status == JobStatus.running)
+        .values(status=JobStatus.done, result_run_id=run_id, locked_by=None, last_error="")
+    )
+    return bool(res.rowcount)
+
+
+def fail_job(session: Session, job: ClaimedJob, worker_id: str, error: str) -> Optional[bool]:
+    """
+    Returns True if the job will be retried (exponential backoff), False if it failed for good,
+    None if the job is no longer ours (see complete_job).
+    """
+    retry = job.attempts < job.max_attempts
+    values: Dict[str, Any] = {"locked_by": None, "last_error": error[-4000:]}
+    if retry:
+        values["status"] = JobStatus.queued
+        values["run_after"] = datetime.utcnow() + timedelta(seconds=30 * 2 ** (job.attempts - 1))
+    else:
+        values["status"] = JobStatus.failed
+    res = session.execute(
+        update(Job)
+        .where(Job.id == job.id, Job.locked_by == worker_id, Job.status == JobStatus.running)
+        .values(**values)
+    )
+    if not res.rowcount:
+        return None
+    return retry
+
+
+def requeue_stale(session: Session, *, stale_after_s: int = JOB_STALE_AFTER_S) -> Tuple[int, List[ClaimedJob]]:
+    """
+    Jobs whose worker stopped sending heartbeats go back to the queue. The lost attempt
+    is already counted by claim_job, so a job that has used all of its attempts (it keeps
+    killing workers) is marked failed instead. Returns (requeued count, failed jobs).
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_after_s)
+    stale = (Job.status == JobStatus.running, Job.heartbeat_at < cutoff)
+    failed = session.execute(
+        update(Job)
+        .where(*stale, Job.attempts >= Job.max_attempts)
+        .values(status=JobStatus.failed, locked_by=None, last_error="worker lost (no heartbeat), no attempts left")
+        .returning(Job.id, Job.kind, Job.chat_id, Job.case_id, Job.payload, Job.attempts, Job.max_attempts)
+    ).all()
+    res = session.execute(
+        update(Job)
+        .where(*stale, Job.attempts < Job.max_attempts)
+        .values(status=JobStatus.queued, locked_by=None, last_error="worker lost (no heartbeat)")
+    )
+    return res.rowcount or 0, [
+        ClaimedJob(id=r.id, kind=r.kind, chat_id=r.chat_id, case_id=r.case_id,
+                   payload=dict(r.payload or {}), attempts=r.attempts, max_attempts=r.max_attempts)
+        for r in failed
+    ]
+
+
+# -------------------- worker --------------------
+
+class JobWorker:
+    """
+    Claim -> run handler outside any transaction -> record the outcome.
+    Handlers open their own short sessions; the DB is never held during LLM calls.
+    Run several of these per process (threads) and as many processes/hosts as needed.
+    """
+
+    def __init__(
+        self,
+        handlers: Dict[str, JobHandler],
+        *,
+        notify: Callable[[ClaimedJob, Subscriber, str], None],
+        progress: Optional[Callable[[ClaimedJob, Subscriber, str], None]] = None,
+        worker_id: Optional[str] = None,
+        poll_interval_s: float = 2.0,
+    ) -> None:
+        self.handlers = handlers
+        self.notify = notify
+        self.progress = progress or notify
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        self.poll_interval_s = poll_interval_s
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _heartbeat_loop(self, job_id: int, done: threading.Event) -> None:
+        while not done.wait(JOB_HEARTBEAT_S):
+            try:
+                with db_session() as session:
+                    heartbeat(session, job_id, self.worker_id)
+            except Exception as e:
+                print(f"[Worker] heartbeat failed for job #{job_id}: {e}")
+
+    def _broadcast(self, fn: Callable[[ClaimedJob, Subscriber, str], None], job: ClaimedJob, text: str) -> None:
+        # Подписчиков перечитываем каждый раз: к идущему джобу могут присоединиться новые чаты
+        with db_session() as session:
+            subs = job_subscribers(session, job)
+        for sub in subs:
+            try:
+                fn(job, sub, text)
+            except Exception as e:
+                print(f"[Worker] delivery to chat {sub.chat_id} failed for job #{job.id}: {e}")
+
+    def run_once(self) -> bool:
+        with db_session() as session:
+            job = claim_job(session, self.worker_id, kinds=list(self.handlers))
+        if job is None:
+            return False
+
+        done = threading.Event()
+        hb = threading.Thread(target=self._heartbeat_loop, args=(job.id, done), daemon=True)
+        hb.start()
+        try:
+            outcome = self.handlers[job.kind](job, lambda text: self._broadcast(self.progress, job, text))
+        except Exception as e:
+            done.set()
+            err = f"{type(e).__name__}: {e}"
+            print(f"[Worker] job #{job.id} ({job.kind}) failed: {err}\n{traceback.format_exc()}")
+            with db_session() as session:
+                retry = fail_job(session, job, self.worker_id, err)
+            if retry is None:
+                print(f"[Worker] job #{job.id} is no longer ours (requeued as stale); dropping this attempt")
+            elif retry:
+                self._broadcast(self.progress, job,
+                                f"⚠️ Ошибка, повторю попытку позже ({job.attempts}/{job.max_attempts}).")
+            else:
+                self._broadcast(self.notify, job, f"❌ Задача #{job.id} не выполнена: {err}")
+            return True
+
+        done.set()
+        with db_session() as session:
+            owned = complete_job(session, job, self.worker_id, run_id=outcome.run_id)
+        if not owned:
+            # Результат сохранен (run_id), но джоб уже переназначен - ответ пришлет новый владелец
+            print(f"[Worker] job #{job.id} is no longer ours (requeued as stale); run #{outcome.run_id} not delivered")
+            return True
+        self._broadcast(self.notify, job, outcome.text)
+        return True
+
+    def run_forever(self) -> None:
+        last_reap = 0.0
+        while not self._stop.is_set():
+            if time.monotonic() - last_reap > 60:
+                last_reap = time.monotonic()
+                try:
+                    with db_session() as session:
+                        n, failed = requeue_stale(session)
+                    if n or failed:
+                        print(f"[Worker] requeued {n} stale jobs, {len(failed)} failed (no attempts left)")
+                    for job in failed:
+                        self._broadcast(self.notify, job,
+                                        f"❌ Задача #{job.id} не выполнена: обработчик падал {job.attempts} раз(а).")
+                except Exception as e:
+                    print(f"[Worker] requeue_stale failed: {e}")
+            try:
+                worked = self.run_once()
+            except Exception as e:
+                print(f"[Worker] loop error: {e}")
+                worked = False
+            if not worked:
+                self._stop.wait(self.poll_interval_s)
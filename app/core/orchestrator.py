@@ -3,13 +3,14 @@ from __future__ import annotations
 
 import hashlib
 from dataclasses import dataclass
-from typing import Optional, Dict, Any, Tuple
+from typing import Optional, Dict, Any, Callable
 
 from sqlalchemy.orm import Session
 
 from app.core.context_builder import ContextPack
 from app.llm.base import LLMClient
-from app.storage.models import Run, RunMode
+from app.llm.judge import Judgment, judge_call
+from app.storage.models import Run, RunMode, RunRisk
 
 
 ANALYST_SYSTEM = """You are an EB-1A legal analyst.
@@ -90,6 +91,11 @@ def _render_user_prompt(
         ctx.evidence_summary or "[no exhibits yet]",
     ]
 
+    exhibit_links = ctx.extra.get("exhibit_links")
+    if exhibit_links:
+        parts += ["", "=== CANDIDATE EXHIBITS FOR UNCITED CLAIMS (vector search; verify before citing) ===",
+                  exhibit_links]
+
     if rag_snippets:
         parts += ["", "=== OFFICIAL SOURCES (RAG SNIPPETS) ===", rag_snippets]
 
@@ -100,8 +106,20 @@ def _render_user_prompt(
     return "\n".join(parts)
 
 
-def run_debate(
-    session: Session,
+@dataclass
+class DebateOutputs:
+    prompt_pack: Dict[str, Any]
+    inputs_hash: str
+    model_a_output: str
+    model_b_output: str
+    critique_a: str
+    critique_b: str
+    judge_output: str
+    # Structured judge answer; None if the judge failed or its answer couldn't be parsed
+    judgment: Optional[Judgment] = None
+
+
+def debate(
     *,
     ctx: ContextPack,
     mode: RunMode,
@@ -112,15 +130,23 @@ def run_debate(
     rag_snippets: Optional[str] = None,
     temperature: float = 0.2,
     max_output_tokens: int = 1400,
-) -> OrchestratorResult:
+    on_progress: Optional[Callable[[str], None]] = None,
+    judge_system: str = JUDGE_SYSTEM,
+    judge_sections: int = 0,
+    prompt_extra: Optional[Dict[str, Any]] = None,
+) -> DebateOutputs:
     """
-    2-model debate with cross-critique + final judge.
-    Stores a Run row for audit/debug.
+    2-model debate with cross-critique + final judge. No DB access:
+    callers must not hold a transaction open during these five provider calls.
     """
     if judge is None:
         # Default: use model A as judge (works fine for MVP)
         judge = llm_a
 
+    def progress(step: str) -> None:
+        if on_progress:
+            on_progress(step)
+
     prompt_pack = {
         "case_id": ctx.case_id,
         "case_name": ctx.case_name,
@@ -130,18 +156,21 @@ def run_debate(
         "user_task": user_task,
         "rag_included": bool(rag_snippets),
         "providers": {"a": llm_a.name, "b": llm_b.name, "judge": judge.name},
+        **(prompt_extra or {}),
     }
     inputs_hash = _hash_inputs(prompt_pack)
 
     # 1) Initial answers
     user_prompt = _render_user_prompt(ctx, user_task, mode=mode, rag_snippets=rag_snippets)
 
+    progress("1/5: анализ (модель A)")
     a0 = llm_a.generate(
         system=ANALYST_SYSTEM,
         user=user_prompt,
         temperature=temperature,
         max_output_tokens=max_output_tokens,
     )
+    progress("2/5: анализ (модель B)")
     b0 = llm_b.generate(
         system=ANALYST_SYSTEM,
         user=user_prompt,
@@ -163,12 +192,14 @@ def run_debate(
         + "\n\nNow critique the OTHER MODEL answer strictly."
     )
 
+    progress("3/5: критика (модель A)")
     a1 = llm_a.generate(
         system=CRITIC_SYSTEM,
         user=a_crit_user,
         temperature=0.1,
         max_output_tokens=900,
     )
+    progress("4/5: критика (модель B)")
     b1 = llm_b.generate(
         system=CRITIC_SYSTEM,
         user=b_crit_user,
@@ -190,24 +221,51 @@ def run_debate(
         + "\n\nSynthesize a final answer per your instructions."
     )
 
-    j = judge.generate(
-        system=JUDGE_SYSTEM,
+    progress("5/5: итоговое заключение")
+    j = judge_call(
+        judge,
+        system=judge_system,
         user=judge_user,
         temperature=0.2,
         max_output_tokens=900,
+        sections=judge_sections,
     )
 
-    run = Run(
-        case_id=ctx.case_id,
-        mode=mode,
-        inputs_hash=inputs_hash,
+    return DebateOutputs(
         prompt_pack=prompt_pack,
+        inputs_hash=inputs_hash,
         model_a_output=a0.text or "",
         model_b_output=b0.text or "",
         critique_a=a1.text or "",
         critique_b=b1.text or "",
-        judge_output=j.text or "",
+        judge_output=j.text,
+        judgment=j.judgment,
+    )
+
+
+def save_run(session: Session, *, ctx: ContextPack, mode: RunMode, outputs: DebateOutputs) -> OrchestratorResult:
+    """
+    Stores a Run row for audit/debug.
+    """
+    run = Run(
+        case_id=ctx.case_id,
+        mode=mode,
+        document_version_id=ctx.extra.get("document_version_id"),
+        inputs_hash=outputs.inputs_hash,
+        prompt_pack=outputs.prompt_pack,
+        model_a_output=outputs.model_a_output,
+        model_b_output=outputs.model_b_output,
+        critique_a=outputs.critique_a,
+        critique_b=outputs.critique_b,
+        judge_output=outputs.judge_output,
     )
+    j = outputs.judgment
+    if j is not None:
+        run.verdict, run.confidence = j.verdict, j.confidence
+        run.risks = [
+            RunRisk(case_id=ctx.case_id, severity=r.severity, criterion=r.criterion, text=r.text, sections=r.sections)
+            for r in j.risks
+        ]
     session.add(run)
     session.flush()  # get run.id without commit
 
@@ -219,3 +277,34 @@ def run_debate(
         judge_output=run.judge_output,
         run_id=run.id,
     )
+
+
+def run_debate(
+    session: Session,
+    *,
+    ctx: ContextPack,
+    mode: RunMode,
+    user_task: str,
+    llm_a: LLMClient,
+    llm_b: LLMClient,
+    judge: Optional[LLMClient] = None,
+    rag_snippets: Optional[str] = None,
+    temperature: float = 0.2,
+    max_output_tokens: int = 1400,
+) -> OrchestratorResult:
+    """
+    2-model debate with cross-critique + final judge.
+    Stores a Run row for audit/debug.
+    """
+    outputs = debate(
+        ctx=ctx,
+        mode=mode,
+        user_task=user_task,
+        llm_a=llm_a,
+        llm_b=llm_b,
+        judge=judge,
+        rag_snippets=rag_snippets,
+        temperature=temperature,
+        max_output_tokens=max_output_tokens,
+    )
+    return save_run(session, ctx=ctx, mode=mode, outputs=outputs)
@@ -0,0 +1,570 @@
+# app/core/review.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.core.context_builder import ContextPack
+from app.core.criteria import criterion_for
+from app.core.orchestrator import (
+    ANALYST_SYSTEM,
+    CRITIC_SYSTEM,
+    JUDGE_SYSTEM,
+    DebateOutputs,
+    _hash_inputs,
+    _render_user_prompt,
+    debate,
+)
+from app.llm.base import LLMClient
+from app.llm.judge import JudgeResult, judge_call, render_judgment
+from app.storage.models import ArchivedRun, DocumentVersion, Run, RunMode, SectionReview
+from app.utils.diff import Section, SectionDiff, _split_long, compact_diff, diff_sections, split_sections
+
+# Если изменилась большая часть документа, инкрементальный режим не экономит - ревьюим целиком
+INCREMENTAL_MAX_CHANGED_RATIO = float(os.getenv("INCREMENTAL_MAX_CHANGED_RATIO", "0.6"))
+# Меняется вместе с промптами ниже: старые находки из кеша перестают совпадать
+SECTION_PROMPT_VERSION = "1"
+
+SECTION_JUDGE_SYSTEM = JUDGE_SYSTEM + """
+The document is split into numbered sections ("### SECTION <n>: <title>").
+After the four parts above, add one block for EVERY section you were given, exactly:
+### SECTION <n>
+- findings for that section only (risks, missing exhibit links, suggested edits), or "- No issues."
+"""
+
+MERGE_SYSTEM = """You are a neutral EB-1A adjudication summarizer.
+You receive per-section review findings for ONE document. Sections marked [NEW] were
+edited since the last review and were just re-reviewed; [CACHED] findings are carried
+over from the previous review of unchanged sections.
+Produce one answer for the whole document:
+1) Verdict: PASS / NEEDS WORK
+2) Strengths (bullets)
+3) Risks (bullets, cite section numbers)
+4) Next steps (max 10 bullets)
+Rules:
+- Do NOT invent facts or sources.
+- Keep it short and actionable.
+"""
+
+_SECTION_BLOCK_RE = re.compile(r"^[ \t#*]*SECTION\s+(\d+)\s*(?::[^\n]*)?[ \t*]*$", re.I | re.M)
+
+
+@dataclass
+class ReviewPlan:
+    sections: List[Section]
+    diff: SectionDiff
+    context_hash: str
+    # section hash -> findings from an earlier review with the same context
+    cached: Dict[str, str]
+    base_version_id: Optional[int] = None
+
+    @property
+    def to_review(self) -> List[Section]:
+        return [s for s in self.sections if s.hash not in self.cached]
+
+    @property
+    def incremental(self) -> bool:
+        return bool(self.cached) and len(self.to_review) <= INCREMENTAL_MAX_CHANGED_RATIO * len(self.sections)
+
+
+@dataclass
+class SectionedReview:
+    outputs: DebateOutputs
+    # Findings to put into the section cache (only sections the judge answered for)
+    fresh: List[Tuple[Section, str]]
+    reviewed: int
+    reused: int
+    incremental: bool
+
+
+def review_context_hash(ctx: ContextPack, *, providers: Dict[str, str], user_task: str) -> str:
+    """
+    Everything besides the section text that the findings depend on.
+    """
+    payload = {
+        "memo": ctx.memo_json,
+        # Сводка экспонатов зависит от текста документа; для кеша важна сама версия реестра
+        "evidence": ctx.extra.get("evidence_fingerprint", ctx.evidence_summary),
+        "lock_mode": ctx.lock_mode,
+        "providers": providers,
+        "task": user_task,
+        "v": SECTION_PROMPT_VERSION,
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+def split_judge_output(text: str) -> Tuple[str, Dict[int, str]]:
+    """
+    SECTION_JUDGE_SYSTEM answer -> (overall part, {section number: findings}).
+    """
+    matches = list(_SECTION_BLOCK_RE.finditer(text or ""))
+    if not matches:
+        return (text or "").strip(), {}
+    blocks: Dict[int, str] = {}
+    for m, nxt in zip(matches, matches[1:] + [None]):
+        body = text[m.end():nxt.start() if nxt else len(text)].strip()
+        if body:
+            blocks[int(m.group(1))] = body
+    return text[:matches[0].start()].strip(), blocks
+
+
+# -------------------- DB --------------------
+
+def last_reviewed_version(session: Session, document_id: int) -> Optional[int]:
+    for table, run_id in ((Run, Run.id), (ArchivedRun, ArchivedRun.run_id)):
+        # Старые прогоны уезжают в архив (app/storage/run_archive.py) - база для инкремента остается
+        version_id = session.execute(
+            select(table.document_version_id)
+            .join(DocumentVersion, DocumentVersion.id == table.document_version_id)
+            .where(DocumentVersion.document_id == document_id, table.mode == RunMode.review)
+            .order_by(run_id.desc())
+            .limit(1)
+        ).scalar_one_or_none()
+        if version_id is not None:
+            return version_id
+    return None
+
+
+def lookup_section_reviews(session: Session, hashes: List[str], context_hash: str) -> Dict[str, str]:
+    if not hashes:
+        return {}
+    rows = session.execute(
+        select(SectionReview.section_hash, SectionReview.findings)
+        .where(SectionReview.context_hash == context_hash, SectionReview.section_hash.in_(set(hashes)))
+    ).all()
+    return {h: f for h, f in rows}
+
+
+def store_section_reviews(session: Session, findings: List[Tuple[Section, str]], *, context_hash: str,
+                          run_id: Optional[int]) -> None:
+    if not findings:
+        return
+    rows = {
+        s.hash: {
+            "section_hash": s.hash,
+            "context_hash": context_hash,
+            "title": s.title[:240],
+            "findings": text,
+            "run_id": run_id,
+            "created_at": datetime.utcnow(),
+        }
+        for s, text in findings
+    }
+    stmt = pg_insert(SectionReview).values(list(rows.values()))
+    session.execute(stmt.on_conflict_do_update(
+        constraint="uq_section_review",
+        set_={
+            "title": stmt.excluded.title,
+            "findings": stmt.excluded.findings,
+            "run_id": stmt.excluded.run_id,
+            "created_at": stmt.excluded.created_at,
+        },
+    ))
+
+
+def plan_review(session: Session, ctx: ContextPack, *, providers: Dict[str, str], user_task: str) -> ReviewPlan:
+    """
+    Sections of the current version, their diff against the last reviewed version,
+    and which of them already have findings for this context.
+    """
+    sections = split_sections(ctx.document_text or "")
+    version_id = ctx.extra.get("document_version_id")
+    base_id = last_reviewed_version(session, ctx.extra["document_id"]) if ctx.extra.get("document_id") else None
+
+    old: Optional[List[Section]] = None
+    if base_id is not None:
+        if base_id == version_id:
+            old = sections
+        else:
+            base = session.get(DocumentVersion, base_id)
+            old = split_sections(base.text_extract or "") if base else None
+
+    context_hash = review_context_hash(ctx, providers=providers, user_task=user_task)
+    return ReviewPlan(
+        sections=sections,
+        diff=diff_sections(old, sections),
+        context_hash=context_hash,
+        cached=lookup_section_reviews(session, [s.hash for s in sections], context_hash),
+        base_version_id=base_id,
+    )
+
+
+# -------------------- map-reduce for long documents --------------------
+
+def criterion_chunks(sections: List[Section], max_chars: int) -> List[Tuple[str, List[Section]]]:
+    """
+    Consecutive sections of one criterion, packed up to max_chars. A section without
+    a recognizable criterion in its heading belongs to the criterion above it.
+    """
+    chunks: List[Tuple[str, List[Section]]] = []
+    current, size = "general", 0
+    for s in sections:
+        current = criterion_for(s.title) or current
+        length = len(s.title) + len(s.text) + 20
+        if chunks and chunks[-1][0] == current and size + length <= max_chars:
+            chunks[-1][1].append(s)
+            size += length
+        else:
+            chunks.append((current, [s]))
+            size = length
+    return chunks
+
+
+# Лимит на один промпт (символы, ~4 на токен): документ длиннее идет через map-reduce
+REVIEW_MAX_PROMPT_CHARS = int(os.getenv("REVIEW_MAX_PROMPT_CHARS", "60000"))
+MAPREDUCE_CONCURRENCY = int(os.getenv("MAPREDUCE_CONCURRENCY", "4"))
+# Промпт судьи в debate() = документ + 4 ответа моделей (1400+1400+900+900 токенов)
+_DEBATE_OUTPUT_RESERVE = 18000
+# Критик в map-шаге видит кусок документа + ответ аналитика
+_MAP_OUTPUT_RESERVE = 6000
+_REDUCE_MAX_LEVELS = 4
+
+_SECTION_BLOCKS_NOTE = """
+The document part is split into numbered sections ("### SECTION <n>: <title>").
+End your answer with one block for EVERY section you were given, exactly:
+### SECTION <n>
+- findings for that section only, or "- No issues."
+"""
+
+REDUCE_SYSTEM = """You condense EB-1A review findings for one long document.
+Merge duplicates, keep every concrete risk, missing exhibit link and suggested edit
+together with its section number. Group bullets by criterion.
+Do NOT invent facts or sources. Do NOT add a verdict.
+"""
+
+
+def _parallel(fn: Callable, items: list, concurrency: int) -> list:
+    if len(items) <= 1 or concurrency <= 1:
+        return [fn(x) for x in items]
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(items)), thread_name_prefix="review") as pool:
+        return list(pool.map(fn, items))
+
+
+def _pack(items: List[str], budget: int) -> List[List[str]]:
+    batches: List[List[str]] = []
+    size = budget
+    for item in items:
+        item = item[:budget]
+        if size + len(item) + 2 > budget:
+            batches.append([])
+            size = 0
+        batches[-1].append(item)
+        size += len(item) + 2
+    return batches
+
+
+def reduce_findings(
+    *,
+    ctx: ContextPack,
+    items: List[str],
+    user_task: str,
+    judge: LLMClient,
+    system: str = JUDGE_SYSTEM,
+    max_prompt_chars: int = REVIEW_MAX_PROMPT_CHARS,
+    concurrency: int = MAPREDUCE_CONCURRENCY,
+    on_progress: Optional[Callable[[str], None]] = None,
+) -> JudgeResult:
+    """
+    Hierarchical reduce: while the findings don't fit into one prompt, condense them
+    in batches (in parallel), then one final (structured) judge call with `system`.
+    """
+    base = _render_user_prompt(replace(ctx, document_text=None), user_task, mode=RunMode.review)
+    budget = max(max_prompt_chars - len(base) - 200, 4000)
+
+    def condense(batch: List[str]) -> str:
+        return judge.generate(
+            system=REDUCE_SYSTEM,
+            user=base + "\n\n=== PARTIAL FINDINGS ===\n" + "\n\n".join(batch) + "\n\nCondense these findings.",
+            temperature=0.1,
+            max_output_tokens=1200,
+        ).text or ""
+
+    level = 0
+    while len(items) > 1 and sum(len(x) + 2 for x in items) > budget and level < _REDUCE_MAX_LEVELS:
+        level += 1
+        batches = _pack(items, budget)
+        if on_progress:
+            on_progress(f"сведение находок, уровень {level} ({len(batches)} групп)")
+        items = _parallel(condense, batches, concurrency)
+
+    if on_progress:
+        on_progress("итоговое заключение по всему документу")
+    findings = "\n\n".join(items)[:budget]
+    return judge_call(
+        judge,
+        system=system,
+        user=base + "\n\n=== SECTION FINDINGS ===\n" + findings
+        + "\n\nSynthesize a final answer for the whole document per your instructions.",
+        temperature=0.2,
+        max_output_tokens=900,
+    )
+
+
+@dataclass
+class _MapResult:
+    label: str
+    analysis: str
+    critique: str
+    findings: Dict[int, str]
+
+
+def _map_chunks(
+    *,
+    ctx: ContextPack,
+    chunks: List[Tuple[str, str, List[Section]]],
+    user_task: str,
+    llm_a: LLMClient,
+    llm_b: LLMClient,
+    concurrency: int,
+    on_progress: Optional[Callable[[str], None]],
+) -> List[_MapResult]:
+    """
+    Per chunk: analysis by model A, strict critique by model B; both answer per section.
+    """
+    done = [0]
+    lock = threading.Lock()
+
+    def run(chunk: Tuple[str, str, List[Section]]) -> _MapResult:
+        label, text, sections = chunk
+        user = _render_user_prompt(
+            replace(ctx, document_text=text),
+            f"{user_task} This is one part of a long document ({label}); review only this part.",
+            mode=RunMode.review,
+        )
+        a = llm_a.generate(system=ANALYST_SYSTEM + _SECTION_BLOCKS_NOTE, user=user,
+                           temperature=0.2, max_output_tokens=1400).text or ""
+        b = llm_b.generate(
+            system=CRITIC_SYSTEM + _SECTION_BLOCKS_NOTE,
+            user=user + "\n\n=== OTHER MODEL ANSWER (A) ===\n" + a + "\n\nNow critique the OTHER MODEL answer strictly.",
+            temperature=0.1,
+            max_output_tokens=900,
+        ).text or ""
+
+        _, a_blocks = split_judge_output(a)
+        _, b_blocks = split_judge_output(b)
+        findings = {}
+        for s in sections:
+            n = s.index + 1
+            if n in a_blocks:
+                findings[n] = a_blocks[n] + (f"\nCritic:\n{b_blocks[n]}" if n in b_blocks else "")
+
+        with lock:
+            done[0] += 1
+            if on_progress:
+                on_progress(f"анализ частей документа {done[0]}/{len(chunks)}")
+        return _MapResult(label=label, analysis=a, critique=b, findings=findings)
+
+    return _parallel(run, chunks, concurrency)
+
+
+# -------------------- LLM (no DB access) --------------------
+
+def _render_targets(plan: ReviewPlan, targets: List[Section], with_changes: bool) -> str:
+    previous = {c.section.hash: c.previous for c in plan.diff.changes if c.status == "changed"}
+    blocks = []
+    for s in targets:
+        block = f"### SECTION {s.index + 1}: {s.title}\n{s.text}"
+        prev = previous.get(s.hash) if with_changes else None
+        if prev is not None:
+            block += f"\n[Edited since the last review; changed lines:]\n{compact_diff(prev.text, s.text)}"
+        blocks.append(block)
+    return "\n\n".join(blocks)
+
+
+def _fit_chunk(plan: ReviewPlan, group: List[Section], with_changes: bool,
+               budget: int) -> List[Tuple[str, List[Section]]]:
+    """
+    Rendered criterion chunk as (text, sections) pieces of at most budget chars each.
+    A section that doesn't fit alone is sent without its change lines, then cut into parts.
+    """
+    blocks: List[Tuple[str, Section]] = []
+    for s in group:
+        block = _render_targets(plan, [s], with_changes)
+        if len(block) > budget:
+            block = _render_targets(plan, [s], False)
+        if len(block) <= budget:
+            blocks.append((block, s))
+            continue
+        header = f"### SECTION {s.index + 1}: {s.title}"
+        pieces = _split_long(s.text, budget - len(header) - 32)
+        blocks.extend((f"{header} (continued {k + 1}/{len(pieces)})\n{piece}", s)
+                      for k, piece in enumerate(pieces))
+
+    out: List[Tuple[str, List[Section]]] = []
+    cur: List[Tuple[str, Section]] = []
+    size = 0
+    for block, s in blocks:
+        if cur and size + len(block) > budget:
+            out.append(("\n\n".join(b for b, _ in cur), list({x.hash: x for _, x in cur}.values())))
+            cur, size = [], 0
+        cur.append((block, s))
+        size += len(block) + 2
+    if cur:
+        out.append(("\n\n".join(b for b, _ in cur), list({x.hash: x for _, x in cur}.values())))
+    return out
+
+
+def review_sections(
+    *,
+    ctx: ContextPack,
+    plan: ReviewPlan,
+    user_task: str,
+    llm_a: LLMClient,
+    llm_b: LLMClient,
+    judge: Optional[LLMClient] = None,
+    on_progress: Optional[Callable[[str], None]] = None,
+    max_prompt_chars: int = REVIEW_MAX_PROMPT_CHARS,
+    concurrency: int = MAPREDUCE_CONCURRENCY,
+) -> SectionedReview:
+    """
+    Section-aware review. Incremental: only the sections without cached findings
+    (edited/new ones) are reviewed, then fresh and cached findings are merged.
+    Otherwise the whole document is reviewed and the judge also answers per section,
+    which fills the cache for the next run.
+    If the reviewed text doesn't fit into one debate within max_prompt_chars, it goes
+    through map-reduce: criterion-aligned chunks reviewed in parallel, then a capped
+    hierarchical reduce into one verdict.
+    """
+    judge = judge or llm_a
+    if not plan.sections:
+        # Текста нет (или документ не указан) - обычный дебат без секций
+        outputs = debate(ctx=ctx, mode=RunMode.review, user_task=user_task, llm_a=llm_a, llm_b=llm_b,
+                         judge=judge, on_progress=on_progress)
+        return SectionedReview(outputs=outputs, fresh=[], reviewed=0, reused=0, incremental=False)
+
+    incremental = plan.incremental
+    targets = plan.to_review if incremental else plan.sections
+    task = user_task
+    if incremental:
+        task += (" Only the sections below were edited or added since the last review;"
+                 " the rest of the document was already reviewed.")
+
+    rendered = _render_targets(plan, targets, incremental)
+    base_len = len(_render_user_prompt(replace(ctx, document_text=""), task, mode=RunMode.review))
+    long_document = bool(targets) and base_len + len(rendered) + _DEBATE_OUTPUT_RESERVE > max_prompt_chars
+
+    prompt_extra = {
+        "review_strategy": "incremental" if incremental else ("map_reduce" if long_document else "sectioned"),
+        "base_version_id": plan.base_version_id,
+        "sections_total": len(plan.sections),
+        "sections_reviewed": len(targets),
+        "sections_cached": len(plan.sections) - len(targets),
+        "section_diff": plan.diff.summary(),
+        "context_hash": plan.context_hash,
+    }
+
+    overall = ""
+    section_findings: Dict[int, str] = {}
+    map_results: List[_MapResult] = []
+
+    if long_document:
+        chunk_budget = max(max_prompt_chars - base_len - _MAP_OUTPUT_RESERVE, 4000)
+        chunks = []
+        for k, (criterion, group) in enumerate(criterion_chunks(targets, chunk_budget)):
+            # Изменения и служебные заголовки могут не влезть в бюджет: кусок делится дальше, а не обрезается
+            pieces = _fit_chunk(plan, group, incremental, chunk_budget)
+            for j, (text, sections) in enumerate(pieces):
+                assert len(text) <= chunk_budget, (len(text), chunk_budget)
+                part = f"{k + 1}.{j + 1}" if len(pieces) > 1 else f"{k + 1}"
+                label = f"part {part}: {criterion}, sections {sections[0].index + 1}-{sections[-1].index + 1}"
+                chunks.append((label, text, sections))
+        prompt_extra["map_reduce"] = {"chunks": len(chunks), "max_prompt_chars": max_prompt_chars,
+                                      "concurrency": concurrency}
+
+        map_results = _map_chunks(ctx=ctx, chunks=chunks, user_task=task, llm_a=llm_a, llm_b=llm_b,
+                                  concurrency=concurrency, on_progress=on_progress)
+        for r in map_results:
+            # Секция, разрезанная на несколько кусков, получает выводы по каждому
+            for n, finding in r.findings.items():
+                section_findings[n] = f"{section_findings[n]}\n\n{finding}" if n in section_findings else finding
+
+        prompt_pack = {
+            "case_id": ctx.case_id,
+            "case_name": ctx.case_name,
+            "mode": RunMode.review.value,
+            "lock_mode": ctx.lock_mode,
+            "has_document_text": True,
+            "user_task": task,
+            "providers": {"a": llm_a.name, "b": llm_b.name, "judge": judge.name},
+            **prompt_extra,
+        }
+        outputs = DebateOutputs(
+            prompt_pack=prompt_pack,
+            inputs_hash=_hash_inputs(prompt_pack),
+            model_a_output="\n\n".join(f"=== {r.label} ===\n{r.analysis}" for r in map_results),
+            model_b_output="",
+            critique_a="",
+            critique_b="\n\n".join(f"=== {r.label} ===\n{r.critique}" for r in map_results),
+            judge_output="",
+        )
+    elif targets:
+        outputs = debate(
+            ctx=replace(ctx, document_text=rendered),
+            mode=RunMode.review,
+            user_task=task,
+            llm_a=llm_a,
+            llm_b=llm_b,
+            judge=judge,
+            on_progress=on_progress,
+            judge_system=SECTION_JUDGE_SYSTEM,
+            judge_sections=len(targets),
+            prompt_extra=prompt_extra,
+        )
+        if outputs.judgment is not None and outputs.judgment.sections:
+            overall, section_findings = render_judgment(outputs.judgment, with_sections=False), outputs.judgment.sections
+        else:
+            overall, section_findings = split_judge_output(outputs.judge_output)
+    else:
+        # Ничего не изменилось с прошлого ревью: дебаты не нужны, только сборка
+        prompt_pack = {
+            "case_id": ctx.case_id,
+            "mode": RunMode.review.value,
+            "user_task": user_task,
+            "providers": {"judge": judge.name},
+            **prompt_extra,
+        }
+        outputs = DebateOutputs(prompt_pack=prompt_pack, inputs_hash=_hash_inputs(prompt_pack),
+                                model_a_output="", model_b_output="", critique_a="", critique_b="",
+                                judge_output="")
+
+    fresh = [(s, section_findings[s.index + 1]) for s in targets if s.index + 1 in section_findings]
+    reduce_kwargs = dict(ctx=ctx, user_task=user_task, judge=judge, max_prompt_chars=max_prompt_chars,
+                         concurrency=concurrency, on_progress=on_progress)
+
+    if not incremental:
+        if long_document:
+            items = [f"=== {r.label} ===\n[Analyst]\n{r.analysis}\n[Critic]\n{r.critique}" for r in map_results]
+            final = reduce_findings(items=items, system=JUDGE_SYSTEM, **reduce_kwargs)
+            outputs.judge_output, outputs.judgment = final.text, final.judgment
+        else:
+            outputs.judge_output = overall
+        return SectionedReview(outputs=outputs, fresh=fresh, reviewed=len(targets), reused=0, incremental=False)
+
+    new_findings = {s.hash: text for s, text in fresh}
+    items = []
+    for s in plan.sections:
+        if s.hash in new_findings:
+            items.append(f"### SECTION {s.index + 1}: {s.title} [NEW]\n{new_findings[s.hash]}")
+        elif s.hash in plan.cached:
+            items.append(f"### SECTION {s.index + 1}: {s.title} [CACHED]\n{plan.cached[s.hash]}")
+        else:
+            items.append(f"### SECTION {s.index + 1}: {s.title} [NEW]\n{overall or '[no findings]'}")
+    if plan.diff.removed:
+        items.append("Removed since the last review: " + "; ".join(s.title for s in plan.diff.removed))
+
+    final = reduce_findings(items=items, system=MERGE_SYSTEM, **reduce_kwargs)
+    outputs.judge_output, outputs.judgment = final.text, final.judgment
+    return SectionedReview(outputs=outputs, fresh=fresh, reviewed=len(targets),
+                           reused=len(plan.sections) - len(targets), incremental=True)
@@ -0,0 +1,146 @@
+# app/core/singleflight.py
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.storage.db import engine
+
+# Сколько follower ждет чужой advisory lock, прежде чем выполнить запрос сам
+SINGLEFLIGHT_LOCK_TIMEOUT_S = int(os.getenv("SINGLEFLIGHT_LOCK_TIMEOUT_S", "180"))
+
+
+def flight_key(
+    command: str,
+    *,
+    case_id: Optional[int] = None,
+    document_version_id: Optional[int] = None,
+    corpus_version: Optional[str] = None,
+    extra: str = "",
+) -> str:
+    """
+    (command, case, document version, corpus version) -> stable key.
+    Pass None for parts the command's result does not depend on.
+    """
+    parts = [command, str(case_id or "-"), str(document_version_id or "-"), corpus_version or "-"]
+    if extra:
+        parts.append(hashlib.sha256(extra.encode("utf-8")).hexdigest()[:16])
+    return ":".join(parts)
+
+
+def advisory_key(key: str) -> int:
+    # pg_advisory_*lock принимает signed bigint
+    return int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big", signed=True)
+
+
+@dataclass
+class _Call:
+    done: threading.Event = field(default_factory=threading.Event)
+    result: Any = None
+    error: Optional[BaseException] = None
+    followers: int = 0
+
+
+@dataclass
+class FlightStats:
+    leaders: int = 0
+    coalesced: int = 0
+    lock_waits: int = 0
+    lock_timeouts: int = 0
+
+
+class SingleFlight:
+    """
+    Identical concurrent calls share one execution.
+
+    In-process: followers wait for the leader's result.
+    Across processes: leaders serialize on a Postgres advisory lock, so
+    fn must first re-check whatever shared store the previous holder filled
+    (e.g. the answer cache) before doing the expensive work.
+    """
+
+    def __init__(self, *, lock_timeout_s: int = SINGLEFLIGHT_LOCK_TIMEOUT_S, use_advisory_lock: bool = True) -> None:
+        self.lock_timeout_s = lock_timeout_s
+        self.use_advisory_lock = use_advisory_lock
+        self.stats = FlightStats()
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Returns (result, shared). shared=True if the result came from another caller's execution.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.stats.leaders += 1
+            else:
+                call.followers += 1
+                self.stats.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = self._run_locked(key, fn) if self.use_advisory_lock else fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def _run_locked(self, key: str, fn: Callable[[], Any]) -> Any:
+        # Отдельное соединение: лок живет до конца его транзакции и не зависит от сессии вызывающего
+        k = advisory_key(key)
+        with engine.connect() as conn:
+            try:
+                conn.execute(text(f"SET LOCAL lock_timeout = '{int(self.lock_timeout_s)}s'"))
+                if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:k)"), {"k": k}).scalar_one():
+                    with self._lock:
+                        self.stats.lock_waits += 1
+                    conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": k})
+            except Exception as e:
+                # Лидер в другом процессе завис - не ждем бесконечно, выполняем сами
+                print(f"[SingleFlight] lock wait for {key} gave up: {e}")
+                with self._lock:
+                    self.stats.lock_timeouts += 1
+                conn.rollback()
+                return fn()
+            try:
+                return fn()
+            finally:
+                conn.rollback()  # снимает xact lock
+
+    def format_stats(self) -> str:
+        with self._lock:
+            s = FlightStats(**vars(self.stats))
+        return (
+            f"Single-flight (this process): leaders={s.leaders} coalesced={s.coalesced} "
+            f"lock_waits={s.lock_waits} lock_timeouts={s.lock_timeouts}"
+        )
+
+
+_flight: Optional[SingleFlight] = None
+_flight_lock = threading.Lock()
+
+
+def get_singleflight() -> SingleFlight:
+    global _flight
+    with _flight_lock:
+        if _flight is None:
+            _flight = SingleFlight()
+        return _flight
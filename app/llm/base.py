@@ -15,6 +15,8 @@ class LLMClient:
     """
     Provider-agnostic interface.
     Implement generate() for OpenAI and Gemini.
+    extra["response_schema"] (+ "schema_name"): JSON schema the answer must follow
+    (enforced where the provider supports it, JSON mode otherwise).
     """
     name: str
 
@@ -41,6 +41,8 @@ class GeminiClient(LLMClient):
             config = GenerationConfig(
                 temperature=temperature,
                 max_output_tokens=max_output_tokens,
+                # JSON-режим; саму схему (с additionalProperties) Gemini не принимает - она в промпте
+                response_mime_type="application/json" if (extra or {}).get("response_schema") else None,
             )
 
             # Вызов генерации
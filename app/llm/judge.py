@@ -0,0 +1,275 @@
+# app/llm/judge.py
+from __future__ import annotations
+
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.criteria import CRITERIA
+from app.llm.base import LLMClient
+
+# 0 - судья отвечает свободным текстом, как раньше (вердикт все равно вытаскивается регэкспом)
+JUDGE_STRUCTURED = os.getenv("JUDGE_STRUCTURED", "1") == "1"
+# JSON многословнее текста: меньше этого лимита ответ с секциями обрезается и не парсится
+JUDGE_STRUCTURED_MIN_TOKENS = int(os.getenv("JUDGE_STRUCTURED_MIN_TOKENS", "1600"))
+# Сверх этого - на каждую секцию, по которой судья отвечает отдельно (SECTION_JUDGE_SYSTEM)
+JUDGE_TOKENS_PER_SECTION = int(os.getenv("JUDGE_TOKENS_PER_SECTION", "200"))
+
+VERDICTS = ("PASS", "NEEDS_WORK")
+SEVERITIES = ("high", "medium", "low")
+RISK_CRITERIA = tuple(CRITERIA) + ("general",)
+
+# OpenAI strict mode: все поля обязательны, лишних нет
+JUDGMENT_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": ["verdict", "confidence", "strengths", "risks", "next_steps", "sections"],
+    "properties": {
+        "verdict": {"type": "string", "enum": list(VERDICTS)},
+        "confidence": {"type": "number", "description": "0..1, how sure the verdict is"},
+        "strengths": {"type": "array", "items": {"type": "string"}},
+        "risks": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": ["text", "severity", "criterion", "sections"],
+                "properties": {
+                    "text": {"type": "string"},
+                    "severity": {"type": "string", "enum": list(SEVERITIES)},
+                    "criterion": {"type": "string", "enum": list(RISK_CRITERIA)},
+                    "sections": {"type": "array", "items": {"type": "integer"}},
+                },
+            },
+        },
+        "next_steps": {"type": "array", "items": {"type": "string"}},
+        "sections": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": ["index", "findings"],
+                "properties": {"index": {"type": "integer"}, "findings": {"type": "string"}},
+            },
+        },
+    },
+}
+
+STRUCTURED_OUTPUT_NOTE = f"""
+Output format: return ONLY one JSON object (no prose, no code fences) with these keys:
+- "verdict": "PASS" or "NEEDS_WORK"
+- "confidence": number from 0 to 1
+- "strengths": list of short strings
+- "risks": list of {{"text", "severity": "high"|"medium"|"low",
+  "criterion": one of {", ".join(RISK_CRITERIA)}, "sections": list of section numbers (may be empty)}}
+- "next_steps": list of at most 10 short strings
+- "sections": list of {{"index": section number, "findings": text}} - one entry per numbered
+  "SECTION <n>" when the instructions ask for per-section blocks, otherwise an empty list.
+"""
+
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.I)
+_VERDICT_RE = re.compile(r"verdict\W{0,6}(pass|needs[ _-]?work)", re.I)
+_HEADING_RE = re.compile(r"^\W*(?:\d\)\s*)?(strengths|risks|next steps)\b", re.I)
+_BULLET_RE = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+(.*\S)")
+
+
+class JudgmentError(ValueError):
+    pass
+
+
+@dataclass
+class RiskItem:
+    text: str
+    severity: str = "medium"
+    criterion: str = "general"
+    sections: List[int] = field(default_factory=list)
+
+
+@dataclass
+class Judgment:
+    verdict: str
+    confidence: Optional[float]
+    strengths: List[str] = field(default_factory=list)
+    risks: List[RiskItem] = field(default_factory=list)
+    next_steps: List[str] = field(default_factory=list)
+    # section number -> findings (SECTION_JUDGE_SYSTEM)
+    sections: Dict[int, str] = field(default_factory=dict)
+    source: str = "json"  # json | text (free-text answer, parsed best-effort)
+
+
+@dataclass
+class JudgeResult:
+    text: str
+    judgment: Optional[Judgment]
+
+
+# -------------------- parsing / validation --------------------
+
+def _str_list(value: Any, name: str) -> List[str]:
+    if not isinstance(value, list):
+        raise JudgmentError(f"'{name}' must be a list")
+    return [str(x).strip() for x in value if str(x).strip()]
+
+
+def validate_judgment(data: Any) -> Judgment:
+    if not isinstance(data, dict):
+        raise JudgmentError("judgment must be a JSON object")
+    verdict = str(data.get("verdict", "")).upper().replace(" ", "_")
+    if verdict not in VERDICTS:
+        raise JudgmentError(f"unknown verdict {data.get('verdict')!r}")
+    try:
+        confidence = min(1.0, max(0.0, float(data.get("confidence"))))
+    except (TypeError, ValueError):
+        raise JudgmentError("'confidence' must be a number") from None
+
+    risks = []
+    for item in data.get("risks") or []:
+        if not isinstance(item, dict) or not str(item.get("text", "")).strip():
+            raise JudgmentError("each risk needs a 'text'")
+        severity = str(item.get("severity", "")).lower()
+        criterion = str(item.get("criterion", "")).lower()
+        risks.append(RiskItem(
+            text=str(item["text"]).strip(),
+            severity=severity if severity in SEVERITIES else "medium",
+            criterion=criterion if criterion in RISK_CRITERIA else "general",
+            sections=[int(n) for n in item.get("sections") or [] if isinstance(n, (int, float))],
+        ))
+
+    sections: Dict[int, str] = {}
+    for item in data.get("sections") or []:
+        if isinstance(item, dict) and isinstance(item.get("index"), (int, float)) and str(item.get("findings", "")).strip():
+            sections[int(item["index"])] = str(item["findings"]).strip()
+
+    return Judgment(
+        verdict=verdict,
+        confidence=confidence,
+        strengths=_str_list(data.get("strengths") or [], "strengths"),
+        risks=risks,
+        next_steps=_str_list(data.get("next_steps") or [], "next_steps")[:10],
+        sections=sections,
+    )
+
+
+def parse_judgment(text: str) -> Judgment:
+    raw = _FENCE_RE.sub("", (text or "").strip())
+    start, end = raw.find("{"), raw.rfind("}")
+    if start < 0 or end <= start:
+        raise JudgmentError("no JSON object in the answer")
+    try:
+        data = json.loads(raw[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise JudgmentError(f"invalid JSON: {e}") from None
+    return validate_judgment(data)
+
+
+def parse_text_judgment(text: str) -> Optional[Judgment]:
+    """
+    Best effort for a free-text "Verdict/Strengths/Risks/Next steps" answer (old runs,
+    providers that ignored the format). No confidence; every risk is "medium"/"general".
+    """
+    m = _VERDICT_RE.search(text or "")
+    if not m:
+        return None
+    j = Judgment(verdict="PASS" if m.group(1).lower() == "pass" else "NEEDS_WORK", confidence=None, source="text")
+    current: Optional[str] = None
+    for line in (text or "").splitlines():
+        h = _HEADING_RE.match(line)
+        if h:
+            current = h.group(1).lower()
+            continue
+        b = _BULLET_RE.match(line)
+        if not b or current is None:
+            continue
+        if current == "strengths":
+            j.strengths.append(b.group(1))
+        elif current == "risks":
+            j.risks.append(RiskItem(text=b.group(1)))
+        elif len(j.next_steps) < 10:
+            j.next_steps.append(b.group(1))
+    return j
+
+
+def render_judgment(j: Judgment, *, with_sections: bool = True) -> str:
+    """
+    The classic Verdict/Strengths/Risks/Next steps text (what users see and judge_output
+    stores). Per-section findings come out as "### SECTION <n>" blocks, as SECTION_JUDGE_SYSTEM asks.
+    """
+    verdict = j.verdict.replace("_", " ")
+    if j.confidence is not None:
+        verdict += f" (confidence {j.confidence:.2f})"
+    parts = [f"1) Verdict: {verdict}", "", "2) Strengths"]
+    parts += [f"- {s}" for s in j.strengths] or ["- none noted"]
+    parts += ["", "3) Risks"]
+    for r in j.risks:
+        where = f" (sections {', '.join(map(str, r.sections))})" if r.sections else ""
+        parts.append(f"- [{r.severity}, {r.criterion}] {r.text}{where}")
+    if not j.risks:
+        parts.append("- none noted")
+    parts += ["", "4) Next steps"]
+    parts += [f"- {s}" for s in j.next_steps] or ["- none"]
+    if with_sections:
+        for n in sorted(j.sections):
+            parts += ["", f"### SECTION {n}", j.sections[n]]
+    return "\n".join(parts)
+
+
+# -------------------- call --------------------
+
+def judge_call(
+    judge: LLMClient,
+    *,
+    system: str,
+    user: str,
+    temperature: float = 0.2,
+    max_output_tokens: int = 900,
+    structured: bool = JUDGE_STRUCTURED,
+    sections: int = 0,
+) -> JudgeResult:
+    """
+    Final judge step. Asks for JSON matching JUDGMENT_SCHEMA (enforced where the provider
+    supports it), validates it and renders the usual text. `sections` is how many per-section
+    blocks the answer must hold; the output budget grows with it.
+    An answer that doesn't validate (e.g. JSON cut off at the token limit) is asked again
+    once as free text; raw JSON never becomes the judge output.
+    """
+    max_output_tokens += sections * JUDGE_TOKENS_PER_SECTION
+
+    def free_text() -> Tuple[JudgeResult, bool]:
+        res = judge.generate(system=system, user=user, temperature=temperature, max_output_tokens=max_output_tokens)
+        text = res.text or ""
+        if res.meta.get("error"):
+            return JudgeResult(text=text, judgment=None), False
+        return JudgeResult(text=text, judgment=parse_text_judgment(text)), bool(text.strip())
+
+    if not structured:
+        return free_text()[0]
+
+    res = judge.generate(
+        system=system + STRUCTURED_OUTPUT_NOTE,
+        user=user,
+        temperature=temperature,
+        max_output_tokens=max(max_output_tokens, JUDGE_STRUCTURED_MIN_TOKENS + sections * JUDGE_TOKENS_PER_SECTION),
+        extra={"response_schema": JUDGMENT_SCHEMA, "schema_name": "eb1a_judgment"},
+    )
+    text = res.text or ""
+    if res.meta.get("error"):
+        return JudgeResult(text=text, judgment=None)
+    try:
+        judgment = parse_judgment(text)
+    except JudgmentError as e:
+        print(f"[Judge] structured output rejected ({e}); asking again as free text")
+        retry, ok = free_text()
+        if ok:
+            return retry
+        # Повтор тоже не удался - показываем то, что удалось вытащить, а не сырой JSON
+        partial = parse_text_judgment(text)
+        if partial is None:
+            return retry
+        return JudgeResult(
+            text=f"1) Verdict: {partial.verdict.replace('_', ' ')}\n\n"
+                 f"(The judge's answer could not be read in full; only the verdict was recovered.)",
+            judgment=partial,
+        )
+    return JudgeResult(text=render_judgment(judgment), judgment=judgment)
@@ -41,12 +41,22 @@ class OpenAIClient(LLMClient):
 
             # Делаем синхронный вызов (для FastAPI лучше асинхронный,
             # но в текущей архитектуре методы синхронные, оставляем так для простоты)
+            kwargs: Dict[str, Any] = {}
+            schema = (extra or {}).get("response_schema")
+            if schema:
+                # Structured Outputs: ответ гарантированно соответствует схеме
+                kwargs["response_format"] = {
+                    "type": "json_schema",
+                    "json_schema": {"name": extra.get("schema_name", "response"), "schema": schema, "strict": True},
+                }
+
             response = self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 temperature=temperature,
                 max_tokens=max_output_tokens,
                 timeout=timeout_s,
+                **kwargs,
             )
 
             content = response.choices[0].message.content or ""
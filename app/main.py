@@ -2,6 +2,7 @@
 import sys
 import os
 import time
+import functools
 import telebot
 from dotenv import load_dotenv
 
@@ -17,8 +18,22 @@ if root_dir not in sys.path:
 
 # 2. ТОЛЬКО ТЕПЕРЬ импортируем модули приложения
 from app.storage.db import db_session
-from app.telegram.commands import set_active_case, cmd_review_document
-from app.telegram.commands_rag import cmd_requirements, cmd_fees, cmd_filing, cmd_premium
+from app.telegram.commands import (
+    set_active_case,
+    cmd_checkpoint,
+    cmd_enqueue_review,
+    cmd_history,
+    cmd_ingest_upload,
+    cmd_open_run,
+    cmd_restore,
+    parse_history_data,
+)
+from app.telegram.commands_rag import cmd_requirements, cmd_fees, cmd_filing, cmd_premium, cmd_ask, cmd_cache_stats
+from app.telegram.admission import AdmissionRejected, get_admission
+from app.telegram.outbox import Outbox
+from app.storage.files import BlobTooLarge
+from app.telegram.uploads import TELEGRAM_DOWNLOAD_LIMIT, download_to_store
+from app.utils.text_extract import UnsupportedFileType, detect_kind
 
 # Инициализация бота
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -26,9 +41,45 @@ if not TELEGRAM_BOT_TOKEN:
     print("Error: TELEGRAM_BOT_TOKEN not found in .env")
     sys.exit(1)
 
-bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN)
+# Чаты, которым доступны служебные команды (/askstats): через запятую. Пусто - никому
+ADMIN_CHAT_IDS = {c.strip() for c in os.getenv("ADMIN_CHAT_IDS", "").split(",") if c.strip()}
+
+# polling | webhook | sharded
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+if BOT_MODE in ("webhook", "sharded") and not os.getenv("TELEGRAM_WEBHOOK_SECRET"):
+    print(f"Error: TELEGRAM_WEBHOOK_SECRET not found in .env (required for BOT_MODE={BOT_MODE})")
+    sys.exit(1)
+
+# В webhook-режиме хендлеры выполняются в пуле UpdateDispatcher, собственный пул TeleBot не нужен
+bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN, threaded=(BOT_MODE == "polling"))
+
+# Все ответы уходят через очередь отправки: лимиты Telegram, 429, разбиение длинных текстов
+outbox = Outbox(bot)
 
-print("--- EB-1A Bot (Polling Mode) Started ---")
+
+def admitted(lane: str):
+    """
+    Admission control for expensive handlers: the handler runs on the admission pool
+    (per-chat and global caps, a bounded wait queue with the RAG lane first), so the
+    thread that received the update is free at once. Replies with the queue position
+    or the reason for rejection.
+    """
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(message):
+            def on_queued(position: int) -> None:
+                outbox.reply(message, f"⏳ Много запросов, вы в очереди: позиция {position}.", parse_mode=None)
+
+            def on_rejected(reason: str) -> None:
+                outbox.reply(message, reason, parse_mode=None)
+
+            try:
+                get_admission().submit(str(message.chat.id), lane, functools.partial(fn, message),
+                                       on_queued=on_queued, on_rejected=on_rejected)
+            except AdmissionRejected as e:
+                outbox.reply(message, str(e), parse_mode=None)
+        return wrapper
+    return deco
 
 
 # --- Обработчики команд ---
@@ -39,46 +90,81 @@ def send_welcome(message):
         "Привет! Я AI-ассистент по EB-1A.\n\n"
         "**Команды управления:**\n"
         "`/case use <Name>` - Выбрать активный кейс (из cases.json)\n"
-        "`/review <DocTitle>` - Проверить документ\n\n"
+        "`/review <DocTitle>` - Проверить документ\n"
+        "`/checkpoint <label>` - Сохранить состояние кейса (мемо, экспонаты, версии документов)\n"
+        "`/restore [id]` - Список чекпоинтов / откат кейса к чекпоинту\n"
+        "`/history` - Прошлые прогоны кейса (с листанием)\n"
+        "Пришлите PDF/DOCX/TXT файлом - он станет новой версией документа "
+        "(название - из подписи к файлу или имени файла)\n\n"
         "**Справочные команды (RAG):**\n"
+        "`/ask <вопрос>` - Свободный вопрос по официальным источникам\n"
         "`/requirements` - Критерии EB-1A\n"
         "`/fees` - Пошлины\n"
         "`/filing` - Адреса подачи\n"
         "`/premium` - Премиум процессинг"
     )
-    bot.reply_to(message, welcome_text, parse_mode="Markdown")
+    outbox.reply(message, welcome_text, parse_mode="Markdown")
 
 
 @bot.message_handler(commands=['requirements'])
+@admitted("rag")
 def handle_requirements(message):
     bot.send_chat_action(message.chat.id, 'typing')
     with db_session() as session:
         resp = cmd_requirements(session, str(message.chat.id))
-        bot.reply_to(message, resp, parse_mode="Markdown")
+        outbox.reply(message, resp, parse_mode="Markdown")
 
 
 @bot.message_handler(commands=['fees'])
+@admitted("rag")
 def handle_fees(message):
     bot.send_chat_action(message.chat.id, 'typing')
     with db_session() as session:
         resp = cmd_fees(session, str(message.chat.id))
-        bot.reply_to(message, resp, parse_mode="Markdown")
+        outbox.reply(message, resp, parse_mode="Markdown")
 
 
 @bot.message_handler(commands=['filing'])
+@admitted("rag")
 def handle_filing(message):
     bot.send_chat_action(message.chat.id, 'typing')
     with db_session() as session:
         resp = cmd_filing(session, str(message.chat.id))
-        bot.reply_to(message, resp, parse_mode="Markdown")
+        outbox.reply(message, resp, parse_mode="Markdown")
 
 
 @bot.message_handler(commands=['premium'])
+@admitted("rag")
 def handle_premium(message):
     bot.send_chat_action(message.chat.id, 'typing')
     with db_session() as session:
         resp = cmd_premium(session, str(message.chat.id))
-        bot.reply_to(message, resp, parse_mode="Markdown")
+        outbox.reply(message, resp, parse_mode="Markdown")
+
+
+@bot.message_handler(commands=['ask'])
+@admitted("rag")
+def handle_ask(message):
+    parts = message.text.strip().split(maxsplit=1)
+    if len(parts) < 2 or not parts[1].strip():
+        outbox.reply(message, "Формат: `/ask <вопрос>`\nПример: `/ask Можно ли использовать членство в жюри?`",
+                     parse_mode="Markdown")
+        return
+    bot.send_chat_action(message.chat.id, 'typing')
+    with db_session() as session:
+        resp = cmd_ask(session, str(message.chat.id), parts[1].strip())
+        outbox.reply(message, resp, parse_mode="Markdown")
+
+
+@bot.message_handler(commands=['askstats'])
+def handle_ask_stats(message):
+    # Внутренняя статистика кеша и очередей - не для пользователей бота
+    if str(message.chat.id) not in ADMIN_CHAT_IDS:
+        print(f"[Bot] /askstats from non-admin chat {message.chat.id} ignored")
+        return
+    with db_session() as session:
+        stats = f"{cmd_cache_stats(session)}\n{get_admission().format_stats()}"
+        outbox.reply(message, stats, parse_mode=None)
 
 
 @bot.message_handler(commands=['case'])
@@ -86,14 +172,63 @@ def handle_case_use(message):
     text = message.text.strip()
     prefix = "/case use "
     if not text.startswith(prefix):
-        bot.reply_to(message, "Формат: `/case use <Case Name>`\nПример: `/case use Owner Four Kings`",
+        outbox.reply(message, "Формат: `/case use <Case Name>`\nПример: `/case use Owner Four Kings`",
                      parse_mode="Markdown")
         return
     case_name = text[len(prefix):].strip()
 
     with db_session() as session:
         resp = set_active_case(session, str(message.chat.id), case_name)
-        bot.reply_to(message, resp)
+        outbox.reply(message, resp, parse_mode=None)
+
+
+@bot.message_handler(commands=['checkpoint'])
+def handle_checkpoint(message):
+    parts = message.text.strip().split(maxsplit=1)
+    label = parts[1].strip() if len(parts) > 1 else ""
+    try:
+        with db_session() as session:
+            resp = cmd_checkpoint(session, str(message.chat.id), label)
+        outbox.reply(message, resp, parse_mode=None)
+    except Exception as e:
+        outbox.reply(message, f"Ошибка: {e}", parse_mode=None)
+
+
+@bot.message_handler(commands=['restore'])
+def handle_restore(message):
+    parts = message.text.strip().split(maxsplit=1)
+    arg = parts[1].strip() if len(parts) > 1 else ""
+    try:
+        with db_session() as session:
+            resp = cmd_restore(session, str(message.chat.id), arg)
+        outbox.reply(message, resp, parse_mode=None)
+    except Exception as e:
+        outbox.reply(message, f"Ошибка: {e}", parse_mode=None)
+
+
+@bot.message_handler(commands=['history'])
+def handle_history(message):
+    with db_session() as session:
+        resp, markup = cmd_history(session, str(message.chat.id))
+    outbox.reply(message, resp, parse_mode=None, reply_markup=markup)
+
+
+@bot.callback_query_handler(func=lambda call: (call.data or "").startswith(("hist:", "run:")))
+def handle_history_callback(call):
+    bot.answer_callback_query(call.id)
+    chat_id = call.message.chat.id
+    try:
+        with db_session() as session:
+            if call.data.startswith("run:"):
+                resp = cmd_open_run(session, str(chat_id), int(call.data[len("run:"):]))
+                outbox.send(chat_id, resp, parse_mode=None)
+                return
+            case_id, before = parse_history_data(call.data)
+            resp, markup = cmd_history(session, str(chat_id), case_id=case_id, before=before)
+        # Листание - правкой того же сообщения, без новых сообщений в чате
+        outbox.edit(chat_id, call.message.message_id, resp, reply_markup=markup)
+    except Exception as e:
+        outbox.send(chat_id, f"Ошибка: {e}", parse_mode=None)
 
 
 @bot.message_handler(commands=['review'])
@@ -101,27 +236,105 @@ def handle_review(message):
     text = message.text.strip()
     prefix = "/review "
     if not text.startswith(prefix):
-        bot.reply_to(message, "Формат: `/review <Doc Title>`", parse_mode="Markdown")
+        outbox.reply(message, "Формат: `/review <Doc Title>`", parse_mode="Markdown")
         return
     doc_title = text[len(prefix):].strip()
 
-    bot.reply_to(message, f"🔍 Анализирую документ '{doc_title}'...")
-    bot.send_chat_action(message.chat.id, 'typing')
+    # message_id статус-сообщения нужен воркеру, чтобы редактировать его по ходу дебата
+    try:
+        status = outbox.reply(message, f"🔍 Ставлю документ '{doc_title}' в очередь...",
+                              parse_mode=None).result(timeout=30)[0]
+    except Exception as e:
+        print(f"[Bot] status message failed: {e}")
+        status = None
+
+    # Сам анализ идет в воркере (scripts/run_worker.py), хендлер только ставит задачу
+    try:
+        with db_session() as session:
+            resp = cmd_enqueue_review(session, str(message.chat.id), doc_title,
+                                      status_message_id=status.message_id if status else None)
+        if status:
+            outbox.edit(message.chat.id, status.message_id, resp)
+        else:
+            outbox.reply(message, resp, parse_mode=None)
+    except Exception as e:
+        outbox.reply(message, f"Ошибка: {e}", parse_mode=None)
+
+
+@bot.message_handler(content_types=['document'])
+@admitted("ingest")
+def handle_document(message):
+    doc = message.document
+    filename = doc.file_name or "document"
+    try:
+        detect_kind(filename)
+    except UnsupportedFileType as e:
+        outbox.reply(message, f"❌ {e}", parse_mode=None)
+        return
+    if doc.file_size and doc.file_size > TELEGRAM_DOWNLOAD_LIMIT:
+        outbox.reply(message, "❌ Файл больше 20 МБ - Telegram не отдает такие файлы ботам.", parse_mode=None)
+        return
 
+    title = (message.caption or os.path.splitext(filename)[0]).strip()[:240]
+    outbox.reply(message, f"📥 Получил '{filename}', извлекаю текст...", parse_mode=None)
     try:
+        ref = download_to_store(bot, doc.file_id)
         with db_session() as session:
-            resp = cmd_review_document(session, str(message.chat.id), doc_title)
-            # Разбиваем длинные сообщения (Telegram лимит 4096)
-            if len(resp) > 4000:
-                for x in range(0, len(resp), 4000):
-                    bot.send_message(message.chat.id, resp[x:x + 4000], parse_mode="Markdown")
-            else:
-                bot.reply_to(message, resp, parse_mode="Markdown")
+            result = cmd_ingest_upload(
+                session, str(message.chat.id),
+                title=title, ref=ref, filename=filename,
+                created_by=f"telegram:{message.from_user.id}", content_type=doc.mime_type or "",
+            )
+    except BlobTooLarge:
+        outbox.reply(message, "❌ Файл больше 20 МБ - Telegram не отдает такие файлы ботам.", parse_mode=None)
+        return
     except Exception as e:
-        bot.reply_to(message, f"Ошибка: {e}")
+        outbox.reply(message, f"Ошибка: {e}", parse_mode=None)
+        return
+
+    # Извлечение идет в пуле процессов; ответ придет, когда версия сохранена
+    if isinstance(result, str):
+        outbox.reply(message, result, parse_mode=None)
+    else:
+        result.add_done_callback(lambda f: outbox.reply(message, f.result(), parse_mode=None))
+
+
+def create_shard_bot():
+    """
+    Bot factory for shard processes (BOT_MODE=sharded, see app/telegram/sharded.py).
+    """
+    from app.storage.db import engine
+
+    outbox.start()
+
+    def on_stop() -> None:
+        get_admission().drain()
+        outbox.stop()
+        engine.dispose()
+
+    return bot, on_stop
 
 
 if __name__ == "__main__":
+    if BOT_MODE == "sharded":
+        from app.telegram.sharded import run_sharded
+
+        print("--- EB-1A Bot (Sharded Webhook Mode) Started ---")
+        run_sharded(TELEGRAM_BOT_TOKEN)
+        sys.exit(0)
+
+    outbox.start()
+
+    if BOT_MODE == "webhook":
+        from app.telegram.webhook import run_webhook
+
+        print("--- EB-1A Bot (Webhook Mode) Started ---")
+        run_webhook(bot)
+        get_admission().drain()
+        outbox.stop()
+        sys.exit(0)
+
+    print("--- EB-1A Bot (Polling Mode) Started ---")
     while True:
         try:
             bot.infinity_polling(timeout=10, long_polling_timeout=5)
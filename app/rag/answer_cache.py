@@ -0,0 +1,169 @@
+# app/rag/answer_cache.py
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import select, func, delete, update
+from sqlalchemy.orm import Session
+
+from app.rag.models import RagChunk, RagAnswerCache
+
+# Косинусное сходство, начиная с которого вопрос считаем перефразом закешированного
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.93"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+ANSWER_CACHE_TTL_DAYS = int(os.getenv("ANSWER_CACHE_TTL_DAYS", "30"))
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+_stats = CacheStats()
+_stats_lock = threading.Lock()
+
+
+def _bump(**deltas: int) -> None:
+    with _stats_lock:
+        for k, v in deltas.items():
+            setattr(_stats, k, getattr(_stats, k) + v)
+
+
+def kind_key(kind_filter: Optional[List[str]]) -> str:
+    return ",".join(sorted(set(kind_filter or [])))
+
+
+def corpus_version(session: Session, kind_filter: Optional[List[str]]) -> str:
+    """
+    Cheap fingerprint of the indexed chunks for these kinds: any re-index
+    (insert, update or delete) changes count or max(updated_at).
+    """
+    stmt = select(func.count(RagChunk.id), func.max(RagChunk.updated_at))
+    if kind_filter:
+        stmt = stmt.where(RagChunk.kind.in_(kind_filter))
+    count, last = session.execute(stmt).one()
+    raw = f"{count}|{last.isoformat() if last else ''}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def lookup(
+    session: Session,
+    *,
+    embedding: List[float],
+    kind_filter: Optional[List[str]],
+    version: str,
+    record_miss: bool = True,
+) -> Optional[str]:
+    distance = RagAnswerCache.question_embedding.cosine_distance(embedding)
+    cutoff = datetime.utcnow() - timedelta(days=ANSWER_CACHE_TTL_DAYS)
+    row = session.execute(
+        select(RagAnswerCache.id, RagAnswerCache.answer, distance.label("distance"))
+        .where(
+            RagAnswerCache.kind_key == kind_key(kind_filter),
+            RagAnswerCache.corpus_version == version,
+            RagAnswerCache.created_at >= cutoff,
+        )
+        .order_by(distance)
+        .limit(1)
+    ).one_or_none()
+
+    if row is None or row.distance > 1.0 - ANSWER_CACHE_SIMILARITY:
+        if record_miss:
+            _bump(misses=1)
+        return None
+
+    session.execute(
+        update(RagAnswerCache)
+        .where(RagAnswerCache.id == row.id)
+        .values(hits=RagAnswerCache.hits + 1, last_hit_at=datetime.utcnow())
+    )
+    _bump(hits=1)
+    return row.answer
+
+
+def store(
+    session: Session,
+    *,
+    question: str,
+    embedding: List[float],
+    kind_filter: Optional[List[str]],
+    version: str,
+    answer: str,
+) -> None:
+    session.add(RagAnswerCache(
+        kind_key=kind_key(kind_filter),
+        corpus_version=version,
+        question=question,
+        question_embedding=embedding,
+        answer=answer,
+    ))
+    session.flush()
+    _bump(stores=1)
+    _evict(session)
+
+
+def _evict(session: Session) -> None:
+    """
+    TTL first, then LRU by last_hit_at down to ANSWER_CACHE_MAX_ENTRIES.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=ANSWER_CACHE_TTL_DAYS)
+    n = session.execute(delete(RagAnswerCache).where(RagAnswerCache.created_at < cutoff)).rowcount or 0
+
+    total = session.execute(select(func.count(RagAnswerCache.id))).scalar_one()
+    overflow = total - ANSWER_CACHE_MAX_ENTRIES
+    if overflow > 0:
+        oldest = (
+            select(RagAnswerCache.id)
+            .order_by(RagAnswerCache.last_hit_at.asc())
+            .limit(overflow)
+            .scalar_subquery()
+        )
+        n += session.execute(delete(RagAnswerCache).where(RagAnswerCache.id.in_(oldest))).rowcount or 0
+    if n:
+        _bump(evictions=n)
+
+
+def invalidate_stale(session: Session) -> int:
+    """
+    Call after re-indexing: drops entries built against an older corpus version.
+    """
+    removed = 0
+    for key in session.execute(select(RagAnswerCache.kind_key).distinct()).scalars().all():
+        version = corpus_version(session, key.split(",") if key else None)
+        removed += session.execute(
+            delete(RagAnswerCache).where(
+                RagAnswerCache.kind_key == key,
+                RagAnswerCache.corpus_version != version,
+            )
+        ).rowcount or 0
+    if removed:
+        _bump(invalidations=removed)
+    return removed
+
+
+def format_stats(session: Session) -> str:
+    with _stats_lock:
+        s = CacheStats(**vars(_stats))
+    entries, total_hits = session.execute(
+        select(func.count(RagAnswerCache.id), func.coalesce(func.sum(RagAnswerCache.hits), 0))
+    ).one()
+    return (
+        f"Answer cache (this process): hits={s.hits} misses={s.misses} "
+        f"hit_rate={s.hit_rate:.0%} stores={s.stores} evictions={s.evictions} "
+        f"invalidations={s.invalidations}\n"
+        f"Stored: {entries} entries, {total_hits} hits total"
+    )
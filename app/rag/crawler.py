@@ -0,0 +1,259 @@
+# app/rag/crawler.py
+from __future__ import annotations
+
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.rag.fetcher import SourceFetcher, FetchResult
+from app.rag.indexer import FetchedPage, parse_page, upsert_page_into_rag, make_chunk_prefix
+from app.rag.models import CrawlFrontier
+
+# Сколько живет захват страницы: fetch + парсинг + эмбеддинги одной страницы укладываются с запасом.
+# Дольше - процесс, скорее всего, упал, и страницу можно отдать другому
+CRAWL_LEASE_S = int(os.getenv("CRAWL_LEASE_S", "900"))
+
+
+@dataclass
+class CrawlRule:
+    kind: str
+    pattern: re.Pattern
+    max_depth: int
+
+
+@dataclass
+class CrawlStats:
+    fetched: int = 0
+    not_modified: int = 0
+    failed: int = 0
+    discovered: int = 0
+    chunks: int = 0
+
+
+# (frontier id, url, kind, depth, attempts)
+_Claim = Tuple[int, str, str, int, int]
+# (session, kind, page) -> chunks written
+IndexPage = Callable[[Session, str, FetchedPage], int]
+
+
+def index_into_rag(session: Session, kind: str, page: FetchedPage) -> int:
+    return upsert_page_into_rag(session, kind=kind, page=page, chunk_prefix=make_chunk_prefix(kind, page.url))
+
+
+def compile_rules(rules: Iterable[Dict[str, Any]]) -> List[CrawlRule]:
+    return [
+        CrawlRule(kind=r["kind"], pattern=re.compile(r["pattern"]), max_depth=int(r.get("max_depth", 1)))
+        for r in rules
+    ]
+
+
+def match_rule(url: str, rules: List[CrawlRule]) -> Optional[CrawlRule]:
+    for rule in rules:
+        if rule.pattern.search(url):
+            return rule
+    return None
+
+
+class Crawler:
+    """
+    Frontier-driven crawler on top of SourceFetcher + parse_page.
+
+    - The frontier lives in `rag_crawl_frontier`; rows are claimed with
+      FOR UPDATE SKIP LOCKED and a `claimed_at` lease, so several crawler
+      processes can share it and only expired claims are recovered.
+    - Fetches run in the fetcher's thread pool (per-host limits and politeness
+      delay are enforced there); parsing, link discovery and DB writes stay on this thread.
+    - Every page is upserted into the RAG index and committed on its own,
+      so nothing accumulates in memory and a crash loses at most in-flight pages.
+
+    scripts/check_crawler.py runs it against the static site in bench/fixtures/site.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        *,
+        fetcher: SourceFetcher,
+        rules: List[CrawlRule],
+        max_depth: Optional[int] = None,
+        max_pages: Optional[int] = None,
+        max_attempts: int = 3,
+        lease_s: int = CRAWL_LEASE_S,
+        index_page: IndexPage = index_into_rag,
+    ) -> None:
+        self.session = session
+        self.fetcher = fetcher
+        self.rules = rules
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.max_attempts = max_attempts
+        self.lease_s = lease_s
+        self.index_page = index_page
+        self.stats = CrawlStats()
+
+    # -------------------- frontier --------------------
+
+    def _depth_limit(self, rule: CrawlRule) -> int:
+        if self.max_depth is None:
+            return rule.max_depth
+        return min(rule.max_depth, self.max_depth)
+
+    def recover(self) -> int:
+        """
+        Return pages orphaned by a crash to the queue: in_progress rows whose lease
+        expired. Live claims of other crawler processes are left alone.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=self.lease_s)
+        res = self.session.execute(
+            update(CrawlFrontier)
+            .where(
+                CrawlFrontier.status == "in_progress",
+                # Строки до появления claimed_at считаем просроченными
+                or_(CrawlFrontier.claimed_at.is_(None), CrawlFrontier.claimed_at < cutoff),
+            )
+            .values(status="pending", claimed_at=None)
+        )
+        self.session.commit()
+        return res.rowcount or 0
+
+    def recrawl(self) -> int:
+        """
+        Re-queue finished pages; conditional GET makes unchanged ones cheap.
+        """
+        res = self.session.execute(
+            update(CrawlFrontier)
+            .where(CrawlFrontier.status.in_(["done", "failed"]))
+            .values(status="pending", attempts=0, last_error="")
+        )
+        self.session.commit()
+        return res.rowcount or 0
+
+    def _enqueue(self, urls: Iterable[str], *, depth: int, parent_url: Optional[str]) -> int:
+        rows = []
+        for url in urls:
+            if len(url) > 800:
+                continue
+            rule = match_rule(url, self.rules)
+            if not rule or depth > self._depth_limit(rule):
+                continue
+            rows.append({"url": url, "kind": rule.kind, "depth": depth, "parent_url": parent_url})
+        if not rows:
+            return 0
+        stmt = pg_insert(CrawlFrontier).values(rows).on_conflict_do_nothing(index_elements=["url"])
+        res = self.session.execute(stmt)
+        return res.rowcount or 0
+
+    def seed(self, urls: Iterable[str]) -> int:
+        urls = list(urls)
+        for url in urls:
+            if not match_rule(url, self.rules):
+                print(f"[Crawler] Seed does not match any allow rule, ignored: {url}")
+        n = self._enqueue(urls, depth=0, parent_url=None)
+        self.session.commit()
+        return n
+
+    def _claim(self, limit: int) -> List[_Claim]:
+        rows = self.session.execute(
+            select(CrawlFrontier)
+            .where(CrawlFrontier.status == "pending")
+            .order_by(CrawlFrontier.depth.asc(), CrawlFrontier.id.asc())
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+        claimed = []
+        now = datetime.utcnow()
+        for r in rows:
+            r.status = "in_progress"
+            r.claimed_at = now
+            r.attempts += 1
+            claimed.append((r.id, r.url, r.kind, r.depth, r.attempts))
+        self.session.commit()
+        return claimed
+
+    def pending_count(self) -> int:
+        return self.session.execute(
+            select(func.count()).select_from(CrawlFrontier).where(CrawlFrontier.status == "pending")
+        ).scalar_one()
+
+    # -------------------- processing --------------------
+
+    def _mark(self, frontier_id: int, **values: Any) -> None:
+        self.session.execute(
+            update(CrawlFrontier).where(CrawlFrontier.id == frontier_id).values(**values)
+        )
+        self.session.commit()
+
+    def _handle(self, claim: _Claim, res: FetchResult) -> None:
+        frontier_id, url, kind, depth, attempts = claim
+
+        if res.error:
+            self.stats.failed += 1
+            status = "failed" if attempts >= self.max_attempts else "pending"
+            self._mark(frontier_id, status=status, last_error=res.error[:2000])
+            print(f"[Crawler] ERROR {url}: {res.error}")
+            return
+
+        html = res.html
+        if res.not_modified:
+            # Тело берем из кеша только ради ссылок; в индекс страница не идет
+            entry = self.fetcher.cache.get(url)
+            html = self.fetcher.cache.read_body(entry) if entry else ""
+
+        try:
+            page = parse_page(url, html or "", last_updated=res.last_modified)
+            self.stats.discovered += self._enqueue(page.links, depth=depth + 1, parent_url=url)
+
+            if res.not_modified:
+                self.stats.not_modified += 1
+            else:
+                n = self.index_page(self.session, kind, page)
+                self.stats.fetched += 1
+                self.stats.chunks += n
+                print(f"[Crawler] [{kind}] d={depth} {url} -> {n} chunks")
+
+            self.session.execute(
+                update(CrawlFrontier)
+                .where(CrawlFrontier.id == frontier_id)
+                .values(status="done", last_error="", raw_hash=page.raw_hash)
+            )
+            self.session.commit()
+            self.fetcher.commit(url)
+        except Exception as e:
+            self.session.rollback()
+            self.stats.failed += 1
+            status = "failed" if attempts >= self.max_attempts else "pending"
+            self._mark(frontier_id, status=status, last_error=str(e)[:2000])
+            print(f"[Crawler] ERROR processing {url}: {e}")
+
+    def run(self) -> CrawlStats:
+        workers = max(1, self.fetcher.max_workers)
+        in_flight: Dict[Future, _Claim] = {}
+        claimed_total = 0
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                # Держим пул занятым, но не забираем из frontier больше, чем можем обработать
+                room = workers - len(in_flight)
+                if self.max_pages is not None:
+                    room = min(room, self.max_pages - claimed_total)
+                if room > 0:
+                    for claim in self._claim(room):
+                        in_flight[pool.submit(self.fetcher.fetch, claim[1])] = claim
+                        claimed_total += 1
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    claim = in_flight.pop(fut)
+                    self._handle(claim, fut.result())
+
+        return self.stats
@@ -0,0 +1,228 @@
+# app/rag/embedder.py
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from openai import (
+    OpenAI,
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+    RateLimitError,
+)
+
+# tiktoken дает точный подсчет токенов; без него - грубая оценка ~4 символа на токен
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover
+    tiktoken = None
+
+EMBED_MODEL = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
+
+# Лимиты API: 8191 токенов на один input, 2048 inputs на запрос, ~300k токенов на запрос
+MAX_INPUT_TOKENS = 8191
+MAX_BATCH_INPUTS = int(os.getenv("EMBED_MAX_BATCH_INPUTS", "256"))
+MAX_BATCH_TOKENS = int(os.getenv("EMBED_MAX_BATCH_TOKENS", "100000"))
+
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_RPM = int(os.getenv("EMBED_RPM", "3000"))
+EMBED_TPM = int(os.getenv("EMBED_TPM", "1000000"))
+
+_RETRYABLE = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+_encoding = None
+if tiktoken is not None:
+    try:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception:  # нет сети для загрузки словаря
+        _encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if _encoding is not None:
+        ids = _encoding.encode(text, disallowed_special=())
+        return _encoding.decode(ids[:max_tokens]) if len(ids) > max_tokens else text
+    return text[: max_tokens * 4]
+
+
+def pack_batches(token_counts: List[int], *, max_tokens: int, max_inputs: int) -> List[Tuple[int, int]]:
+    """
+    Greedy packing of consecutive inputs into [start, end) ranges that respect
+    both the token budget and the input-count limit. Order is preserved.
+    """
+    batches: List[Tuple[int, int]] = []
+    start = 0
+    tokens = 0
+    for i, n in enumerate(token_counts):
+        if i > start and (tokens + n > max_tokens or i - start >= max_inputs):
+            batches.append((start, i))
+            start, tokens = i, 0
+        tokens += n
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
+
+class RateLimiter:
+    """
+    Token bucket over requests/min and tokens/min, shared by all worker threads.
+    """
+
+    def __init__(self, rpm: int, tpm: int) -> None:
+        self.rpm = float(rpm)
+        self.tpm = float(tpm)
+        self._req = self.rpm
+        self._tok = self.tpm
+        self._ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> None:
+        tokens = min(float(tokens), self.tpm)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed = now - self._ts
+                self._ts = now
+                self._req = min(self.rpm, self._req + elapsed * self.rpm / 60.0)
+                self._tok = min(self.tpm, self._tok + elapsed * self.tpm / 60.0)
+                if self._req >= 1.0 and self._tok >= tokens:
+                    self._req -= 1.0
+                    self._tok -= tokens
+                    return
+                wait = max(
+                    (1.0 - self._req) * 60.0 / self.rpm,
+                    (tokens - self._tok) * 60.0 / self.tpm,
+                )
+            time.sleep(max(wait, 0.01))
+
+
+@dataclass
+class EmbedStats:
+    texts: int = 0
+    tokens: int = 0
+    batches: int = 0
+    retries: int = 0
+    failed_batches: int = 0
+    seconds: float = 0.0
+
+    @property
+    def texts_per_s(self) -> float:
+        return self.texts / self.seconds if self.seconds else 0.0
+
+    @property
+    def tokens_per_s(self) -> float:
+        return self.tokens / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.texts} texts / {self.tokens} tokens in {self.batches} batches, "
+            f"{self.seconds:.1f}s ({self.texts_per_s:.1f} texts/s, {self.tokens_per_s:.0f} tok/s), "
+            f"retries={self.retries}, failed_batches={self.failed_batches}"
+        )
+
+
+class Embedder:
+    """
+    Embedding pipeline: one shared OpenAI client, token-bounded batches,
+    concurrent dispatch under a rate limit, per-batch retries, order preserved.
+    """
+
+    def __init__(
+        self,
+        *,
+        client: Optional[OpenAI] = None,
+        model: str = EMBED_MODEL,
+        max_batch_tokens: int = MAX_BATCH_TOKENS,
+        max_batch_inputs: int = MAX_BATCH_INPUTS,
+        concurrency: int = EMBED_CONCURRENCY,
+        rpm: int = EMBED_RPM,
+        tpm: int = EMBED_TPM,
+        max_retries: int = 5,
+    ) -> None:
+        # Ретраи делаем сами (по батчу), встроенные ретраи клиента отключаем
+        self.client = client or OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        self.model = model
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_inputs = max_batch_inputs
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.limiter = RateLimiter(rpm, tpm)
+        self.stats = EmbedStats()
+        self._stats_lock = threading.Lock()
+
+    def _embed_batch(self, texts: List[str], tokens: int) -> List[List[float]]:
+        attempt = 0
+        while True:
+            self.limiter.acquire(tokens)
+            try:
+                resp = self.client.embeddings.create(input=texts, model=self.model)
+                # API не гарантирует порядок - сортируем по index
+                return [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
+            except _RETRYABLE as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    with self._stats_lock:
+                        self.stats.failed_batches += 1
+                    raise
+                with self._stats_lock:
+                    self.stats.retries += 1
+                delay = min(30.0, 0.5 * 2 ** attempt) + random.uniform(0, 0.5)
+                print(f"[RAG] Embedding batch of {len(texts)} failed ({type(e).__name__}), retry in {delay:.1f}s")
+                time.sleep(delay)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+
+        t0 = time.perf_counter()
+        # Заменяем переносы строк на пробелы для лучшего качества эмбеддингов
+        clean = [_truncate_to_tokens(t.replace("\n", " "), MAX_INPUT_TOKENS) for t in texts]
+        counts = [estimate_tokens(t) for t in clean]
+        batches = pack_batches(counts, max_tokens=self.max_batch_tokens, max_inputs=self.max_batch_inputs)
+
+        out: List[Optional[List[float]]] = [None] * len(clean)
+
+        def run(rng: Tuple[int, int]) -> None:
+            s, e = rng
+            vectors = self._embed_batch(clean[s:e], sum(counts[s:e]))
+            out[s:e] = vectors
+
+        if len(batches) == 1:
+            run(batches[0])
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as pool:
+                # list() пробрасывает первое исключение после завершения остальных батчей
+                list(pool.map(run, batches))
+
+        with self._stats_lock:
+            self.stats.texts += len(clean)
+            self.stats.tokens += sum(counts)
+            self.stats.batches += len(batches)
+            self.stats.seconds += time.perf_counter() - t0
+
+        return out  # type: ignore[return-value]
+
+
+_embedder: Optional[Embedder] = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder() -> Embedder:
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                _embedder = Embedder()
+    return _embedder
@@ -0,0 +1,181 @@
+# app/rag/extract.py
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+from urllib.parse import urljoin, urldefrag
+
+from bs4 import BeautifulSoup, NavigableString
+
+# lxml в разы быстрее html.parser; если не установлен - работаем через BeautifulSoup
+try:
+    import lxml.html as lxml_html
+    from lxml.etree import ParserError as LxmlParserError
+except ImportError:  # pragma: no cover
+    lxml_html = None
+    LxmlParserError = ValueError
+
+DEFAULT_PARSER = "lxml" if lxml_html is not None else "html.parser"
+
+_HEADINGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+# Не контент (как и раньше: скрипты, стили, шапка/подвал/навигация)
+_SKIP = {"head", "script", "style", "noscript", "header", "footer", "nav", "template", "svg"}
+# Теги, на границах которых заканчивается абзац
+_BREAKS = {
+    "p", "li", "pre", "blockquote", "td", "th", "dd", "dt", "caption", "figcaption",
+    "div", "section", "article", "main", "aside", "ul", "ol", "dl", "table", "tr",
+    "thead", "tbody", "form", "br", "hr", "body",
+}
+
+_WS_RE = re.compile(r"\s+")
+
+
+@dataclass
+class Section:
+    # Heading path, e.g. ["Chapter 2 - Extraordinary Ability", "B. Eligibility", "1. Evidence"]
+    breadcrumbs: List[str]
+    paragraphs: List[str] = field(default_factory=list)
+
+
+@dataclass
+class ExtractedHtml:
+    title: str
+    sections: List[Section]
+    links: List[str]
+
+    @property
+    def text(self) -> str:
+        return "\n\n".join(p for s in self.sections for p in s.paragraphs)
+
+
+class _SectionBuilder:
+    def __init__(self) -> None:
+        self.sections: List[Section] = [Section(breadcrumbs=[])]
+        self._stack: List[Tuple[int, str]] = []
+        self._inline: List[str] = []
+
+    def inline(self, text: str) -> None:
+        self._inline.append(text)
+
+    def flush(self) -> None:
+        if not self._inline:
+            return
+        text = _WS_RE.sub(" ", "".join(self._inline)).strip()
+        self._inline = []
+        if text:
+            self.sections[-1].paragraphs.append(text)
+
+    def heading(self, level: int, text: str) -> None:
+        self.flush()
+        text = _WS_RE.sub(" ", text).strip()
+        if not text:
+            return
+        while self._stack and self._stack[-1][0] >= level:
+            self._stack.pop()
+        self._stack.append((level, text))
+        # Заголовок остается первым абзацем секции, чтобы он попал в текст чанка
+        self.sections.append(Section(breadcrumbs=[t for _, t in self._stack], paragraphs=[text]))
+
+    def result(self) -> List[Section]:
+        self.flush()
+        return [s for s in self.sections if s.paragraphs]
+
+
+def _walk_lxml(root, b: _SectionBuilder) -> None:
+    # Явный стек вместо рекурсии: битый HTML (незакрытые <p>) дает тысячи уровней вложенности
+    stack = [(iter(root), None, False)]
+    while stack:
+        it, el, brk = stack[-1]
+        child = next(it, None)
+        if child is None:
+            stack.pop()
+            if brk:
+                b.flush()
+            # tail - текст после закрывающего тега, принадлежит родителю
+            if el is not None and el.tail:
+                b.inline(el.tail)
+            continue
+
+        tag = child.tag
+        if isinstance(tag, str):
+            tag = tag.lower()
+            if tag in _HEADINGS:
+                b.heading(_HEADINGS[tag], child.text_content())
+            elif tag not in _SKIP:
+                brk_child = tag in _BREAKS
+                if brk_child:
+                    b.flush()
+                if child.text:
+                    b.inline(child.text)
+                stack.append((iter(child), child, brk_child))
+                continue
+        # Заголовки, пропущенные теги и комментарии: tail все равно наш
+        if child.tail:
+            b.inline(child.tail)
+
+
+def _walk_bs4(root, b: _SectionBuilder) -> None:
+    stack = [(iter(root.children), False)]
+    while stack:
+        it, brk = stack[-1]
+        child = next(it, None)
+        if child is None:
+            stack.pop()
+            if brk:
+                b.flush()
+            continue
+
+        if isinstance(child, NavigableString):
+            # Comment/Doctype/CData тоже NavigableString - берем только обычный текст
+            if type(child) is NavigableString:
+                b.inline(str(child))
+            continue
+        tag = (child.name or "").lower()
+        if tag in _HEADINGS:
+            b.heading(_HEADINGS[tag], child.get_text(" "))
+        elif tag not in _SKIP:
+            brk_child = tag in _BREAKS
+            if brk_child:
+                b.flush()
+            stack.append((iter(child.children), brk_child))
+
+
+def _links(base_url: str, hrefs) -> List[str]:
+    seen = {}
+    for href in hrefs:
+        if not href:
+            continue
+        href, _ = urldefrag(urljoin(base_url, href.strip()))
+        if href.startswith(("http://", "https://")):
+            seen.setdefault(href, None)
+    return list(seen)
+
+
+def extract_html(url: str, html: str, *, parser: Optional[str] = None) -> ExtractedHtml:
+    """
+    One pass over the DOM: title, links (nav included - that is where the
+    Policy Manual TOC lives) and content sections with heading breadcrumbs.
+    """
+    parser = parser or DEFAULT_PARSER
+    b = _SectionBuilder()
+
+    if parser == "lxml" and lxml_html is not None:
+        try:
+            root = lxml_html.document_fromstring(html)
+        except ValueError:
+            # lxml не принимает str с <?xml encoding=...?> - отдаем байты
+            root = lxml_html.document_fromstring(html.encode("utf-8"))
+        except LxmlParserError:
+            return ExtractedHtml(title="", sections=[], links=[])
+        title_el = root.find(".//title")
+        title = title_el.text_content().strip() if title_el is not None else ""
+        links = _links(url, (a.get("href") for a in root.iter("a")))
+        _walk_lxml(root, b)
+    else:
+        soup = BeautifulSoup(html, "html.parser")
+        title = soup.title.get_text(strip=True) if soup.title else ""
+        links = _links(url, (a.get("href") for a in soup.find_all("a", href=True)))
+        _walk_bs4(soup, b)
+
+    return ExtractedHtml(title=title, sections=b.result(), links=links)
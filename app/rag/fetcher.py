@@ -0,0 +1,258 @@
+# app/rag/fetcher.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterable, Iterator, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Имитируем браузер, чтобы USCIS не блокировал запрос
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+}
+
+_root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+HTTP_CACHE_DIR = os.getenv("RAG_HTTP_CACHE_DIR", os.path.join(_root_dir, "data", "http_cache"))
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+    body_path: str
+    # False until the consumer confirms the body was indexed (HttpCache.commit):
+    # unconfirmed validators are not sent, so a failed indexing run gets a full 200 next time
+    committed: bool = True
+
+
+@dataclass
+class FetchResult:
+    url: str
+    # None when the server answered 304 or the fetch failed
+    html: Optional[str]
+    last_modified: Optional[datetime]
+    not_modified: bool = False
+    from_cache: bool = False
+    error: Optional[str] = None
+
+
+def _parse_http_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        dt = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    # В БД храним naive UTC, как и остальные DateTime колонки
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+class HttpCache:
+    """
+    On-disk HTTP cache: <root>/<sha256(url)>.json (validators) + .html (body).
+    Doubles as a fixture store: point RAG_HTTP_CACHE_DIR at saved pages and run offline.
+    A fresh body is stored uncommitted; its ETag/Last-Modified are used for conditional
+    requests only after commit(url), i.e. once the page made it into the index.
+    """
+
+    def __init__(self, root: str = HTTP_CACHE_DIR) -> None:
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _paths(self, url: str) -> tuple[str, str]:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.root, key)
+        return base + ".json", base + ".html"
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        meta_path, body_path = self._paths(url)
+        if not (os.path.exists(meta_path) and os.path.exists(body_path)):
+            return None
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(
+            url=url,
+            etag=meta.get("etag"),
+            last_modified=meta.get("last_modified"),
+            fetched_at=meta.get("fetched_at", 0.0),
+            body_path=body_path,
+            committed=meta.get("committed", True),
+        )
+
+    def read_body(self, entry: CacheEntry) -> str:
+        with open(entry.body_path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def put(self, url: str, body: str, *, etag: Optional[str], last_modified: Optional[str]) -> CacheEntry:
+        meta_path, body_path = self._paths(url)
+        # Пишем во временный файл и переименовываем, чтобы не оставить полузаписанный кеш
+        tmp_body = body_path + ".tmp"
+        with open(tmp_body, "w", encoding="utf-8") as f:
+            f.write(body)
+        os.replace(tmp_body, body_path)
+        self._write_meta(meta_path, url, etag, last_modified, committed=False)
+        return CacheEntry(url=url, etag=etag, last_modified=last_modified,
+                          fetched_at=time.time(), body_path=body_path, committed=False)
+
+    def touch(self, entry: CacheEntry) -> None:
+        meta_path, _ = self._paths(entry.url)
+        self._write_meta(meta_path, entry.url, entry.etag, entry.last_modified, committed=entry.committed)
+
+    def commit(self, url: str) -> None:
+        entry = self.get(url)
+        if entry is not None and not entry.committed:
+            meta_path, _ = self._paths(url)
+            self._write_meta(meta_path, url, entry.etag, entry.last_modified, committed=True)
+
+    @staticmethod
+    def _write_meta(meta_path: str, url: str, etag: Optional[str], last_modified: Optional[str],
+                    *, committed: bool) -> None:
+        tmp_meta = meta_path + ".tmp"
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({"url": url, "etag": etag, "last_modified": last_modified, "fetched_at": time.time(),
+                       "committed": committed}, f)
+        os.replace(tmp_meta, meta_path)
+
+
+class SourceFetcher:
+    """
+    Pooled, conditional-GET fetcher.
+    - one requests.Session with a connection pool shared by all workers;
+    - at most `per_host` concurrent requests to the same host;
+    - optional politeness delay between requests to the same host;
+    - If-None-Match / If-Modified-Since from the on-disk cache, so 304 means "nothing to do";
+      call commit(url) after the page is indexed, until then it is fetched in full;
+    - offline=True serves only from the cache (replay against saved fixtures).
+    """
+
+    def __init__(
+        self,
+        *,
+        cache: Optional[HttpCache] = None,
+        offline: bool = False,
+        force: bool = False,
+        max_workers: int = 8,
+        per_host: int = 2,
+        delay_s: float = 0.0,
+        timeout_s: int = 40,
+    ) -> None:
+        self.cache = cache or HttpCache()
+        self.offline = offline
+        self.force = force
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.delay_s = delay_s
+        self.timeout_s = timeout_s
+
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._host_next_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            sem = self._host_slots.get(host)
+            if sem is None:
+                sem = threading.BoundedSemaphore(self.per_host)
+                self._host_slots[host] = sem
+            return sem
+
+    def _wait_politely(self, url: str) -> None:
+        """
+        Keep at least `delay_s` between request starts to the same host.
+        """
+        if self.delay_s <= 0:
+            return
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._host_next_at.get(host, 0.0))
+            self._host_next_at[host] = start_at + self.delay_s
+        if start_at > now:
+            time.sleep(start_at - now)
+
+    def fetch(self, url: str) -> FetchResult:
+        entry = self.cache.get(url)
+
+        if self.offline:
+            if not entry:
+                return FetchResult(url=url, html=None, last_modified=None, error="not in offline cache")
+            return FetchResult(
+                url=url,
+                html=self.cache.read_body(entry),
+                last_modified=_parse_http_date(entry.last_modified),
+                from_cache=True,
+            )
+
+        headers: Dict[str, str] = {}
+        if entry and entry.committed and not self.force:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        try:
+            with self._slot(url):
+                self._wait_politely(url)
+                r = self.session.get(url, headers=headers, timeout=self.timeout_s)
+            if r.status_code == 304 and entry:
+                self.cache.touch(entry)
+                return FetchResult(
+                    url=url,
+                    html=None,
+                    last_modified=_parse_http_date(entry.last_modified),
+                    not_modified=True,
+                )
+            r.raise_for_status()
+        except requests.RequestException as e:
+            return FetchResult(url=url, html=None, last_modified=None, error=str(e))
+
+        etag = r.headers.get("ETag")
+        last_modified = r.headers.get("Last-Modified")
+        self.cache.put(url, r.text, etag=etag, last_modified=last_modified)
+        return FetchResult(url=url, html=r.text, last_modified=_parse_http_date(last_modified))
+
+    def commit(self, url: str) -> None:
+        """
+        The page fetched from `url` is indexed: its validators may be used from now on.
+        """
+        self.cache.commit(url)
+
+    def fetch_many(self, urls: Iterable[str]) -> Iterator[FetchResult]:
+        """
+        Fetch in parallel, yield results as they complete.
+        Consumers (DB writes, embeddings) stay on the calling thread.
+        """
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls))) as pool:
+            futures = [pool.submit(self.fetch, u) for u in urls]
+            for fut in as_completed(futures):
+                yield fut.result()
+
+    def close(self) -> None:
+        self.session.close()
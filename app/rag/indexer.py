@@ -1,18 +1,17 @@
 # app/rag/indexer.py
 from __future__ import annotations
 
-import re
-import os
 import hashlib
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from typing import List, Optional
 
 import requests
-from bs4 import BeautifulSoup
-from openai import OpenAI  # Требуется: pip install openai
 
 from sqlalchemy.orm import Session
+from app.rag.embedder import get_embedder
+from app.rag.extract import Section, extract_html
+from app.rag.fetcher import DEFAULT_HEADERS
 from app.rag.models import RagChunk
 
 
@@ -23,46 +22,126 @@ class FetchedPage:
     text: str
     last_updated: Optional[datetime]
     raw_hash: str
+    # Absolute http(s) links found on the page (used by the crawler)
+    links: List[str] = field(default_factory=list)
+    # Heading-aware structure; empty for plain-text sources
+    sections: List[Section] = field(default_factory=list)
 
 
-def _normalize_whitespace(s: str) -> str:
-    s = re.sub(r"[ \t]+", " ", s)
-    s = re.sub(r"\n{3,}", "\n\n", s)
-    return s.strip()
+def parse_page(url: str, html: str, *, title_fallback: str = "",
+               last_updated: Optional[datetime] = None,
+               parser: Optional[str] = None) -> FetchedPage:
+    extracted = extract_html(url, html, parser=parser)
+    text = extracted.text
+
+    raw_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    return FetchedPage(
+        url=url,
+        title=extracted.title or title_fallback,
+        text=text,
+        last_updated=last_updated,
+        raw_hash=raw_hash,
+        links=extracted.links,
+        sections=extracted.sections,
+    )
 
 
 def fetch_page(url: str, title_fallback: str = "") -> FetchedPage:
-    # Имитируем браузер, чтобы USCIS не блокировал запрос
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-    }
-    r = requests.get(url, timeout=40, headers=headers)
+    r = requests.get(url, timeout=40, headers=DEFAULT_HEADERS)
     r.raise_for_status()
-    html = r.text
+    return parse_page(url, r.text, title_fallback=title_fallback)
 
-    soup = BeautifulSoup(html, "html.parser")
 
-    # Удаляем лишнее
-    for tag in soup(
-            ["script", "style", "noscript", "header", "footer", "nav"]):
-        tag.decompose()
+def make_chunk_prefix(kind: str, url: str) -> str:
+    """
+    Stable across runs (built-in hash() is salted per process, which duplicated chunks on every update).
+    """
+    digest = int(hashlib.sha1(url.encode("utf-8")).hexdigest(), 16)
+    return kind[:3] + "-" + str(digest % 10_000_000)
 
-    title = (soup.title.get_text(
-        strip=True) if soup.title else title_fallback).strip()
 
-    # Извлекаем текст
-    text = soup.get_text("\n", strip=True)
-    text = _normalize_whitespace(text)
+@dataclass
+class Chunk:
+    text: str
+    breadcrumbs: List[str]
 
-    raw_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
 
-    return FetchedPage(
-        url=url,
-        title=title or title_fallback,
-        text=text,
-        last_updated=None,
-        raw_hash=raw_hash,
-    )
+def _common_prefix(a: List[str], b: List[str]) -> List[str]:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return a[:n]
+
+
+def chunk_sections(sections: List[Section], *, max_chars: int = 2000,
+                   overlap_chars: int = 200, min_chars: int = 400) -> List[Chunk]:
+    """
+    Один проход: абзацы копятся в списке (без конкатенации строк), чанк закрывается
+    на границе секции (если уже набрал min_chars) или при переполнении.
+    Overlap - хвост предыдущего чанка той же секции, добавляется сразу при закрытии.
+    """
+    chunks: List[Chunk] = []
+    buf: List[str] = []
+    buf_len = 0      # длина "\n\n".join(buf)
+    fresh = 0        # абзацев в buf помимо перенесенного overlap
+    crumbs: List[str] = []
+
+    def add(p: str) -> None:
+        nonlocal buf_len, fresh
+        buf_len += len(p) + (2 if buf else 0)
+        buf.append(p)
+        fresh += 1
+
+    def flush(carry: bool) -> None:
+        nonlocal buf, buf_len, fresh
+        tail = ""
+        if fresh:
+            text = "\n\n".join(buf)
+            chunks.append(Chunk(text=text, breadcrumbs=crumbs))
+            if carry and overlap_chars > 0:
+                tail = text[-overlap_chars:].strip()
+        buf = [tail] if tail else []
+        buf_len = len(tail)
+        fresh = 0
+
+    for section in sections:
+        if fresh and buf_len >= min_chars:
+            flush(carry=False)
+        if not fresh:
+            buf, buf_len = [], 0
+            crumbs = section.breadcrumbs
+        else:
+            # Мелкая секция сливается со следующей: оставляем общий префикс пути
+            crumbs = _common_prefix(crumbs, section.breadcrumbs)
+
+        for p in section.paragraphs:
+            if len(p) > max_chars:
+                if fresh and buf_len < min_chars:
+                    # Короткий заголовок не оставляем отдельным чанком - режем вместе с абзацем
+                    p = "\n\n".join(buf + [p])
+                    buf, buf_len, fresh = [], 0, 0
+                else:
+                    flush(carry=True)
+                step = max(1, max_chars - overlap_chars)
+                start = 0
+                while len(p) - start > max_chars:
+                    chunks.append(Chunk(text=p[start:start + max_chars].strip(), breadcrumbs=crumbs))
+                    start += step
+                buf, buf_len, fresh = [], 0, 0
+                add(p[start:])
+                continue
+            if buf and buf_len + 2 + len(p) > max_chars:
+                if fresh:
+                    flush(carry=True)
+                if buf and buf_len + 2 + len(p) > max_chars:
+                    buf, buf_len = [], 0
+            add(p)
+
+    flush(carry=False)
+    return chunks
 
 
 def chunk_text(text: str, *, max_chars: int = 2000,
@@ -71,61 +150,20 @@ def chunk_text(text: str, *, max_chars: int = 2000,
     Разбиваем текст на куски. 2000 символов ~ 400-500 токенов, идеально для RAG.
     """
     paras = [p.strip() for p in text.split("\n\n") if p.strip()]
-    chunks: List[str] = []
-    buf = ""
-
-    def flush():
-        nonlocal buf
-        if buf.strip():
-            chunks.append(buf.strip())
-        buf = ""
-
-    for p in paras:
-        if len(buf) + len(p) + 2 <= max_chars:
-            buf = (buf + "\n\n" + p).strip()
-        else:
-            flush()
-            while len(p) > max_chars:
-                chunks.append(p[:max_chars].strip())
-                p = p[max_chars - overlap_chars:]
-            buf = p
-    flush()
-
-    # Добавляем перекрытие (overlap)
-    if overlap_chars > 0 and len(chunks) > 1:
-        overlapped = []
-        prev_tail = ""
-        for c in chunks:
-            if prev_tail:
-                merged = (prev_tail + "\n\n" + c).strip()
-                overlapped.append(merged[:max_chars])
-            else:
-                overlapped.append(c)
-            prev_tail = c[-overlap_chars:]
-        chunks = overlapped
-
-    return chunks
+    section = Section(breadcrumbs=[], paragraphs=paras)
+    return [c.text for c in chunk_sections([section], max_chars=max_chars, overlap_chars=overlap_chars)]
 
 
 def embed_texts(texts: List[str]) -> List[List[float]]:
     """
     Генерируем реальные векторы через OpenAI (text-embedding-3-small).
-    Размерность: 1536.
+    Размерность: 1536. Батчинг/ретраи/лимиты - в app.rag.embedder.
     """
     if not texts:
         return []
 
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-    # Заменяем переносы строк на пробелы для лучшего качества эмбеддингов
-    clean_texts = [t.replace("\n", " ") for t in texts]
-
     try:
-        resp = client.embeddings.create(
-            input=clean_texts,
-            model="text-embedding-3-small"
-        )
-        return [d.embedding for d in resp.data]
+        return get_embedder().embed(texts)
     except Exception as e:
         print(f"[RAG Error] Embedding failed: {e}")
         raise e
@@ -138,29 +176,45 @@ def upsert_page_into_rag(
         page: FetchedPage,
         chunk_prefix: str,
 ) -> int:
-    chunks = chunk_text(page.text)
+    # Страница не изменилась с прошлой индексации - не тратим эмбеддинги
+    same_hash = (
+        session.query(RagChunk.id)
+        .filter(RagChunk.source_url == page.url,
+                RagChunk.meta_json["raw_hash"].as_string() == page.raw_hash)
+        .first()
+    )
+    if same_hash:
+        return 0
+
+    if page.sections:
+        chunks = chunk_sections(page.sections)
+    else:
+        chunks = [Chunk(text=t, breadcrumbs=[]) for t in chunk_text(page.text)]
 
     if not chunks:
         return 0
 
-    embeddings = embed_texts(chunks)
+    embeddings = embed_texts([c.text for c in chunks])
+
+    # Все чанки страницы одним запросом вместо SELECT на каждый чанк
+    existing_by_id = {
+        rc.chunk_id: rc
+        for rc in session.query(RagChunk).filter(RagChunk.source_url == page.url)
+    }
 
     upserted = 0
+    chunk_ids = []
     for i, (chunk, emb) in enumerate(zip(chunks, embeddings)):
         chunk_id = f"{chunk_prefix}-{i:04d}"
+        chunk_ids.append(chunk_id)
 
-        existing = (
-            session.query(RagChunk)
-            .filter(RagChunk.source_url == page.url,
-                    RagChunk.chunk_id == chunk_id)
-            .one_or_none()
-        )
+        existing = existing_by_id.get(chunk_id)
 
-        meta = {"raw_hash": page.raw_hash, "index": i}
+        meta = {"raw_hash": page.raw_hash, "index": i, "breadcrumbs": chunk.breadcrumbs}
         if existing:
             # Обновляем, если хеш изменился
             if existing.meta_json.get("raw_hash") != page.raw_hash:
-                existing.text = chunk
+                existing.text = chunk.text
                 existing.embedding = emb
                 existing.source_title = page.title
                 existing.kind = kind
@@ -173,7 +227,7 @@ def upsert_page_into_rag(
                 source_url=page.url,
                 source_title=page.title,
                 chunk_id=chunk_id,
-                text=chunk,
+                text=chunk.text,
                 meta_json=meta,
                 source_last_updated=page.last_updated,
                 embedding=emb,
@@ -181,4 +235,9 @@ def upsert_page_into_rag(
             session.add(rc)
             upserted += 1
 
-    return upserted
\ No newline at end of file
+    # Страница стала короче (или сменился префикс) - старые хвостовые чанки удаляем
+    for chunk_id, rc in existing_by_id.items():
+        if chunk_id not in chunk_ids:
+            session.delete(rc)
+
+    return upserted
@@ -47,4 +47,56 @@ class RagChunk(Base):
     embedding: Mapped[list] = mapped_column(Vector(1536))
 
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
\ No newline at end of file
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+class CrawlFrontier(Base):
+    """
+    Persisted crawl frontier: survives crashes, so a crawl can resume where it stopped.
+    status: pending -> in_progress -> done | failed | skipped
+    """
+    __tablename__ = "rag_crawl_frontier"
+    __table_args__ = (
+        Index("ix_crawl_status_depth", "status", "depth"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    url: Mapped[str] = mapped_column(String(800), unique=True)
+    kind: Mapped[str] = mapped_column(String(64))
+    depth: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    parent_url: Mapped[Optional[str]] = mapped_column(String(800), nullable=True)
+
+    status: Mapped[str] = mapped_column(String(16), default="pending", nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    last_error: Mapped[str] = mapped_column(Text, default="", nullable=False)
+    raw_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    # Аренда in_progress-строки: после истечения ее может забрать recover() другого процесса
+    claimed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class RagAnswerCache(Base):
+    """
+    Semantic cache of RAG answers: a new question reuses a cached answer when its
+    embedding is close enough, the kind filter matches and the corpus has not changed.
+    """
+    __tablename__ = "rag_answer_cache"
+    __table_args__ = (
+        Index("ix_answer_cache_lookup", "kind_key", "corpus_version"),
+        Index("ix_answer_cache_last_hit", "last_hit_at"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    # Sorted, comma-joined kind filter ("" = all kinds)
+    kind_key: Mapped[str] = mapped_column(String(400), default="", nullable=False)
+    corpus_version: Mapped[str] = mapped_column(String(64), nullable=False)
+
+    question: Mapped[str] = mapped_column(Text, nullable=False)
+    question_embedding: Mapped[list] = mapped_column(Vector(1536))
+    answer: Mapped[str] = mapped_column(Text, nullable=False)
+
+    hits: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    last_hit_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
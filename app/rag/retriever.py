@@ -1,7 +1,7 @@
 # app/rag/retriever.py
 from __future__ import annotations
 
-from typing import List, Optional
+from typing import List, Optional, Sequence
 from sqlalchemy.orm import Session
 from sqlalchemy import select
 
@@ -11,14 +11,16 @@ from app.rag.models import RagChunk
 from app.rag.indexer import embed_texts
 
 
-def retrieve_snippets(
+def retrieve_chunks(
     session: Session,
     *,
-    query: str,
+    query: Optional[str] = None,
+    query_embedding: Optional[List[float]] = None,
     kind_filter: Optional[List[str]] = None,
     top_k: int = 8,
-) -> str:
-    q_emb = embed_texts([query])[0]
+) -> List[RagChunk]:
+    if query_embedding is None:
+        query_embedding = embed_texts([query or ""])[0]
 
     stmt = select(RagChunk)
     if kind_filter:
@@ -26,10 +28,12 @@ def retrieve_snippets(
 
     # pgvector cosine distance: use `.cosine_distance`
     # order by smallest distance
-    stmt = stmt.order_by(RagChunk.embedding.cosine_distance(q_emb)).limit(top_k)
+    stmt = stmt.order_by(RagChunk.embedding.cosine_distance(query_embedding)).limit(top_k)
+
+    return list(session.execute(stmt).scalars().all())
 
-    rows = session.execute(stmt).scalars().all()
 
+def render_snippets(rows: Sequence) -> str:
     if not rows:
         return ""
 
@@ -40,3 +44,14 @@ def retrieve_snippets(
             f"[{r.kind}] {r.source_title}\nURL: {r.source_url}\nCHUNK: {r.chunk_id}\n---\n{r.text}\n"
         )
     return "\n\n".join(rendered).strip()
+
+
+def retrieve_snippets(
+    session: Session,
+    *,
+    query: str,
+    kind_filter: Optional[List[str]] = None,
+    top_k: int = 8,
+) -> str:
+    rows = retrieve_chunks(session, query=query, kind_filter=kind_filter, top_k=top_k)
+    return render_snippets(rows)
@@ -56,3 +56,33 @@ RAG_SOURCES = [
         "url": "https://www.ecfr.gov/current/title-8/chapter-I/subchapter-B/part-204/section-204.5",
     },
 ]
+
+
+# Crawler: seeds + allow-list. A discovered URL is queued only if it matches one of
+# CRAWL_RULES (first match wins and sets `kind`) and stays within the rule's max_depth.
+CRAWL_SEEDS = [
+    "https://www.uscis.gov/policy-manual/volume-6",
+    "https://www.ecfr.gov/current/title-8/chapter-I/subchapter-B/part-204",
+    "https://www.uscis.gov/administrative-appeals/aao-decisions/aao-non-precedent-decisions",
+]
+
+CRAWL_RULES = [
+    # Policy Manual, Volume 6 (Immigrants): parts/chapters
+    {
+        "kind": "policy_manual",
+        "pattern": r"^https://www\.uscis\.gov/policy-manual/volume-6(-part-[a-z](-chapter-\d+)?)?$",
+        "max_depth": 3,
+    },
+    # eCFR: 8 CFR part 204 sections (linked from the Policy Manual citations)
+    {
+        "kind": "cfr",
+        "pattern": r"^https://www\.ecfr\.gov/current/title-8/chapter-I/subchapter-B/part-204(/(subpart-[A-Z]|section-204\.\d+))?$",
+        "max_depth": 2,
+    },
+    # AAO non-precedent decisions: listing pages only (the decisions themselves are PDFs)
+    {
+        "kind": "aao",
+        "pattern": r"^https://www\.uscis\.gov/administrative-appeals/aao-decisions/aao-non-precedent-decisions(\?.*)?$",
+        "max_depth": 1,
+    },
+]
@@ -0,0 +1,257 @@
+# app/storage/bulk.py
+from __future__ import annotations
+
+import gzip
+import io
+import json
+import os
+from dataclasses import dataclass
+from typing import IO, Any, Dict, Iterator, List, Optional, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# Реестр переносится между окружениями: кейс указывается по имени, а не по id
+TABLES: Dict[str, Sequence[str]] = {
+    "cases": ("name", "memo_json", "lock_mode"),
+    "evidence": ("case_name", "exhibit_code", "title", "description", "criterion_tags", "strength", "status", "file_ids"),
+    "tasks": ("case_name", "title", "priority", "status", "due_at"),
+}
+_REQUIRED = {"cases": ("name",), "evidence": ("case_name", "exhibit_code", "title"), "tasks": ("case_name", "title")}
+
+COPY_BLOCK_BYTES = 1 << 20
+
+# Staging: все колонки текстовые, разбор и приведение типов - в SQL при слиянии.
+# ord - порядок строк в файле: при дублях ключа побеждает последняя.
+_STAGING = {
+    table: f"CREATE TEMP TABLE stage_{table} (ord BIGSERIAL, {', '.join(f'{c} TEXT' for c in cols)}) ON COMMIT DROP"
+    for table, cols in TABLES.items()
+}
+
+# criterion_tags / file_ids: JSON-массив или "a;b;c" (удобно для CSV из таблиц)
+_JSON_LIST = """CASE
+    WHEN coalesce(trim({c}), '') = '' THEN '[]'::jsonb
+    WHEN left(trim({c}), 1) = '[' THEN trim({c})::jsonb
+    ELSE to_jsonb(array_remove(string_to_array(replace({c}, ' ', ''), ';'), ''))
+END"""
+
+_MERGE = {
+    "cases": """
+WITH s AS (
+    SELECT DISTINCT ON (name) * FROM stage_cases WHERE coalesce(name, '') <> '' ORDER BY name, ord DESC
+), m AS (
+    INSERT INTO cases (name, memo_json, lock_mode, created_at, updated_at)
+    SELECT s.name, coalesce(nullif(s.memo_json, ''), '{}')::json, coalesce(nullif(s.lock_mode, '')::boolean, true),
+           now() AT TIME ZONE 'utc', now() AT TIME ZONE 'utc'
+    FROM s
+    ON CONFLICT (name) DO UPDATE SET memo_json = EXCLUDED.memo_json, updated_at = EXCLUDED.updated_at
+    WHERE cases.memo_json::jsonb IS DISTINCT FROM EXCLUDED.memo_json::jsonb
+    RETURNING (xmax = 0) AS inserted
+)
+SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted),
+       (SELECT count(*) FROM s) - count(*), 0
+FROM m
+""",
+    # Строки без изменений не трогаем: updated_at (кеш ContextPack) и эмбеддинги остаются валидными
+    "evidence": f"""
+WITH s AS (
+    SELECT DISTINCT ON (case_name, exhibit_code) * FROM stage_evidence ORDER BY case_name, exhibit_code, ord DESC
+), src AS (
+    SELECT c.id AS case_id, s.exhibit_code, s.title, coalesce(s.description, '') AS description,
+           {_JSON_LIST.format(c="s.criterion_tags")} AS criterion_tags,
+           coalesce(nullif(s.strength, '')::int, 3) AS strength,
+           coalesce(nullif(s.status, ''), 'draft')::evidencestatus AS status,
+           {_JSON_LIST.format(c="s.file_ids")} AS file_ids
+    FROM s JOIN cases c ON c.name = s.case_name
+), m AS (
+    INSERT INTO evidence_items (case_id, exhibit_code, title, description, criterion_tags, strength, status,
+                                file_ids, created_at, updated_at)
+    SELECT case_id, exhibit_code, title, description, criterion_tags::json, strength, status, file_ids::json,
+           now() AT TIME ZONE 'utc', now() AT TIME ZONE 'utc'
+    FROM src
+    ON CONFLICT (case_id, exhibit_code) DO UPDATE SET
+        title = EXCLUDED.title,
+        description = EXCLUDED.description,
+        criterion_tags = EXCLUDED.criterion_tags,
+        strength = EXCLUDED.strength,
+        status = EXCLUDED.status,
+        file_ids = EXCLUDED.file_ids,
+        updated_at = EXCLUDED.updated_at
+    WHERE (evidence_items.title, evidence_items.description, evidence_items.strength, evidence_items.status)
+              IS DISTINCT FROM (EXCLUDED.title, EXCLUDED.description, EXCLUDED.strength, EXCLUDED.status)
+       OR evidence_items.criterion_tags::jsonb IS DISTINCT FROM EXCLUDED.criterion_tags::jsonb
+       OR evidence_items.file_ids::jsonb IS DISTINCT FROM EXCLUDED.file_ids::jsonb
+    RETURNING (xmax = 0) AS inserted
+)
+SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted),
+       (SELECT count(*) FROM src) - count(*), (SELECT count(*) FROM s) - (SELECT count(*) FROM src)
+FROM m
+""",
+    # У задач нет уникального ключа: совпадение по (кейс, название) обновляется, остальное вставляется
+    "tasks": """
+WITH s AS (
+    SELECT DISTINCT ON (case_name, title) * FROM stage_tasks ORDER BY case_name, title, ord DESC
+), src AS (
+    SELECT c.id AS case_id, s.title, coalesce(nullif(s.priority, '')::int, 3) AS priority,
+           coalesce(nullif(s.status, ''), 'open') AS status, nullif(s.due_at, '')::timestamp AS due_at
+    FROM s JOIN cases c ON c.name = s.case_name
+), upd AS (
+    UPDATE tasks t SET priority = src.priority, status = src.status, due_at = src.due_at
+    FROM src
+    WHERE t.case_id = src.case_id AND t.title = src.title
+      AND (t.priority, t.status, t.due_at) IS DISTINCT FROM (src.priority, src.status, src.due_at)
+    RETURNING t.id
+), ins AS (
+    INSERT INTO tasks (case_id, title, priority, status, due_at, linked_evidence_ids, created_at)
+    SELECT src.case_id, src.title, src.priority, src.status, src.due_at, '[]'::json, now() AT TIME ZONE 'utc'
+    FROM src
+    WHERE NOT EXISTS (SELECT 1 FROM tasks t WHERE t.case_id = src.case_id AND t.title = src.title)
+    RETURNING id
+)
+SELECT (SELECT count(*) FROM ins), (SELECT count(*) FROM upd),
+       (SELECT count(*) FROM src) - (SELECT count(*) FROM ins) - (SELECT count(*) FROM upd),
+       (SELECT count(*) FROM s) - (SELECT count(*) FROM src)
+""",
+}
+
+_EXPORT = {
+    "cases": "SELECT name, memo_json, lock_mode FROM cases {where} ORDER BY name",
+    "evidence": """
+SELECT c.name AS case_name, e.exhibit_code, e.title, e.description, e.criterion_tags, e.strength, e.status, e.file_ids
+FROM evidence_items e JOIN cases c ON c.id = e.case_id {where} ORDER BY c.name, e.exhibit_code""",
+    "tasks": """
+SELECT c.name AS case_name, t.title, t.priority, t.status, t.due_at
+FROM tasks t JOIN cases c ON c.id = t.case_id {where} ORDER BY c.name, t.id""",
+}
+
+
+@dataclass
+class ImportStats:
+    table: str
+    rows: int = 0
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    unknown_case: int = 0
+
+    def summary(self) -> str:
+        return (f"{self.table}: {self.rows} rows read, {self.inserted} inserted, {self.updated} updated, "
+                f"{self.unchanged} unchanged" + (f", {self.unknown_case} skipped (unknown case)"
+                                                  if self.unknown_case else ""))
+
+
+def detect_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    ext = os.path.splitext(name.lower())[1]
+    if ext == ".csv":
+        return "csv"
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    raise ValueError(f"Unsupported file '{path}': use .csv or .jsonl (optionally .gz)")
+
+
+def open_binary(path: str, mode: str = "rb") -> IO[bytes]:
+    return gzip.open(path, mode) if path.endswith(".gz") else open(path, mode)
+
+
+def _driver_cursor(session: Session):
+    # COPY идет через psycopg напрямую, в той же транзакции, что и слияние
+    return session.connection().connection.driver_connection.cursor()
+
+
+def _csv_header(f: IO[bytes], table: str) -> List[str]:
+    header = f.readline().decode("utf-8-sig").strip()
+    columns = [c.strip().strip('"') for c in header.split(",")]
+    unknown = [c for c in columns if c not in TABLES[table]]
+    missing = [c for c in _REQUIRED[table] if c not in columns]
+    if unknown or missing:
+        raise ValueError(f"{table} CSV header: unknown columns {unknown}, missing {missing}")
+    return columns
+
+
+def _jsonl_rows(f: IO[bytes], table: str) -> Iterator[List[Optional[str]]]:
+    columns = TABLES[table]
+    for n, line in enumerate(io.TextIOWrapper(f, encoding="utf-8"), start=1):
+        if not line.strip():
+            continue
+        try:
+            obj: Dict[str, Any] = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{table} JSONL line {n}: {e}") from None
+        row = []
+        for c in columns:
+            v = obj.get(c)
+            if v is None:
+                row.append(None)
+            elif isinstance(v, (dict, list)):
+                row.append(json.dumps(v, ensure_ascii=False))
+            elif isinstance(v, bool):
+                row.append("true" if v else "false")
+            else:
+                row.append(str(v))
+        yield row
+
+
+def copy_into_staging(session: Session, table: str, f: IO[bytes], fmt: str) -> int:
+    """
+    Streams the file into stage_<table> with COPY FROM STDIN. CSV bytes go to the server
+    as they are (Postgres parses them); JSONL is decoded line by line. Memory stays flat.
+    """
+    session.execute(text(_STAGING[table]))
+    with _driver_cursor(session) as cur:
+        if fmt == "csv":
+            columns = _csv_header(f, table)
+            with cur.copy(f"COPY stage_{table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)") as copy:
+                for block in iter(lambda: f.read(COPY_BLOCK_BYTES), b""):
+                    copy.write(block)
+        else:
+            with cur.copy(f"COPY stage_{table} ({', '.join(TABLES[table])}) FROM STDIN") as copy:
+                for row in _jsonl_rows(f, table):
+                    copy.write_row(row)
+        cur.execute(f"SELECT count(*) FROM stage_{table}")
+        return cur.fetchone()[0]
+
+
+def import_file(session: Session, table: str, path: str) -> ImportStats:
+    """
+    COPY into a temp staging table, then one set-based merge (ON CONFLICT for cases and
+    evidence). The whole file is one transaction: it lands completely or not at all.
+    """
+    if table not in TABLES:
+        raise ValueError(f"Unknown table '{table}', expected one of {', '.join(TABLES)}")
+    fmt = detect_format(path)
+    stats = ImportStats(table=table)
+    with open_binary(path) as f:
+        stats.rows = copy_into_staging(session, table, f, fmt)
+    stats.inserted, stats.updated, stats.unchanged, stats.unknown_case = session.execute(text(_MERGE[table])).one()
+    return stats
+
+
+def export_file(session: Session, table: str, path: str, *, case_names: Sequence[str] = ()) -> int:
+    """
+    Streams COPY ... TO STDOUT into a CSV/JSONL file (the import format); returns the row count.
+    """
+    if table not in TABLES:
+        raise ValueError(f"Unknown table '{table}', expected one of {', '.join(TABLES)}")
+    fmt = detect_format(path)
+    alias = "cases" if table == "cases" else "c"
+    where = ""
+    params: Dict[str, Any] = {}
+    if case_names:
+        where = f"WHERE {alias}.name = ANY(%(names)s)"
+        params["names"] = list(case_names)
+    query = _EXPORT[table].format(where=where)
+
+    with _driver_cursor(session) as cur, open_binary(path, "wb") as out:
+        if fmt == "csv":
+            with cur.copy(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", params or None) as copy:
+                for block in copy:
+                    out.write(block)
+        else:
+            with cur.copy(f"COPY (SELECT row_to_json(x)::text FROM ({query}) x) TO STDOUT", params or None) as copy:
+                # Через rows(): COPY text-формат экранирует обратные слеши, psycopg снимает экранирование
+                copy.set_types(["text"])
+                for (line,) in copy.rows():
+                    out.write(line.encode("utf-8") + b"\n")
+        # "COPY n" из ответа сервера
+        return cur.rowcount
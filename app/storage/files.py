@@ -0,0 +1,329 @@
+# app/storage/files.py
+from __future__ import annotations
+
+import hashlib
+import io
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, BinaryIO, Iterable, Iterator, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.storage.models import FileObject
+
+# boto3 нужен только для FILE_STORE=s3 (MinIO/S3)
+try:
+    import boto3
+except ImportError:  # pragma: no cover
+    boto3 = None
+
+_root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+FILE_STORE = os.getenv("FILE_STORE", "local")  # local | s3
+FILE_STORE_DIR = os.getenv("FILE_STORE_DIR", os.path.join(_root_dir, "data", "blobs"))
+S3_BUCKET = os.getenv("S3_BUCKET", "eb1a-files")
+S3_PREFIX = os.getenv("S3_PREFIX", "blobs/")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+
+CHUNK_SIZE = 1 << 20
+
+# storage_url не зависит от бэкенда: по хешу файл находит любой BlobStore
+BLOB_URL_PREFIX = "blob:sha256:"
+
+
+class BlobTooLarge(ValueError):
+    pass
+
+
+@dataclass
+class BlobRef:
+    sha256: str
+    size: int
+    created: bool  # False - такой blob уже был (дедупликация)
+
+    @property
+    def url(self) -> str:
+        return f"{BLOB_URL_PREFIX}{self.sha256}"
+
+
+def sha_from_url(url: str) -> str:
+    if not url.startswith(BLOB_URL_PREFIX):
+        raise ValueError(f"Not a blob url: {url}")
+    return url[len(BLOB_URL_PREFIX):]
+
+
+def _spool(chunks: Iterable[bytes], tmp_dir: str, max_bytes: Optional[int]) -> tuple[str, str, int]:
+    """
+    Writes chunks to a temp file in tmp_dir, hashing on the fly. Returns (tmp_path, sha256, size).
+    """
+    os.makedirs(tmp_dir, exist_ok=True)
+    h = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=tmp_dir, prefix="incoming-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise BlobTooLarge(f"Blob is larger than {max_bytes} bytes.")
+                h.update(chunk)
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return tmp, h.hexdigest(), size
+
+
+class _MmapReader(io.RawIOBase):
+    """
+    io interface over an mmap: zipfile (DOCX) and pypdf check readable()/seekable(),
+    which mmap itself doesn't have.
+    """
+
+    def __init__(self, mm: mmap.mmap) -> None:
+        self._mm = mm
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        data = self._mm.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._mm.read(None if size is None or size < 0 else size)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._mm.seek(offset, whence)
+        return self._mm.tell()
+
+    def tell(self) -> int:
+        return self._mm.tell()
+
+
+@contextmanager
+def open_mmap(path: str) -> Iterator[BinaryIO]:
+    """
+    Read-only memory map as a binary file object. Pages are loaded on access,
+    the file is never copied into the heap.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield io.BytesIO(b"")  # пустой файл нельзя отобразить
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield _MmapReader(mm)
+
+
+def iter_file(f: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    return iter(lambda: f.read(chunk_size), b"")
+
+
+class BlobStore(ABC):
+    """
+    Content-addressed storage: a blob's key is the sha256 of its bytes,
+    so identical files (from any case) are stored once.
+    """
+
+    @abstractmethod
+    def put_chunks(self, chunks: Iterable[bytes], *, max_bytes: Optional[int] = None) -> BlobRef:
+        ...
+
+    def put_file(self, path: str) -> BlobRef:
+        with open(path, "rb") as f:
+            return self.put_chunks(iter_file(f))
+
+    @abstractmethod
+    def exists(self, sha256: str) -> bool:
+        ...
+
+    @abstractmethod
+    def local_path(self, sha256: str) -> str:
+        """
+        A local file with the blob's bytes (for parsers that want a path).
+        """
+
+    @contextmanager
+    def open_mmap(self, sha256: str) -> Iterator[BinaryIO]:
+        with open_mmap(self.local_path(sha256)) as mm:
+            yield mm
+
+
+class LocalBlobStore(BlobStore):
+    """
+    <root>/ab/cd/<sha256>. Writes go to <root>/tmp and are renamed into place
+    atomically, so a reader never sees a partial blob.
+    """
+
+    def __init__(self, root: str = FILE_STORE_DIR) -> None:
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+
+    def path_for(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def put_chunks(self, chunks: Iterable[bytes], *, max_bytes: Optional[int] = None) -> BlobRef:
+        tmp, sha, size = _spool(chunks, self.tmp_dir, max_bytes)
+        final = self.path_for(sha)
+        if os.path.exists(final):
+            os.remove(tmp)
+            return BlobRef(sha, size, created=False)
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        os.replace(tmp, final)
+        return BlobRef(sha, size, created=True)
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.exists(self.path_for(sha256))
+
+    def local_path(self, sha256: str) -> str:
+        path = self.path_for(sha256)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Blob {sha256} not found")
+        return path
+
+
+def _is_not_found(e: Exception) -> bool:
+    if isinstance(e, (FileNotFoundError, KeyError)):
+        return True
+    code = str(getattr(e, "response", {}).get("Error", {}).get("Code", ""))
+    return code in ("404", "NoSuchKey", "NotFound")
+
+
+class S3BlobStore(BlobStore):
+    """
+    Same keys in an S3-compatible bucket. Uses only head_object / upload_file /
+    download_file, so boto3 (S3, MinIO) and LocalS3Client both fit.
+    Reads are served from a local content-addressed cache.
+    """
+
+    def __init__(self, client: Any, *, bucket: str = S3_BUCKET, prefix: str = S3_PREFIX,
+                 cache_dir: str = os.path.join(FILE_STORE_DIR, "s3-cache")) -> None:
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.cache = LocalBlobStore(cache_dir)
+
+    def key_for(self, sha256: str) -> str:
+        return f"{self.prefix}{sha256[:2]}/{sha256}"
+
+    def exists(self, sha256: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key_for(sha256))
+            return True
+        except Exception as e:
+            if _is_not_found(e):
+                return False
+            raise
+
+    def put_chunks(self, chunks: Iterable[bytes], *, max_bytes: Optional[int] = None) -> BlobRef:
+        # Ключ известен только после хеширования: сначала пишем в локальный кеш
+        ref = self.cache.put_chunks(chunks, max_bytes=max_bytes)
+        if self.exists(ref.sha256):
+            return BlobRef(ref.sha256, ref.size, created=False)
+        # upload_file в boto3 сам делает multipart для больших файлов
+        self.client.upload_file(self.cache.path_for(ref.sha256), self.bucket, self.key_for(ref.sha256))
+        return BlobRef(ref.sha256, ref.size, created=True)
+
+    def local_path(self, sha256: str) -> str:
+        if not self.cache.exists(sha256):
+            os.makedirs(self.cache.tmp_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.cache.tmp_dir, prefix="download-")
+            os.close(fd)
+            try:
+                self.client.download_file(self.bucket, self.key_for(sha256), tmp)
+                final = self.cache.path_for(sha256)
+                os.makedirs(os.path.dirname(final), exist_ok=True)
+                os.replace(tmp, final)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+        return self.cache.path_for(sha256)
+
+
+class LocalS3Client:
+    """
+    Filesystem stand-in for the boto3 S3 client subset used by S3BlobStore
+    (local development and tests without MinIO).
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, *key.split("/"))
+
+    def head_object(self, *, Bucket: str, Key: str) -> dict:
+        st = os.stat(self._path(Bucket, Key))  # FileNotFoundError == 404
+        return {"ContentLength": st.st_size}
+
+    def upload_file(self, filename: str, bucket: str, key: str) -> None:
+        dest = self._path(bucket, key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = dest + ".part"
+        shutil.copyfile(filename, tmp)
+        os.replace(tmp, dest)
+
+    def download_file(self, bucket: str, key: str, filename: str) -> None:
+        shutil.copyfile(self._path(bucket, key), filename)
+
+
+_store: Optional[BlobStore] = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            if FILE_STORE == "s3":
+                if boto3 is None:
+                    raise RuntimeError("FILE_STORE=s3 requires boto3 (pip install boto3)")
+                _store = S3BlobStore(boto3.client("s3", endpoint_url=S3_ENDPOINT_URL))
+            else:
+                _store = LocalBlobStore()
+        return _store
+
+
+def register_file(
+    session: Session,
+    ref: BlobRef,
+    *,
+    original_name: str = "",
+    content_type: str = "",
+) -> int:
+    """
+    FileObject row for a stored blob (one row per distinct content). Returns its id.
+    """
+    file_id = session.execute(
+        pg_insert(FileObject)
+        .values(
+            sha256=ref.sha256,
+            size_bytes=ref.size,
+            storage_url=ref.url,
+            original_name=original_name[:240],
+            content_type=content_type[:120],
+            created_at=datetime.utcnow(),
+        )
+        .on_conflict_do_nothing(index_elements=["sha256"])
+        .returning(FileObject.id)
+    ).scalar_one_or_none()
+    if file_id is not None:
+        return file_id
+    return session.execute(select(FileObject.id).where(FileObject.sha256 == ref.sha256)).scalar_one()
@@ -6,6 +6,7 @@ from datetime import datetime
 from typing import Optional, List, Dict, Any
 
 from sqlalchemy import (
+    BigInteger,
     String,
     Text,
     DateTime,
@@ -13,12 +14,17 @@ from sqlalchemy import (
     Boolean,
     Integer,
     Enum,
+    Float,
     JSON,
     Index,
+    LargeBinary,
     UniqueConstraint,
+    text,
 )
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
+from pgvector.sqlalchemy import Vector
+
 
 class Base(DeclarativeBase):
     pass
@@ -54,6 +60,13 @@ class RunMode(str, enum.Enum):
     general = "general"
 
 
+class JobStatus(str, enum.Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
 # -------------------- Core tables --------------------
 
 class ChatState(Base):
@@ -96,6 +109,15 @@ class EvidenceItem(Base):
     __table_args__ = (
         UniqueConstraint("case_id", "exhibit_code", name="uq_case_exhibit"),
         Index("ix_evidence_case_criterion", "case_id"),
+        # Проверка свежести кеша ContextPack: count/max(updated_at) по кейсу из одного индекса
+        Index("ix_evidence_case_updated", "case_id", "updated_at"),
+        Index(
+            "ix_evidence_embedding_hnsw",
+            "embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"embedding": "vector_cosine_ops"},
+        ),
     )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -114,6 +136,11 @@ class EvidenceItem(Base):
     # File references stored as list of FileObject ids
     file_ids: Mapped[List[int]] = mapped_column(JSON, default=list, nullable=False)
 
+    # Embedding of title + description (app/core/exhibit_links.py). embedding_hash = md5 of the
+    # embedded text: a row whose md5(title || '\n' || description) differs is stale, whatever wrote it.
+    embedding: Mapped[Optional[list]] = mapped_column(Vector(1536), nullable=True)
+    embedding_hash: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow,
                                                  nullable=False)
@@ -163,14 +190,21 @@ class DocumentVersion(Base):
     __tablename__ = "document_versions"
     __table_args__ = (
         Index("ix_docver_doc_created", "document_id", "created_at"),
+        Index("ix_docver_content_hash", "content_hash"),
     )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     document_id: Mapped[int] = mapped_column(ForeignKey("documents.id"), index=True)
 
-    # Where the raw file lives (MinIO/S3) or local path.
+    # Where the raw file lives: blob:sha256:<hex> (app/storage/files.py), MinIO/S3 or local path.
     storage_url: Mapped[str] = mapped_column(String(500))
 
+    # The stored blob (FileObject, see app/storage/files.py); null for versions saved before the file store
+    file_id: Mapped[Optional[int]] = mapped_column(ForeignKey("file_objects.id"), nullable=True, index=True)
+
+    # sha256 of the raw file: re-uploading an identical file doesn't create a version
+    content_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+
     # Plain text extracted for LLM work (store it here to avoid re-OCR/re-parse)
     text_extract: Mapped[str] = mapped_column(Text, default="", nullable=False)
 
@@ -187,6 +221,22 @@ class DocumentVersion(Base):
     )
 
 
+class FileObject(Base):
+    """
+    One row per distinct stored file (content-addressed, see app/storage/files.py).
+    DocumentVersion.file_id and EvidenceItem.file_ids point here; identical files across cases share a row.
+    """
+    __tablename__ = "file_objects"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    sha256: Mapped[str] = mapped_column(String(64), unique=True)
+    size_bytes: Mapped[int] = mapped_column(Integer, nullable=False)
+    storage_url: Mapped[str] = mapped_column(String(500))  # blob:sha256:<hex>
+    original_name: Mapped[str] = mapped_column(String(240), default="", nullable=False)
+    content_type: Mapped[str] = mapped_column(String(120), default="", nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+
 class Checkpoint(Base):
     __tablename__ = "checkpoints"
     __table_args__ = (
@@ -196,8 +246,15 @@ class Checkpoint(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     case_id: Mapped[int] = mapped_column(ForeignKey("cases.id"), index=True)
     label: Mapped[str] = mapped_column(String(240))
+    # Legacy full snapshots only; new checkpoints keep it empty and store `delta` instead
     snapshot_json: Mapped[Dict[str, Any]] = mapped_column(JSON, default=dict, nullable=False)
 
+    # zlib(JSON) of the changes against base_id (app/core/checkpoints.py); base_id NULL = keyframe
+    base_id: Mapped[Optional[int]] = mapped_column(ForeignKey("checkpoints.id"), nullable=True)
+    depth: Mapped[int] = mapped_column(Integer, default=0, nullable=False)  # deltas since the keyframe
+    delta: Mapped[Optional[bytes]] = mapped_column(LargeBinary, nullable=True)
+    size_bytes: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
 
     case: Mapped["Case"] = relationship(back_populates="checkpoints")
@@ -231,6 +288,10 @@ class Run(Base):
     __tablename__ = "runs"
     __table_args__ = (
         Index("ix_run_case_created", "case_id", "created_at"),
+        # Политика хранения: архиватор выбирает самые старые прогоны
+        Index("ix_run_created", "created_at"),
+        # "Кейсы с NEEDS_WORK за неделю" - диапазон по индексу
+        Index("ix_run_verdict_created", "verdict", "created_at"),
     )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -239,15 +300,157 @@ class Run(Base):
     mode: Mapped[RunMode] = mapped_column(Enum(RunMode), default=RunMode.general, nullable=False)
 
     inputs_hash: Mapped[str] = mapped_column(String(64), index=True)
-    # Raw text for transparency (you can also store JSON)
-    prompt_pack: Mapped[Dict[str, Any]] = mapped_column(JSON, default=dict, nullable=False)
+    # Reviewed document version (mode=review): base for incremental re-review
+    document_version_id: Mapped[Optional[int]] = mapped_column(ForeignKey("document_versions.id"), nullable=True,
+                                                               index=True)
+    # Raw text for transparency (you can also store JSON).
+    # Deferred as one group: listing queries don't pull the large columns, the first access loads all of them.
+    prompt_pack: Mapped[Dict[str, Any]] = mapped_column(JSON, default=dict, nullable=False,
+                                                        deferred=True, deferred_group="outputs")
+
+    model_a_output: Mapped[str] = mapped_column(Text, default="", nullable=False,
+                                                deferred=True, deferred_group="outputs")
+    model_b_output: Mapped[str] = mapped_column(Text, default="", nullable=False,
+                                                deferred=True, deferred_group="outputs")
+    critique_a: Mapped[str] = mapped_column(Text, default="", nullable=False, deferred=True, deferred_group="outputs")
+    critique_b: Mapped[str] = mapped_column(Text, default="", nullable=False, deferred=True, deferred_group="outputs")
+    judge_output: Mapped[str] = mapped_column(Text, default="", nullable=False,
+                                              deferred=True, deferred_group="outputs")
+
+    # Parsed judge answer (app/llm/judge.py): PASS | NEEDS_WORK, 0..1; NULL when the judge failed
+    verdict: Mapped[Optional[str]] = mapped_column(String(16), nullable=True)
+    confidence: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+    case: Mapped["Case"] = relationship()
+    risks: Mapped[List["RunRisk"]] = relationship(back_populates="run", cascade="all, delete-orphan",
+                                                  passive_deletes=True)
 
-    model_a_output: Mapped[str] = mapped_column(Text, default="", nullable=False)
-    model_b_output: Mapped[str] = mapped_column(Text, default="", nullable=False)
-    critique_a: Mapped[str] = mapped_column(Text, default="", nullable=False)
-    critique_b: Mapped[str] = mapped_column(Text, default="", nullable=False)
-    judge_output: Mapped[str] = mapped_column(Text, default="", nullable=False)
 
+class RunRisk(Base):
+    """
+    One risk item from the judge's structured answer.
+    """
+    __tablename__ = "run_risks"
+    __table_args__ = (
+        Index("ix_run_risk_case_criterion", "case_id", "criterion"),
+        Index("ix_run_risk_severity_created", "severity", "created_at"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    run_id: Mapped[int] = mapped_column(ForeignKey("runs.id", ondelete="CASCADE"), index=True)
+    case_id: Mapped[int] = mapped_column(ForeignKey("cases.id"), nullable=False)
+    severity: Mapped[str] = mapped_column(String(8), default="medium", nullable=False)  # high | medium | low
+    criterion: Mapped[str] = mapped_column(String(32), default="general", nullable=False)
+    text: Mapped[str] = mapped_column(Text, default="", nullable=False)
+    sections: Mapped[List[int]] = mapped_column(JSON, default=list, nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
 
-    case: Mapped["Case"] = relationship()
\ No newline at end of file
+    run: Mapped["Run"] = relationship(back_populates="risks")
+
+
+class ArchivedRun(Base):
+    """
+    Index of runs moved out of `runs` into compressed JSONL files (app/storage/run_archive.py).
+    Each run is its own gzip member at (path, offset, length), so one run is read back without
+    decompressing the whole file, and the file is still a plain .jsonl.gz.
+    """
+    __tablename__ = "run_archive_index"
+    __table_args__ = (
+        Index("ix_run_archive_case_created", "case_id", "created_at"),
+    )
+
+    run_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    case_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    mode: Mapped[RunMode] = mapped_column(Enum(RunMode), nullable=False)
+    inputs_hash: Mapped[str] = mapped_column(String(64), default="", nullable=False)
+    document_version_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True, index=True)
+    verdict: Mapped[Optional[str]] = mapped_column(String(16), nullable=True)
+    confidence: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    path: Mapped[str] = mapped_column(String(500))  # relative to RUN_ARCHIVE_DIR
+    offset: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    length: Mapped[int] = mapped_column(Integer, nullable=False)
+    archived_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class SectionReview(Base):
+    """
+    Review findings for one document section (app/utils/diff.py), reused by
+    incremental /review while the section text and the review context are unchanged.
+    """
+    __tablename__ = "section_reviews"
+    __table_args__ = (
+        UniqueConstraint("section_hash", "context_hash", name="uq_section_review"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    section_hash: Mapped[str] = mapped_column(String(64))
+    # Hash of memo + evidence registry + providers + prompt version (see app/core/review.py)
+    context_hash: Mapped[str] = mapped_column(String(64))
+    title: Mapped[str] = mapped_column(String(240), default="", nullable=False)
+    findings: Mapped[str] = mapped_column(Text, default="", nullable=False)
+    run_id: Mapped[Optional[int]] = mapped_column(ForeignKey("runs.id", ondelete="SET NULL"), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class Job(Base):
+    """
+    Durable background job (e.g. /review debates), processed by scripts/run_worker.py.
+    Workers claim rows with SELECT ... FOR UPDATE SKIP LOCKED, so any number of
+    worker processes/hosts can share the table.
+    """
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_job_status_run_after", "status", "run_after"),
+        # Дедупликация: один активный (queued/running) джоб на ключ
+        Index(
+            "uq_job_dedupe_active",
+            "dedupe_key",
+            unique=True,
+            postgresql_where=text("status IN ('queued', 'running')"),
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(String(32))  # review, ...
+    chat_id: Mapped[str] = mapped_column(String(64), index=True)
+    case_id: Mapped[Optional[int]] = mapped_column(ForeignKey("cases.id"), nullable=True)
+
+    payload: Mapped[Dict[str, Any]] = mapped_column(JSON, default=dict, nullable=False)
+    dedupe_key: Mapped[Optional[str]] = mapped_column(String(200), nullable=True)
+
+    status: Mapped[JobStatus] = mapped_column(Enum(JobStatus), default=JobStatus.queued, nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    max_attempts: Mapped[int] = mapped_column(Integer, default=3, nullable=False)
+    run_after: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+    locked_by: Mapped[Optional[str]] = mapped_column(String(120), nullable=True)
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[str] = mapped_column(Text, default="", nullable=False)
+
+    # Run.id of the result
+    result_run_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow,
+                                                 nullable=False)
+
+
+class JobSubscriber(Base):
+    """
+    Chats waiting for a job's result. Identical /review requests from several
+    chats coalesce into one job; each chat gets its own status message and the result.
+    """
+    __tablename__ = "job_subscribers"
+    __table_args__ = (
+        UniqueConstraint("job_id", "chat_id", name="uq_job_subscriber"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    job_id: Mapped[int] = mapped_column(ForeignKey("jobs.id", ondelete="CASCADE"), index=True)
+    chat_id: Mapped[str] = mapped_column(String(64))
+    status_message_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
@@ -0,0 +1,166 @@
+# app/storage/run_archive.py
+from __future__ import annotations
+
+import gzip
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, selectinload, undefer_group
+
+from app.storage.db import db_session
+from app.storage.models import ArchivedRun, Run
+
+_root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+RUN_ARCHIVE_DIR = os.getenv("RUN_ARCHIVE_DIR", os.path.join(_root_dir, "data", "run_archive"))
+# Сколько дней прогоны живут в горячей таблице
+RUN_RETENTION_DAYS = int(os.getenv("RUN_RETENTION_DAYS", "90"))
+RUN_ARCHIVE_BATCH = int(os.getenv("RUN_ARCHIVE_BATCH", "500"))
+
+# Один архиватор за раз: файлы дописываются в конец, offset'ы не должны пересекаться
+_ARCHIVE_LOCK_KEY = 0x52554E41  # "RUNA"
+
+_OUTPUT_FIELDS = ("prompt_pack", "model_a_output", "model_b_output", "critique_a", "critique_b", "judge_output")
+
+
+@dataclass
+class ArchiveStats:
+    runs: int = 0
+    files: int = 0
+    bytes_written: int = 0
+    raw_bytes: int = 0
+
+    def summary(self) -> str:
+        ratio = self.raw_bytes / self.bytes_written if self.bytes_written else 0.0
+        return (f"{self.runs} runs -> {self.files} file(s), {self.bytes_written / 1024:.0f} KB written "
+                f"({ratio:.1f}x compression)")
+
+
+def _archive_path(created_at: datetime) -> str:
+    # Файл на месяц: старые файлы больше не меняются, их можно уносить на холодный диск целиком
+    return f"runs-{created_at:%Y-%m}.jsonl.gz"
+
+
+def run_record(run: Run) -> Dict[str, Any]:
+    return {
+        "id": run.id,
+        "case_id": run.case_id,
+        "mode": run.mode.value,
+        "inputs_hash": run.inputs_hash,
+        "document_version_id": run.document_version_id,
+        "created_at": run.created_at.isoformat(),
+        "verdict": run.verdict,
+        "confidence": run.confidence,
+        **{f: getattr(run, f) for f in _OUTPUT_FIELDS},
+        "risks": [
+            {"severity": r.severity, "criterion": r.criterion, "text": r.text, "sections": r.sections}
+            for r in run.risks
+        ],
+    }
+
+
+def archive_batch(session: Session, cutoff: datetime, *, batch_size: int = RUN_ARCHIVE_BATCH,
+                  archive_dir: str = RUN_ARCHIVE_DIR) -> ArchiveStats:
+    """
+    Moves up to batch_size runs older than cutoff: gzip members are appended and fsynced
+    first, then the index rows are written and the runs deleted in the same transaction.
+    A crash in between leaves unreferenced bytes in a file, never a lost run.
+    """
+    session.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": _ARCHIVE_LOCK_KEY})
+    runs: List[Run] = list(session.execute(
+        select(Run)
+        .options(undefer_group("outputs"), selectinload(Run.risks))
+        .where(Run.created_at < cutoff)
+        .order_by(Run.created_at, Run.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).scalars())
+    stats = ArchiveStats()
+    if not runs:
+        return stats
+
+    os.makedirs(archive_dir, exist_ok=True)
+    by_file: Dict[str, List[Run]] = {}
+    for run in runs:
+        by_file.setdefault(_archive_path(run.created_at), []).append(run)
+
+    index: List[Dict[str, Any]] = []
+    for rel_path, group in by_file.items():
+        with open(os.path.join(archive_dir, rel_path), "ab") as f:
+            for run in group:
+                raw = (json.dumps(run_record(run), ensure_ascii=False) + "\n").encode("utf-8")
+                member = gzip.compress(raw, compresslevel=6, mtime=0)
+                offset = f.tell()
+                f.write(member)
+                index.append({
+                    "run_id": run.id,
+                    "case_id": run.case_id,
+                    "mode": run.mode,
+                    "inputs_hash": run.inputs_hash,
+                    "document_version_id": run.document_version_id,
+                    "verdict": run.verdict,
+                    "confidence": run.confidence,
+                    "created_at": run.created_at,
+                    "path": rel_path,
+                    "offset": offset,
+                    "length": len(member),
+                })
+                stats.raw_bytes += len(raw)
+                stats.bytes_written += len(member)
+            f.flush()
+            os.fsync(f.fileno())
+        stats.files += 1
+
+    stmt = pg_insert(ArchivedRun).values(index)
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=[ArchivedRun.run_id],
+        set_={c: stmt.excluded[c] for c in ("path", "offset", "length")} | {"archived_at": datetime.utcnow()},
+    ))
+    session.execute(delete(Run).where(Run.id.in_([r.id for r in runs])).execution_options(synchronize_session=False))
+    stats.runs = len(runs)
+    return stats
+
+
+def archive_old_runs(*, days: int = RUN_RETENTION_DAYS, batch_size: int = RUN_ARCHIVE_BATCH,
+                     max_batches: Optional[int] = None) -> ArchiveStats:
+    """
+    Retention policy: everything older than `days` leaves the hot table, one transaction per batch.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    total = ArchiveStats()
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        with db_session() as session:
+            stats = archive_batch(session, cutoff, batch_size=batch_size)
+        total.runs += stats.runs
+        total.files += stats.files
+        total.bytes_written += stats.bytes_written
+        total.raw_bytes += stats.raw_bytes
+        batches += 1
+        if stats.runs < batch_size:
+            break
+    return total
+
+
+def read_archived(entry: ArchivedRun, *, archive_dir: str = RUN_ARCHIVE_DIR) -> Dict[str, Any]:
+    with open(os.path.join(archive_dir, entry.path), "rb") as f:
+        f.seek(entry.offset)
+        member = f.read(entry.length)
+    return json.loads(gzip.decompress(member).decode("utf-8"))
+
+
+def fetch_run(session: Session, run_id: int) -> Optional[Dict[str, Any]]:
+    """
+    A run as a dict (the archive record format), from the hot table or the cold archive.
+    """
+    run = session.get(Run, run_id)
+    if run is not None:
+        return run_record(run)
+    entry = session.get(ArchivedRun, run_id)
+    if entry is None:
+        return None
+    return read_archived(entry)
@@ -0,0 +1,214 @@
+# app/telegram/admission.py
+from __future__ import annotations
+
+import itertools
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+# Размер собственного пула исполнителей: дорогие хендлеры выполняются в нем, а не в потоках,
+# которые принимают апдейты (TeleBot / UpdateDispatcher), так что лимит не упирается в их число
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "4"))
+ADMISSION_PER_CHAT_CONCURRENT = int(os.getenv("ADMISSION_PER_CHAT_CONCURRENT", "1"))
+# Сколько запросов одного чата может быть в работе и в очереди одновременно
+ADMISSION_PER_CHAT_PENDING = int(os.getenv("ADMISSION_PER_CHAT_PENDING", "3"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "50"))
+ADMISSION_WAIT_TIMEOUT_S = float(os.getenv("ADMISSION_WAIT_TIMEOUT_S", "120"))
+
+# Меньше - раньше: дешевые RAG-ответы обгоняют загрузку файлов.
+# /review сюда не входит: он только ставит джоб, лимиты у очереди джобов свои (app/core/jobs.py)
+LANES = {"rag": 0, "ingest": 1}
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised instead of queueing; the message is meant for the user.
+    """
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    chat_id: str = field(compare=False)
+    work: Callable[[], None] = field(compare=False)
+    deadline: float = field(compare=False)
+    on_rejected: Optional[Callable[[str], None]] = field(default=None, compare=False)
+
+
+@dataclass
+class AdmissionStats:
+    admitted: int = 0
+    queued: int = 0
+    rejected: int = 0
+    timeouts: int = 0
+
+
+class AdmissionController:
+    """
+    Global and per-chat concurrency caps in front of the expensive handlers.
+
+    submit() never blocks the calling (update-receiving) thread: the work either starts
+    right away on the controller's own pool of max_concurrent threads or waits in a
+    bounded queue ordered by lane priority, then arrival. A waiter whose chat is at its
+    own cap does not block waiters from other chats behind it.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+        per_chat_concurrent: int = ADMISSION_PER_CHAT_CONCURRENT,
+        per_chat_pending: int = ADMISSION_PER_CHAT_PENDING,
+        queue_size: int = ADMISSION_QUEUE_SIZE,
+        wait_timeout_s: float = ADMISSION_WAIT_TIMEOUT_S,
+    ) -> None:
+        self.max_concurrent = max(1, max_concurrent)
+        self.per_chat_concurrent = max(1, per_chat_concurrent)
+        self.per_chat_pending = max(self.per_chat_concurrent, per_chat_pending)
+        self.queue_size = queue_size
+        self.wait_timeout_s = wait_timeout_s
+        self.stats = AdmissionStats()
+
+        self._running = 0
+        self._running_by_chat: Counter = Counter()
+        self._pending_by_chat: Counter = Counter()
+        self._waiting: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        # Слоты раздает _dispatch, поэтому в пуле задачи никогда не ждут
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="admitted")
+
+    def submit(
+        self,
+        chat_id: str,
+        lane: str,
+        work: Callable[[], None],
+        *,
+        on_queued: Optional[Callable[[int], None]] = None,
+        on_rejected: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        """
+        Runs `work` on the controller's pool once a slot is free. Raises AdmissionRejected
+        right away when the chat or the queue is over its cap; on_queued(position) is called
+        if the work has to wait, on_rejected(reason) if it then waits too long.
+        """
+        with self._cond:
+            if self._pending_by_chat[chat_id] >= self.per_chat_pending:
+                self.stats.rejected += 1
+                raise AdmissionRejected(
+                    f"⛔ У вас уже {self._pending_by_chat[chat_id]} запроса в работе. "
+                    f"Дождитесь ответа и повторите."
+                )
+            if len(self._waiting) >= self.queue_size:
+                self.stats.rejected += 1
+                raise AdmissionRejected("⛔ Бот сейчас перегружен, очередь заполнена. Попробуйте через пару минут.")
+
+            waiter = _Waiter(LANES[lane], next(self._seq), chat_id, work,
+                             time.monotonic() + self.wait_timeout_s, on_rejected)
+            self._waiting.append(waiter)
+            self._pending_by_chat[chat_id] += 1
+            expired = self._dispatch()
+            position = sorted(self._waiting).index(waiter) + 1 if waiter in self._waiting else 0
+            if position:
+                self.stats.queued += 1
+
+        self._notify_expired(expired)
+        if position and on_queued is not None:
+            on_queued(position)
+
+    def _dispatch(self) -> List[_Waiter]:
+        # Под self._cond: раздаем свободные слоты по приоритету, пропуская чаты на своем лимите.
+        # Возвращает просроченные ожидания - им отвечают уже без блокировки
+        now = time.monotonic()
+        expired = []
+        for w in sorted(self._waiting):
+            if w.deadline <= now:
+                self._waiting.remove(w)
+                self._forget(w.chat_id)
+                self.stats.timeouts += 1
+                expired.append(w)
+                continue
+            if self._running >= self.max_concurrent:
+                continue
+            if self._running_by_chat[w.chat_id] >= self.per_chat_concurrent:
+                continue
+            self._waiting.remove(w)
+            self._running += 1
+            self._running_by_chat[w.chat_id] += 1
+            self.stats.admitted += 1
+            self._pool.submit(self._run, w)
+        return expired
+
+    @staticmethod
+    def _notify_expired(expired: List[_Waiter]) -> None:
+        for w in expired:
+            if w.on_rejected is not None:
+                try:
+                    w.on_rejected("⛔ Не дождались свободного слота. Попробуйте позже.")
+                except Exception as e:
+                    print(f"[Admission] rejection reply failed: {e}")
+
+    def _run(self, waiter: _Waiter) -> None:
+        try:
+            waiter.work()
+        except Exception as e:
+            print(f"[Admission] handler for chat {waiter.chat_id} failed: {type(e).__name__}: {e}")
+        finally:
+            self._release(waiter.chat_id)
+
+    def _forget(self, chat_id: str) -> None:
+        self._pending_by_chat[chat_id] -= 1
+        if self._pending_by_chat[chat_id] <= 0:
+            del self._pending_by_chat[chat_id]
+
+    def _release(self, chat_id: str) -> None:
+        with self._cond:
+            self._running -= 1
+            self._running_by_chat[chat_id] -= 1
+            if self._running_by_chat[chat_id] <= 0:
+                del self._running_by_chat[chat_id]
+            self._forget(chat_id)
+            expired = self._dispatch()
+            self._cond.notify_all()
+        self._notify_expired(expired)
+
+    def drain(self, timeout_s: float = 60.0) -> None:
+        """
+        Graceful stop: waits for running and queued work (queued work still honours its deadline).
+        """
+        deadline = time.monotonic() + timeout_s
+        while True:
+            left = deadline - time.monotonic()
+            with self._cond:
+                if left <= 0 or not (self._running or self._waiting):
+                    break
+                self._cond.wait(timeout=min(left, 1.0))
+                expired = self._dispatch()
+            self._notify_expired(expired)
+        self._pool.shutdown(wait=False)
+
+    def format_stats(self) -> str:
+        with self._cond:
+            s = AdmissionStats(**vars(self.stats))
+            running, waiting = self._running, len(self._waiting)
+        return (
+            f"Admission (this process): running={running}/{self.max_concurrent} waiting={waiting} "
+            f"admitted={s.admitted} queued={s.queued} rejected={s.rejected} timeouts={s.timeouts}"
+        )
+
+
+_controller: Optional[AdmissionController] = None
+_controller_lock = threading.Lock()
+
+
+def get_admission() -> AdmissionController:
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController()
+        return _controller
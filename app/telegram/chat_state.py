@@ -0,0 +1,140 @@
+# app/telegram/chat_state.py
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.storage.models import ChatState
+
+# Кеш верен, только пока все апдейты чата идут в один процесс: polling (один getUpdates)
+# и sharded (шард выбирается по chat_id). Реплики webhook за балансировщиком видели бы
+# чужой /case use только через TTL, поэтому там кеш по умолчанию выключен.
+# auto | 1 | 0
+CHAT_STATE_CACHE = os.getenv("CHAT_STATE_CACHE", "auto")
+CHAT_STATE_TTL_S = float(os.getenv("CHAT_STATE_TTL_S", "60"))
+CHAT_STATE_MAX_ENTRIES = int(os.getenv("CHAT_STATE_MAX_ENTRIES", "10000"))
+
+
+def _cache_enabled() -> bool:
+    if CHAT_STATE_CACHE == "auto":
+        return os.getenv("BOT_MODE", "polling") != "webhook"
+    return CHAT_STATE_CACHE == "1"
+
+
+class ChatStateCache:
+    """
+    In-process TTL + LRU cache of chat_id -> active_case_id (None is cached too).
+    """
+
+    def __init__(self, ttl_s: float = CHAT_STATE_TTL_S, max_entries: int = CHAT_STATE_MAX_ENTRIES) -> None:
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, Tuple[float, Optional[int]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chat_id: str) -> Tuple[bool, Optional[int]]:
+        with self._lock:
+            entry = self._data.get(chat_id)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(chat_id)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, chat_id: str, case_id: Optional[int]) -> None:
+        with self._lock:
+            self._data[chat_id] = (time.monotonic() + self.ttl_s, case_id)
+            self._data.move_to_end(chat_id)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, chat_id: str) -> None:
+        with self._lock:
+            self._data.pop(chat_id, None)
+
+
+_cache = ChatStateCache()
+_enabled = _cache_enabled()
+
+# Несохраненные изменения сессии: chat_id -> case_id. В кеш попадают только после commit
+_PENDING = "chat_state_pending"
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_pending(session: Session) -> None:
+    for chat_id, case_id in session.info.pop(_PENDING, {}).items():
+        _cache.put(chat_id, case_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_pending(session: Session, previous_transaction) -> None:
+    for chat_id in session.info.pop(_PENDING, {}):
+        _cache.invalidate(chat_id)
+
+
+def ensure_chat_state(session: Session, chat_id: str) -> Optional[int]:
+    """
+    Atomic get-or-create: concurrent first messages from one chat can't
+    collide on the unique chat_id. Returns active_case_id.
+    """
+    now = datetime.utcnow()
+    inserted = session.execute(
+        pg_insert(ChatState)
+        .values(chat_id=chat_id, active_case_id=None, created_at=now, updated_at=now)
+        .on_conflict_do_nothing(index_elements=["chat_id"])
+        .returning(ChatState.active_case_id)
+    ).first()
+    if inserted is not None:
+        return inserted.active_case_id
+    return session.execute(
+        select(ChatState.active_case_id).where(ChatState.chat_id == chat_id)
+    ).scalar_one_or_none()
+
+
+def get_active_case_id(session: Session, chat_id: str) -> Optional[int]:
+    """
+    Warm path is a dict lookup; chat_state is touched only on a cache miss.
+    """
+    if not _enabled:
+        return ensure_chat_state(session, chat_id)
+    pending = session.info.get(_PENDING, {})
+    if chat_id in pending:
+        return pending[chat_id]
+    found, case_id = _cache.get(chat_id)
+    if found:
+        return case_id
+    case_id = ensure_chat_state(session, chat_id)
+    _cache.put(chat_id, case_id)
+    return case_id
+
+
+def set_active_case_id(session: Session, chat_id: str, case_id: Optional[int]) -> None:
+    now = datetime.utcnow()
+    stmt = pg_insert(ChatState).values(chat_id=chat_id, active_case_id=case_id, created_at=now, updated_at=now)
+    session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["chat_id"],
+            set_={"active_case_id": stmt.excluded.active_case_id, "updated_at": now},
+        )
+    )
+    if _enabled:
+        # Write-through после commit: откат не оставит в кеше чужой кейс
+        _cache.invalidate(chat_id)
+        session.info.setdefault(_PENDING, {})[chat_id] = case_id
+
+
+def cache_stats() -> str:
+    if not _enabled:
+        return "Chat state cache: off (CHAT_STATE_CACHE=0 or webhook replicas)"
+    return f"Chat state cache (this process): hits={_cache.hits} misses={_cache.misses}"
@@ -1,68 +1,304 @@
 # app/telegram/commands.py
 from __future__ import annotations
 
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Callable, Optional, Tuple
+
 from sqlalchemy.orm import Session
+from telebot import types
 
+from app.core.checkpoints import create_checkpoint, list_checkpoints, restore_checkpoint
 from app.core.context_builder import build_context_pack
-from app.core.orchestrator import run_debate
+from app.core.exhibit_links import attach_exhibit_links
+from app.core.history import Cursor, history_page, open_run
+from app.core.ingest import IngestResult, ingest_blob
+from app.core.jobs import (
+    JOB_MAX_ACTIVE_PER_CHAT,
+    JOB_QUEUE_MAX,
+    ClaimedJob,
+    JobOutcome,
+    active_job_count,
+    enqueue_job,
+    find_active,
+    queue_position,
+)
+from app.core.orchestrator import save_run
+from app.core.review import plan_review, review_sections, store_section_reviews
+from app.core.singleflight import flight_key
 from app.llm.openai_client import OpenAIClient
 from app.llm.gemini_client import GeminiClient
 from app.storage.models import ChatState, RunMode, Document
 from app.storage.models import Case
+from app.storage.db import db_session
+from app.storage.files import BlobRef
+from app.utils.text_extract import UnsupportedFileType
+from app.telegram.chat_state import ensure_chat_state, get_active_case_id, set_active_case_id
 
 
 def get_or_create_chat_state(session: Session, chat_id: str) -> ChatState:
-    cs = session.query(ChatState).filter(ChatState.chat_id == chat_id).one_or_none()
-    if cs:
-        return cs
-    cs = ChatState(chat_id=chat_id, active_case_id=None)
-    session.add(cs)
-    session.flush()
-    return cs
+    ensure_chat_state(session, chat_id)
+    return session.query(ChatState).filter(ChatState.chat_id == chat_id).one()
 
 
 def set_active_case(session: Session, chat_id: str, case_name: str) -> str:
-    cs = get_or_create_chat_state(session, chat_id)
     case = session.query(Case).filter(Case.name == case_name).one_or_none()
     if not case:
         return f"Case '{case_name}' not found."
-    cs.active_case_id = case.id
-    session.add(cs)
+    set_active_case_id(session, chat_id, case.id)
     return f"Active case set to: {case.name}"
 
 
-def cmd_review_document(session: Session, chat_id: str, document_title: str) -> str:
-    cs = get_or_create_chat_state(session, chat_id)
-    if not cs.active_case_id:
+def cmd_checkpoint(session: Session, chat_id: str, label: str) -> str:
+    case_id = get_active_case_id(session, chat_id)
+    if not case_id:
+        return "No active case. Use /case use <name> first."
+    info = create_checkpoint(session, case_id, label or "checkpoint")
+    kind = "full snapshot" if info.keyframe else f"{info.changes} change(s) since the previous one"
+    return f"✅ Checkpoint #{info.id} '{info.label}' saved ({kind}, {info.size_bytes} bytes)."
+
+
+def cmd_restore(session: Session, chat_id: str, arg: str) -> str:
+    """
+    /restore without arguments lists recent checkpoints; /restore <id> rolls the case back.
+    """
+    case_id = get_active_case_id(session, chat_id)
+    if not case_id:
+        return "No active case. Use /case use <name> first."
+
+    if not arg:
+        rows = list_checkpoints(session, case_id)
+        if not rows:
+            return "No checkpoints yet. Use /checkpoint <label> to create one."
+        lines = [f"#{r.id} {r.created_at:%Y-%m-%d %H:%M} {r.label} ({r.size_bytes} B)" for r in rows]
+        return "Checkpoints (newest first):\n" + "\n".join(lines) + "\n\nUse /restore <id> to roll back."
+    if not arg.lstrip("#").isdigit():
+        return "Format: /restore <checkpoint id>"
+
+    try:
+        r = restore_checkpoint(session, case_id, int(arg.lstrip("#")))
+    except ValueError as e:
+        return str(e)
+    lines = [
+        f"♻️ Restored checkpoint #{r.checkpoint_id}: {r.evidence_restored} exhibit(s) restored, "
+        f"{r.evidence_removed} removed, {r.documents_restored} document(s) reset.",
+        f"Previous state saved as checkpoint #{r.safety_checkpoint_id} (/restore {r.safety_checkpoint_id} to undo).",
+    ]
+    if r.documents_missing:
+        lines.append("Deleted since the checkpoint, not restored: " + ", ".join(r.documents_missing))
+    if r.documents_kept:
+        lines.append("Created after the checkpoint, kept: " + ", ".join(r.documents_kept))
+    return "\n".join(lines)
+
+
+def _history_button_data(case_id: int, cursor: Optional[Cursor]) -> str:
+    # callback_data <= 64 байт: "hist:<case>:<created_at>:<id>"
+    if cursor is None:
+        return f"hist:{case_id}"
+    return f"hist:{case_id}:{cursor[0].isoformat()}:{cursor[1]}"
+
+
+def parse_history_data(data: str) -> Tuple[int, Optional[Cursor]]:
+    parts = data.split(":", 2)
+    case_id = int(parts[1])
+    if len(parts) < 3:
+        return case_id, None
+    ts, run_id = parts[2].rsplit(":", 1)
+    return case_id, (datetime.fromisoformat(ts), int(run_id))
+
+
+def cmd_history(session: Session, chat_id: str, *, case_id: Optional[int] = None,
+                before: Optional[Cursor] = None) -> Tuple[str, Optional[types.InlineKeyboardMarkup]]:
+    """
+    One page of /history with an inline keyboard: a button per run, "Older" / "Newest" paging.
+    A page button from another case (the chat switched cases since) is refused.
+    """
+    active = get_active_case_id(session, chat_id)
+    if not active:
+        return "No active case. Use /case use <name> first.", None
+    if case_id is not None and case_id != active:
+        return "This list belongs to another case. Send /history again.", None
+
+    runs, next_cursor = history_page(session, active, before=before)
+    if not runs:
+        return ("No more runs." if before else "No runs yet for this case. Use /review <DocTitle>."), None
+
+    markup = types.InlineKeyboardMarkup()
+    lines = []
+    for r in runs:
+        tag = " [archived]" if r.archived else ""
+        verdict = r.verdict + (f" ({r.confidence:.2f})" if r.confidence is not None else "")
+        lines.append(f"#{r.id} {r.created_at:%Y-%m-%d %H:%M} {r.mode}{tag}" + (f"\n   {verdict}" if verdict else ""))
+        markup.add(types.InlineKeyboardButton(f"#{r.id} {r.mode} {r.created_at:%m-%d}", callback_data=f"run:{r.id}"))
+    nav = []
+    if before is not None:
+        nav.append(types.InlineKeyboardButton("⏮ Newest", callback_data=_history_button_data(active, None)))
+    if next_cursor is not None:
+        nav.append(types.InlineKeyboardButton("Older ▶", callback_data=_history_button_data(active, next_cursor)))
+    if nav:
+        markup.row(*nav)
+    return "Runs (newest first), tap one to open:\n\n" + "\n".join(lines), markup
+
+
+def cmd_open_run(session: Session, chat_id: str, run_id: int) -> str:
+    case_id = get_active_case_id(session, chat_id)
+    if not case_id:
+        return "No active case. Use /case use <name> first."
+    record = open_run(session, case_id, run_id)
+    if record is None:
+        return f"Run #{run_id} not found in the active case."
+    created = datetime.fromisoformat(record["created_at"])
+    return f"Run #{run_id} ({record['mode']}, {created:%Y-%m-%d %H:%M})\n\n{record['judge_output']}"
+
+
+REVIEW_TASK = (
+    "Review the provided document for EB-1A strength and weaknesses. "
+    "Find missing evidence links to exhibits, overbroad claims, inconsistencies, and suggest edits."
+)
+
+
+def cmd_enqueue_review(session: Session, chat_id: str, document_title: str,
+                       status_message_id: Optional[int] = None) -> str:
+    """
+    /review only enqueues: the debate runs in scripts/run_worker.py, not in the handler thread.
+    """
+    case_id = get_active_case_id(session, chat_id)
+    if not case_id:
         return "No active case. Use /case use <name> first."
 
     doc = (
         session.query(Document)
-        .filter(Document.case_id == cs.active_case_id, Document.title == document_title)
+        .filter(Document.case_id == case_id, Document.title == document_title)
         .one_or_none()
     )
     if not doc:
         return f"Document '{document_title}' not found in active case."
 
-    ctx = build_context_pack(session, cs.active_case_id, document_id=doc.id, include_document_text=True)
+    payload = {
+        "document_id": doc.id,
+        "document_version_id": doc.current_version_id,
+        "document_title": doc.title,
+    }
+    # Single-flight: одинаковый /review (тот же кейс и версия документа) из любых чатов -
+    # один дебат, результат получают все подписавшиеся
+    dedupe_key = flight_key(
+        "review",
+        case_id=case_id,
+        document_version_id=doc.current_version_id,
+        extra=str(doc.id),
+    )
+    # Присоединение к уже идущему ревью ничего не стоит - лимиты только для новых джобов
+    if find_active(session, dedupe_key) is None:
+        if active_job_count(session, chat_id=chat_id) >= JOB_MAX_ACTIVE_PER_CHAT:
+            return (f"⛔ You already have {JOB_MAX_ACTIVE_PER_CHAT} reviews in progress. "
+                    f"Wait for them to finish before starting another one.")
+        if active_job_count(session) >= JOB_QUEUE_MAX:
+            return "⛔ The review queue is full right now. Please try again in a few minutes."
+
+    job_id, created = enqueue_job(
+        session,
+        kind="review",
+        chat_id=chat_id,
+        case_id=case_id,
+        payload=payload,
+        dedupe_key=dedupe_key,
+        status_message_id=status_message_id,
+    )
+    position = queue_position(session, job_id)
+
+    if not created:
+        return (f"⏳ Review of '{doc.title}' is already running for this case (job #{job_id}). "
+                f"You will get the same result here.")
+    return f"⏳ Review of '{doc.title}' queued (job #{job_id}, position {position}). I will post progress here."
 
+
+def run_review_job(job: ClaimedJob, progress: Callable[[str], None]) -> JobOutcome:
+    """
+    Job handler for kind="review". DB sessions are short: one to build the context,
+    one to store the Run; none is open during the provider calls.
+    Sections unchanged since the last review reuse their cached findings (app/core/review.py).
+    """
+    progress("▶️ Начал анализ документа...")
     llm_a = OpenAIClient()
     llm_b = GeminiClient()
 
-    task = (
-        "Review the provided document for EB-1A strength and weaknesses. "
-        "Find missing evidence links to exhibits, overbroad claims, inconsistencies, and suggest edits."
-    )
+    with db_session() as session:
+        ctx = build_context_pack(
+            session,
+            job.case_id,
+            document_version_id=job.payload.get("document_version_id"),
+            document_id=job.payload.get("document_id"),
+            include_document_text=True,
+        )
+        plan = plan_review(
+            session, ctx,
+            providers={"a": llm_a.name, "b": llm_b.name, "judge": llm_a.name},
+            user_task=REVIEW_TASK,
+        )
 
-    result = run_debate(
-        session,
+    # Кандидаты-экспонаты для утверждений без ссылок считаются заранее, а не угадываются моделью
+    try:
+        attach_exhibit_links(ctx)
+    except Exception as e:
+        print(f"[Review] exhibit linking skipped: {type(e).__name__}: {e}")
+
+    review = review_sections(
         ctx=ctx,
-        mode=RunMode.review,
-        user_task=task,
+        plan=plan,
+        user_task=REVIEW_TASK,
         llm_a=llm_a,
         llm_b=llm_b,
         judge=llm_a,
+        on_progress=lambda step: progress(f"🔄 Шаг {step}"),
     )
 
+    with db_session() as session:
+        result = save_run(session, ctx=ctx, mode=RunMode.review, outputs=review.outputs)
+        store_section_reviews(session, review.fresh, context_hash=plan.context_hash, run_id=result.run_id)
+
+    header = f"Run #{result.run_id}"
+    if review.incremental:
+        header += (f" (incremental vs version #{plan.base_version_id}: {review.reviewed} section(s) re-reviewed, "
+                   f"{review.reused} reused; {plan.diff.summary()})")
+    map_reduce = review.outputs.prompt_pack.get("map_reduce")
+    if map_reduce:
+        header += f" [long document: {map_reduce['chunks']} parts reviewed in parallel]"
     # Return the judge output (clean final)
-    return f"Run #{result.run_id}\n\n{result.judge_output}"
+    return JobOutcome(text=f"{header}\n\n{result.judge_output}", run_id=result.run_id)
+
+
+def cmd_ingest_upload(session: Session, chat_id: str, *, title: str, ref: BlobRef, filename: str,
+                      created_by: str, content_type: str = "") -> "Future[str] | str":
+    """
+    Uploaded file -> new DocumentVersion of `title` in the active case.
+    Returns an error string right away, or a Future with the reply text (extraction runs in a process pool).
+    """
+    case_id = get_active_case_id(session, chat_id)
+    if not case_id:
+        return "No active case. Use /case use <name> first."
+
+    fut = ingest_blob(case_id=case_id, title=title, ref=ref, filename=filename,
+                      created_by=created_by, content_type=content_type)
+    reply: Future = Future()
+
+    def _done(f: "Future[IngestResult]") -> None:
+        try:
+            res = f.result()
+        except UnsupportedFileType as e:
+            reply.set_result(f"❌ {e}")
+            return
+        except Exception as e:
+            reply.set_result(f"❌ Could not read '{filename}': {type(e).__name__}: {e}")
+            return
+        if res.duplicate:
+            reply.set_result(f"♻️ This file is already stored as '{res.title}' (version #{res.version_id}). Skipped.")
+            return
+        note = " Text was truncated." if res.truncated else ""
+        reply.set_result(
+            f"✅ '{res.title}': version #{res.version_id} saved "
+            f"({res.pages} pages/blocks, {res.chars} chars).{note}\n"
+            f"File #{res.file_id} (for evidence file_ids). Review it with /review {res.title}"
+        )
+
+    fut.add_done_callback(_done)
+    return reply
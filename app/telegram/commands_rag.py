@@ -2,9 +2,14 @@
 from __future__ import annotations
 
 from sqlalchemy.orm import Session
+from app.core.context_builder import cache_stats as context_cache_stats
+from app.core.singleflight import flight_key, get_singleflight
 from app.llm.openai_client import OpenAIClient
-from app.rag.retriever import retrieve_snippets
-from app.storage.models import ChatState
+from app.rag import answer_cache
+from app.rag.indexer import embed_texts
+from app.rag.retriever import retrieve_chunks, render_snippets
+from app.storage.db import db_session
+from app.telegram.chat_state import get_active_case_id, cache_stats as chat_state_stats
 
 # --- ИЗМЕНЕНИЕ: Добавили инструкцию про русский язык ---
 RAG_SYSTEM = """You are an expert EB-1A immigration assistant.
@@ -18,25 +23,59 @@ IMPORTANT:
 5. Translate legal terms correctly (e.g., "Petitioner" -> "Петиционер/Заявитель", "Beneficiary" -> "Бенефициар").
 """
 
-def _get_chat(session: Session, chat_id: str) -> ChatState:
-    from app.telegram.commands import get_or_create_chat_state
-    return get_or_create_chat_state(session, chat_id)
-
-def _simple_rag_query(session: Session, chat_id: str, query: str, user_prompt_template: str, kind_filter: list[str]) -> str:
+def _simple_rag_query(session: Session, chat_id: str, query: str, user_prompt_template: str, kind_filter: list[str] | None) -> str:
     """
     Helper for single-shot RAG queries (cheaper and faster than debate).
+    Answers go through the semantic cache: a paraphrase of a cached question
+    (same kind filter, same corpus version) gets the cached answer without an LLM call.
+    On a miss, identical concurrent queries (even from other processes) share one LLM call.
     """
-    cs = _get_chat(session, chat_id)
-    if not cs.active_case_id:
+    # Кешируется в процессе: на теплом пути chat_state не читается
+    if not get_active_case_id(session, chat_id):
         return "Сначала выберите кейс с помощью команды /case use <Name>"
 
-    # 1. Ищем в базе (источники на английском)
-    rag_text = retrieve_snippets(
-        session,
-        query=query,
-        kind_filter=kind_filter,
-        top_k=8,
+    # Эмбеддинг вопроса считаем один раз: и для кеша, и для поиска
+    q_emb = embed_texts([query])[0]
+    version = answer_cache.corpus_version(session, kind_filter)
+
+    cached = answer_cache.lookup(session, embedding=q_emb, kind_filter=kind_filter, version=version)
+    if cached is not None:
+        return cached
+
+    # Ответ не зависит от кейса: ключ - запрос, фильтр и версия корпуса
+    key = flight_key(
+        "rag",
+        corpus_version=version,
+        extra=f"{answer_cache.kind_key(kind_filter)}\0{query}\0{user_prompt_template}",
+    )
+    answer, _shared = get_singleflight().do(
+        key,
+        lambda: _answer_and_store(query, q_emb, user_prompt_template, kind_filter, version),
     )
+    return answer
+
+
+def _answer_and_store(query: str, q_emb: list[float], user_prompt_template: str,
+                      kind_filter: list[str] | None, version: str) -> str:
+    """
+    Runs under the single-flight lock. Own short sessions: the stored answer is
+    committed before the lock is released, so the next holder finds it in the cache.
+    """
+    with db_session() as session:
+        # Пока ждали лок, ответ мог сохранить другой процесс
+        cached = answer_cache.lookup(session, embedding=q_emb, kind_filter=kind_filter, version=version,
+                                     record_miss=False)
+        if cached is not None:
+            return cached
+
+        # 1. Ищем в базе (источники на английском)
+        rows = retrieve_chunks(
+            session,
+            query_embedding=q_emb,
+            kind_filter=kind_filter,
+            top_k=8,
+        )
+        rag_text = render_snippets(rows)
 
     if not rag_text:
         return "К сожалению, я не нашел информации в официальных источниках."
@@ -56,6 +95,18 @@ def _simple_rag_query(session: Session, chat_id: str, query: str, user_prompt_te
         max_output_tokens=1500 # Чуть больше токенов для перевода
     )
 
+    # Ошибки провайдера не кешируем
+    if not result.meta.get("error"):
+        with db_session() as session:
+            answer_cache.store(
+                session,
+                question=query,
+                embedding=q_emb,
+                kind_filter=kind_filter,
+                version=version,
+                answer=result.text,
+            )
+
     return result.text
 
 # --- ИЗМЕНЕНИЕ: Вопросы в функциях тоже лучше адаптировать,
@@ -96,4 +147,17 @@ def cmd_premium(session: Session, chat_id: str) -> str:
         query="I-907 premium processing instructions I-140 eligibility",
         user_prompt_template="Объясни, как запросить Premium Processing (I-907) для EB-1A.",
         kind_filter=["form_i907", "form_i140"]
-    )
\ No newline at end of file
+    )
+
+def cmd_ask(session: Session, chat_id: str, question: str) -> str:
+    # Свободный вопрос: ищем по всему корпусу, вопрос пользователя - и запрос, и задание
+    return _simple_rag_query(
+        session,
+        chat_id,
+        query=question,
+        user_prompt_template=f"Ответь на вопрос пользователя на основе источников: {question}",
+        kind_filter=None,
+    )
+
+def cmd_cache_stats(session: Session) -> str:
+    return f"{answer_cache.format_stats(session)}\n{get_singleflight().format_stats()}\n{chat_state_stats()}\n{context_cache_stats()}"
@@ -0,0 +1,418 @@
+# app/telegram/outbox.py
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Set
+
+import requests
+import telebot
+from telebot.apihelper import ApiTelegramException
+
+# Лимиты Telegram: ~30 сообщений/с на бота, ~1/с в личный чат, 20/мин в группу
+# Лимит общий на бота, а не на процесс: бот (или его шарды) и воркер делят его по долям
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+OUTBOX_WORKER_SHARE = float(os.getenv("OUTBOX_WORKER_SHARE", "0.2"))
+# Доля конкретного процесса; шардам ее выставляет shard_env
+OUTBOX_PROCESS_RATE = os.getenv("OUTBOX_PROCESS_RATE")
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_CHAT_BURST = int(os.getenv("OUTBOX_CHAT_BURST", "3"))
+OUTBOX_GROUP_RATE = float(os.getenv("OUTBOX_GROUP_RATE", str(20 / 60)))
+OUTBOX_SENDERS = int(os.getenv("OUTBOX_SENDERS", "4"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+
+# Запас до 4096: при разрезе внутри ``` блок закрывается и открывается заново
+TG_LIMIT = 4000
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """
+        Seconds until a token is available (0 if one is available now). Does not consume.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def try_take(self) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def take(self) -> None:
+        while not self.try_take():
+            time.sleep(self.delay() or 0.01)
+
+
+def process_rate(role: str = "bot", shards: int = 1) -> float:
+    """
+    This process's share of the bot-wide send rate: the worker gets OUTBOX_WORKER_SHARE,
+    the bot the rest, split evenly between shards.
+    """
+    share = min(max(OUTBOX_WORKER_SHARE, 0.0), 1.0)
+    if role == "worker":
+        return OUTBOX_GLOBAL_RATE * share
+    return OUTBOX_GLOBAL_RATE * (1 - share) / max(1, shards)
+
+
+# -------------------- entity-safe splitting --------------------
+
+def _safe_cut_points(window: str) -> Dict[str, int]:
+    """
+    One pass over the window: for each separator kind, the rightmost cut position
+    where no legacy-Markdown entity (*bold*, _italic_, `code`, [link](url)) is open.
+    Code fences may be open - the splitter closes and reopens them.
+    """
+    best = {"\n\n": 0, "\n": 0, " ": 0}
+    in_fence = in_code = False
+    stars = unders = brackets = 0
+    i, n = 0, len(window)
+    while i < n:
+        if window.startswith("```", i):
+            in_fence = not in_fence
+            i += 3
+            continue
+        ch = window[i]
+        if not in_fence:
+            if ch == "`":
+                in_code = not in_code
+            elif not in_code:
+                if ch == "*":
+                    stars ^= 1
+                elif ch == "_":
+                    unders ^= 1
+                elif ch == "[":
+                    brackets += 1
+                elif ch == ")" and brackets:
+                    brackets -= 1
+        i += 1
+        balanced = not in_code and not stars and not unders and not brackets
+        if balanced and ch in "\n ":
+            if ch == "\n" and i >= 2 and window[i - 2] == "\n":
+                best["\n\n"] = i
+            if ch == "\n":
+                best["\n"] = i
+            best[" "] = i
+    return best
+
+
+def _opens_empty_fence(head: str) -> bool:
+    """
+    True if head ends inside a ``` block that has nothing after its opening line.
+    """
+    if head.count("```") % 2 == 0:
+        return False
+    opener, _, body = head[head.rfind("```") + 3:].partition("\n")
+    return not body.strip()
+
+
+def split_message(text: str, limit: int = TG_LIMIT) -> List[str]:
+    """
+    Splits on paragraph, then line, then word boundaries, never inside an inline
+    entity; an open ``` block is closed at the end of a part and reopened in the next.
+    Falls back to a hard cut only for unbreakable runs.
+    """
+    parts: List[str] = []
+    text = text.strip()
+    while len(text) > limit:
+        window = text[:limit - 4]
+        points = _safe_cut_points(window)
+        # Абзац, если он не слишком рано; иначе строка; иначе слово
+        cut = next((points[sep] for sep in ("\n\n", "\n", " ") if points[sep] > len(window) // 3), 0)
+        # Нет безопасной точки (непарные * или _ - такой текст все равно уйдет plain text): режем по строке
+        cut = cut or max(points.values()) or (window.rfind("\n") + 1) or (window.rfind(" ") + 1) or len(window)
+        if _opens_empty_fence(text[:cut]):
+            # Точка сразу за ``` (длинная строка в блоке кода): часть была бы пустой,
+            # а остаток с заново открытым блоком - не короче текста. Режем внутри блока
+            cut = len(window)
+
+        head, text = text[:cut].rstrip(), text[cut:].lstrip("\n ")
+        if head.count("```") % 2:
+            head += "\n```"
+            text = "```\n" + text
+        parts.append(head)
+    if text:
+        parts.append(text)
+    return parts
+
+
+# -------------------- outbox --------------------
+
+@dataclass
+class OutMessage:
+    chat_id: int | str
+    text: str
+    parse_mode: Optional[str] = "Markdown"
+    reply_to_message_id: Optional[int] = None
+    edit_message_id: Optional[int] = None
+    reply_markup: Optional[Any] = None
+    future: Future = field(default_factory=Future)
+    attempts: int = 0
+
+
+@dataclass
+class OutboxStats:
+    sent: int = 0
+    edits: int = 0
+    rate_limited: int = 0
+    plain_fallbacks: int = 0
+    edits_superseded: int = 0
+    failed: int = 0
+
+
+class Outbox:
+    """
+    All outgoing Telegram traffic goes through here.
+    Per-chat FIFO queues (one message of a chat in flight at a time, so parts
+    arrive in order), a per-process share of the bot-wide rate and a per-chat token
+    bucket, 429 retry_after (pauses all sending - flood limits are per bot), and a plain-text retry when Telegram can't parse the Markdown.
+    send()/reply()/edit() return Futures resolved with the sent Message(s).
+    """
+
+    def __init__(self, bot: telebot.TeleBot, *, senders: int = OUTBOX_SENDERS,
+                 global_rate: Optional[float] = None) -> None:
+        self.bot = bot
+        if global_rate is None:
+            global_rate = float(OUTBOX_PROCESS_RATE) if OUTBOX_PROCESS_RATE else process_rate()
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.stats = OutboxStats()
+        self.senders = max(1, senders)
+        self.threads: List[threading.Thread] = []
+
+        self._queues: Dict[str, Deque[OutMessage]] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._not_before: Dict[str, float] = {}
+        self._paused_until = 0.0
+        self._busy: Set[str] = set()
+        self._cond = threading.Condition()
+        self._stopping = False
+
+    # ---- public API ----
+
+    def start(self) -> None:
+        for i in range(self.senders):
+            t = threading.Thread(target=self._sender, name=f"outbox-sender-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def send(self, chat_id: int | str, text: str, *, parse_mode: Optional[str] = "Markdown",
+             reply_to_message_id: Optional[int] = None, reply_markup: Optional[Any] = None) -> Future:
+        parts = split_message(text or "")
+        if not parts:
+            # Telegram отвечает 400 на пустой текст - ошибка вызывающего, а не доставки
+            raise ValueError("Outbox.send: empty message text")
+        futures = []
+        for i, part in enumerate(parts):
+            # reply_to только у первой части, клавиатура - у последней
+            msg = OutMessage(chat_id, part, parse_mode, reply_to_message_id if i == 0 else None,
+                             reply_markup=reply_markup if i == len(parts) - 1 else None)
+            futures.append(msg.future)
+            self._put(msg)
+        return _gather(futures)
+
+    def reply(self, message: telebot.types.Message, text: str, *,
+              parse_mode: Optional[str] = "Markdown", reply_markup: Optional[Any] = None) -> Future:
+        return self.send(message.chat.id, text, parse_mode=parse_mode, reply_to_message_id=message.message_id,
+                         reply_markup=reply_markup)
+
+    def edit(self, chat_id: int | str, message_id: int, text: str, *,
+             parse_mode: Optional[str] = None, reply_markup: Optional[Any] = None) -> Future:
+        """
+        Progress edits: a still-queued edit of the same message is replaced, not sent twice.
+        """
+        if not (text or "").strip():
+            raise ValueError("Outbox.edit: empty message text")
+        key = str(chat_id)
+        text = split_message(text)[0] if len(text) > TG_LIMIT else text
+        with self._cond:
+            for pending in self._queues.get(key, ()):
+                if pending.edit_message_id == message_id and pending.attempts == 0:
+                    pending.text, pending.parse_mode, pending.reply_markup = text, parse_mode, reply_markup
+                    self.stats.edits_superseded += 1
+                    return pending.future
+        msg = OutMessage(chat_id, text, parse_mode, edit_message_id=message_id, reply_markup=reply_markup)
+        self._put(msg)
+        return msg.future
+
+    def backlog(self) -> int:
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def stop(self, timeout_s: float = 30.0) -> None:
+        # Досылаем очередь, потом останавливаем отправителей
+        deadline = time.monotonic() + timeout_s
+        while self.backlog() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for t in self.threads:
+            t.join(timeout=max(0.0, deadline - time.monotonic()))
+
+    # ---- internals ----
+
+    def _chat_bucket(self, key: str) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            # Отрицательный chat_id - группа/канал, там лимит строже
+            rate = OUTBOX_GROUP_RATE if key.startswith("-") else OUTBOX_CHAT_RATE
+            bucket = self._buckets[key] = TokenBucket(rate, OUTBOX_CHAT_BURST)
+        return bucket
+
+    def _put(self, msg: OutMessage, *, front: bool = False) -> None:
+        key = str(msg.chat_id)
+        with self._cond:
+            q = self._queues.setdefault(key, deque())
+            q.appendleft(msg) if front else q.append(msg)
+            self._cond.notify()
+
+    def _next(self) -> Optional[OutMessage]:
+        """
+        Picks the first ready chat (not busy, not backing off, has a chat token).
+        Called under self._cond; waits until something is ready.
+        """
+        while not self._stopping:
+            now = time.monotonic()
+            if self._paused_until > now:
+                self._cond.wait(timeout=self._paused_until - now)
+                continue
+            wait = 1.0
+            for key, q in list(self._queues.items()):
+                if not q:
+                    del self._queues[key]
+                    continue
+                if key in self._busy:
+                    continue
+                nb = self._not_before.get(key, 0.0)
+                if nb > now:
+                    wait = min(wait, nb - now)
+                    continue
+                bucket = self._chat_bucket(key)
+                if not bucket.try_take():
+                    wait = min(wait, bucket.delay())
+                    continue
+                self._busy.add(key)
+                return q.popleft()
+            self._cond.wait(timeout=max(0.01, wait))
+        return None
+
+    def _sender(self) -> None:
+        while True:
+            with self._cond:
+                msg = self._next()
+            if msg is None:
+                return
+            key = str(msg.chat_id)
+            self.global_bucket.take()
+            # Сообщение могли взять до 429 в соседнем потоке - ждем конца паузы
+            while (pause := self._paused_until - time.monotonic()) > 0:
+                time.sleep(pause)
+            try:
+                self._deliver(msg)
+            finally:
+                with self._cond:
+                    self._busy.discard(key)
+                    self._cond.notify_all()
+
+    def _deliver(self, msg: OutMessage) -> None:
+        msg.attempts += 1
+        try:
+            if msg.edit_message_id is not None:
+                result = self.bot.edit_message_text(msg.text, chat_id=msg.chat_id, message_id=msg.edit_message_id,
+                                                    parse_mode=msg.parse_mode, reply_markup=msg.reply_markup)
+                self.stats.edits += 1
+            else:
+                result = self.bot.send_message(msg.chat_id, msg.text, parse_mode=msg.parse_mode,
+                                               reply_to_message_id=msg.reply_to_message_id,
+                                               allow_sending_without_reply=True, reply_markup=msg.reply_markup)
+                self.stats.sent += 1
+            msg.future.set_result(result)
+        except ApiTelegramException as e:
+            self._on_api_error(msg, e)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            self._retry(msg, e, delay=min(30.0, 2.0 ** msg.attempts))
+        except Exception as e:
+            self._fail(msg, e)
+
+    def _on_api_error(self, msg: OutMessage, e: ApiTelegramException) -> None:
+        if e.error_code == 429:
+            retry_after = float((e.result_json.get("parameters") or {}).get("retry_after", 5))
+            self.stats.rate_limited += 1
+            # Flood control действует на весь бот: останавливаем все чаты, не только этот
+            with self._cond:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            print(f"[Outbox] 429 in chat {msg.chat_id}: pausing all sends for {retry_after:.0f}s")
+            # 429 - не попытка: повторяем без учета лимита попыток, в начале очереди чата
+            msg.attempts -= 1
+            self._put(msg, front=True)
+            return
+        desc = (e.description or "").lower()
+        if e.error_code == 400 and msg.parse_mode and "parse entities" in desc:
+            # Вывод модели - не всегда валидный Markdown: шлем как обычный текст
+            self.stats.plain_fallbacks += 1
+            msg.parse_mode = None
+            self._put(msg, front=True)
+            return
+        if msg.edit_message_id is not None and "message is not modified" in desc:
+            msg.future.set_result(None)
+            return
+        if e.error_code >= 500:
+            self._retry(msg, e, delay=min(30.0, 2.0 ** msg.attempts))
+            return
+        self._fail(msg, e)
+
+    def _retry(self, msg: OutMessage, e: Exception, *, delay: float) -> None:
+        if msg.attempts >= OUTBOX_MAX_ATTEMPTS:
+            self._fail(msg, e)
+            return
+        with self._cond:
+            self._not_before[str(msg.chat_id)] = time.monotonic() + delay
+        self._put(msg, front=True)
+
+    def _fail(self, msg: OutMessage, e: Exception) -> None:
+        self.stats.failed += 1
+        print(f"[Outbox] delivery to chat {msg.chat_id} failed: {e}")
+        msg.future.set_exception(e)
+
+
+def _gather(futures: List[Future]) -> Future:
+    """
+    One Future for a multi-part message: resolves with the list of Messages,
+    or with the first part's error.
+    """
+    out: Future = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def _done(f: Future) -> None:
+        with lock:
+            if out.done():
+                return
+            if f.exception() is not None:
+                out.set_exception(f.exception())
+                return
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                out.set_result([x.result() for x in futures])
+
+    for f in futures:
+        f.add_done_callback(_done)
+    return out
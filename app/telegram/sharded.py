@@ -0,0 +1,302 @@
+# app/telegram/sharded.py
+from __future__ import annotations
+
+import importlib
+import json
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import telebot
+from aiohttp import web
+
+from app.telegram.admission import ADMISSION_MAX_CONCURRENT
+from app.telegram.outbox import process_rate
+from app.telegram.webhook import (
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_WORKERS,
+    UpdateDispatcher,
+    check_secret,
+    require_secret,
+    set_webhook,
+)
+
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", str(os.cpu_count() or 2)))
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "200"))
+SHARD_HEARTBEAT_S = float(os.getenv("SHARD_HEARTBEAT_S", "2"))
+SHARD_DRAIN_TIMEOUT_S = float(os.getenv("SHARD_DRAIN_TIMEOUT_S", "60"))
+# Общий бюджет соединений с Postgres на все шарды (каждый получает свою долю пула)
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "40"))
+# Соединений, которые один дорогой хендлер держит одновременно: сессия хендлера открыта на время
+# вызова LLM + соединение single-flight advisory lock + сессия сохранения ответа (/ask, RAG)
+DB_CONNECTIONS_PER_UPDATE = int(os.getenv("DB_CONNECTIONS_PER_UPDATE", "3"))
+
+# "module:function" -> (bot, on_stop). Вызывается в каждом дочернем процессе
+BotFactory = Callable[[], Tuple[Any, Optional[Callable[[], None]]]]
+DEFAULT_BOT_FACTORY = "app.main:create_shard_bot"
+
+
+def raw_chat_id(data: Dict[str, Any]) -> Optional[int]:
+    """
+    update_chat_id() on the raw JSON: the front process routes without parsing into telebot types.
+    """
+    msg = data.get("message") or data.get("edited_message")
+    if msg is None:
+        msg = (data.get("callback_query") or {}).get("message")
+    if msg is None:
+        return None
+    return (msg.get("chat") or {}).get("id")
+
+
+def shard_for(data: Dict[str, Any], shards: int) -> int:
+    chat_id = raw_chat_id(data)
+    key = str(chat_id if chat_id is not None else data.get("update_id", 0)).encode("utf-8")
+    return zlib.crc32(key) % shards
+
+
+def _load_factory(path: str) -> BotFactory:
+    module, _, name = path.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def shard_env(workers: int, threads: int = WEBHOOK_WORKERS) -> Tuple[int, Dict[str, str]]:
+    """
+    Per-shard settings derived from the totals: (update threads, env with DB pool, admission
+    slots and Telegram send rate). Update threads run cheap handlers (one connection each);
+    RAG/ingest handlers run on the admission pool, DB_CONNECTIONS_PER_UPDATE each. The pool
+    covers both at their peak; when the budget can't, update threads shrink first.
+    """
+    workers = max(1, workers)
+    per_shard = DB_CONNECTION_BUDGET // workers
+    slots = ADMISSION_MAX_CONCURRENT
+    want = (threads, slots)
+    while threads + slots * DB_CONNECTIONS_PER_UPDATE > per_shard and (slots > 1 or threads > 1):
+        # Потоки апдейтов только раздают работу - урезаем их первыми, но не до одного
+        if threads > 2:
+            threads -= 1
+        elif slots > 1:
+            slots -= 1
+        else:
+            threads -= 1
+    if (threads, slots) != want:
+        print(f"[Shards] DB_CONNECTION_BUDGET={DB_CONNECTION_BUDGET} covers {threads} update thread(s) and "
+              f"{slots} admission slot(s) per shard, not {want[0]} and {want[1]}")
+    return threads, {
+        "DB_POOL_SIZE": str(threads + slots * DB_CONNECTIONS_PER_UPDATE),
+        "DB_MAX_OVERFLOW": "0",
+        "ADMISSION_MAX_CONCURRENT": str(slots),
+        # Доля бота в общем лимите Telegram делится между шардами (воркер шлет из своей доли)
+        "OUTBOX_PROCESS_RATE": f"{process_rate('bot', workers):.3f}",
+    }
+
+
+def _shard_main(index: int, factory_path: str, q: "mp.Queue", heartbeat: Any, processed: Any,
+                threads: int) -> None:
+    bot, on_stop = _load_factory(factory_path)()
+
+    dispatcher = UpdateDispatcher(bot, workers=threads)
+    dispatcher.start()
+
+    stop = threading.Event()
+    # После рестарта шарда счетчик продолжается, а не обнуляется
+    base = processed.value
+
+    def _beat() -> None:
+        while not stop.is_set():
+            heartbeat.value = time.time()
+            processed.value = base + dispatcher.processed
+            stop.wait(SHARD_HEARTBEAT_S)
+
+    threading.Thread(target=_beat, daemon=True).start()
+
+    while True:
+        raw = q.get()
+        if raw is None:
+            break
+        try:
+            update = telebot.types.Update.de_json(json.loads(raw))
+        except Exception as e:
+            print(f"[Shard {index}] bad update: {e}")
+            continue
+        # Очередь между процессами ограничена, здесь просто ждем место
+        dispatcher.submit(update, timeout=3600)
+
+    # Graceful drain: доделываем принятые апдейты, досылаем ответы
+    dispatcher.stop(timeout_s=SHARD_DRAIN_TIMEOUT_S)
+    processed.value = base + dispatcher.processed
+    if on_stop is not None:
+        on_stop()
+    stop.set()
+
+
+@dataclass
+class Shard:
+    index: int
+    queue: "mp.Queue"
+    heartbeat: Any
+    processed: Any
+    process: Optional[mp.process.BaseProcess] = None
+    restarts: int = 0
+
+
+class ShardedRunner:
+    """
+    N worker processes; updates go to crc32(chat_id) % N, so a chat always lands
+    on the same process and its updates stay in order (each process keeps per-chat
+    ordering with its own UpdateDispatcher). Dead shards are restarted on the same
+    queue; drain() stops intake and lets every shard finish what it accepted.
+    """
+
+    def __init__(self, workers: int = SHARD_WORKERS, *, factory: str = DEFAULT_BOT_FACTORY,
+                 queue_size: int = SHARD_QUEUE_SIZE, threads_per_shard: int = WEBHOOK_WORKERS) -> None:
+        self.ctx = mp.get_context("spawn")
+        self.factory = factory
+        self.threads_per_shard, self.env = shard_env(workers, threads_per_shard)
+        self.shards: List[Shard] = [
+            Shard(i, self.ctx.Queue(maxsize=queue_size), self.ctx.Value("d", 0.0), self.ctx.Value("q", 0))
+            for i in range(max(1, workers))
+        ]
+        self.accepting = False
+        self.rejected = 0
+        self._draining = False
+        self._supervisor: Optional[threading.Thread] = None
+
+    def _spawn(self, shard: Shard) -> None:
+        shard.process = self.ctx.Process(
+            target=_shard_main,
+            args=(shard.index, self.factory, shard.queue, shard.heartbeat, shard.processed, self.threads_per_shard),
+            name=f"bot-shard-{shard.index}",
+        )
+        # spawn копирует окружение родителя в момент start(): так пул БД и outbox
+        # шарда настраиваются до любых импортов app.* в дочернем процессе
+        saved = {k: os.environ.get(k) for k in self.env}
+        os.environ.update(self.env)
+        try:
+            shard.process.start()
+        finally:
+            for k, v in saved.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+
+    def start(self) -> None:
+        for shard in self.shards:
+            self._spawn(shard)
+        self.accepting = True
+        self._supervisor = threading.Thread(target=self._supervise, daemon=True)
+        self._supervisor.start()
+
+    def _supervise(self) -> None:
+        while not self._draining:
+            for shard in self.shards:
+                if self._draining:
+                    return
+                if shard.process is not None and not shard.process.is_alive():
+                    print(f"[Shards] shard {shard.index} exited ({shard.process.exitcode}), restarting")
+                    shard.restarts += 1
+                    self._spawn(shard)
+            time.sleep(1.0)
+
+    def submit(self, data: Dict[str, Any], timeout: Optional[float] = None) -> bool:
+        if not self.accepting:
+            return False
+        shard = self.shards[shard_for(data, len(self.shards))]
+        try:
+            shard.queue.put(json.dumps(data), block=timeout is not None, timeout=timeout)
+            return True
+        except queue.Full:
+            self.rejected += 1
+            return False
+
+    def processed(self) -> int:
+        return sum(s.processed.value for s in self.shards)
+
+    def health(self) -> Dict[str, Any]:
+        now = time.time()
+        shards = []
+        for s in self.shards:
+            age = now - s.heartbeat.value if s.heartbeat.value else None
+            alive = s.process is not None and s.process.is_alive()
+            shards.append({
+                "index": s.index,
+                "pid": s.process.pid if s.process else None,
+                "alive": alive,
+                "healthy": alive and age is not None and age < SHARD_HEARTBEAT_S * 5,
+                "heartbeat_age_s": round(age, 1) if age is not None else None,
+                "backlog": s.queue.qsize(),
+                "processed": s.processed.value,
+                "restarts": s.restarts,
+            })
+        return {
+            "ok": self.accepting and all(s["healthy"] for s in shards),
+            "accepting": self.accepting,
+            "rejected": self.rejected,
+            "shards": shards,
+        }
+
+    def drain(self, timeout_s: float = SHARD_DRAIN_TIMEOUT_S) -> None:
+        self.accepting = False
+        self._draining = True
+        for s in self.shards:
+            s.queue.put(None)
+        deadline = time.monotonic() + timeout_s
+        for s in self.shards:
+            if s.process is None:
+                continue
+            s.process.join(timeout=max(0.0, deadline - time.monotonic()))
+            if s.process.is_alive():
+                print(f"[Shards] shard {s.index} did not drain in time, terminating")
+                s.process.terminate()
+
+
+def create_sharded_app(runner: ShardedRunner, *, secret: str = WEBHOOK_SECRET,
+                       path: str = WEBHOOK_PATH) -> web.Application:
+    require_secret(secret)
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if not check_secret(request, secret):
+            return web.Response(status=401)
+        try:
+            data = await request.json()
+        except Exception:
+            return web.Response(status=400)
+        # Шард переполнен или идет drain - 503, Telegram повторит доставку
+        if not runner.submit(data):
+            return web.Response(status=503)
+        return web.Response(status=200)
+
+    async def healthz(request: web.Request) -> web.Response:
+        report = runner.health()
+        return web.json_response(report, status=200 if report["ok"] else 503)
+
+    async def on_shutdown(app: web.Application) -> None:
+        runner.drain()
+
+    app = web.Application(client_max_size=1024 ** 2)
+    app.router.add_post(path, handle_update)
+    app.router.add_get("/healthz", healthz)
+    app.on_shutdown.append(on_shutdown)
+    return app
+
+
+def run_sharded(token: str, workers: int = SHARD_WORKERS) -> None:
+    """
+    Entry point for BOT_MODE=sharded: this process only receives webhooks and routes
+    them; handlers run in the shard processes (see app.main.create_shard_bot).
+    """
+    require_secret(WEBHOOK_SECRET)
+    runner = ShardedRunner(workers)
+    runner.start()
+    set_webhook(telebot.TeleBot(token, threaded=False))
+    print(f"Shards: {workers} processes, {runner.threads_per_shard} update threads, "
+          f"{runner.env['ADMISSION_MAX_CONCURRENT']} admission slots and DB pool {runner.env['DB_POOL_SIZE']} each")
+    web.run_app(create_sharded_app(runner), host=WEBHOOK_HOST, port=WEBHOOK_PORT)
@@ -0,0 +1,25 @@
+# app/telegram/uploads.py
+from __future__ import annotations
+
+import requests
+import telebot
+from telebot import apihelper
+
+from app.storage.files import BlobRef, BlobStore, get_blob_store
+
+# Bot API не отдает ботам файлы больше 20 МБ
+TELEGRAM_DOWNLOAD_LIMIT = 20 * 1024 * 1024
+
+
+def download_to_store(bot: telebot.TeleBot, file_id: str, store: BlobStore | None = None) -> BlobRef:
+    """
+    Streams a Telegram file straight into the blob store (hashed on the way, never held in memory).
+    Raises BlobTooLarge past TELEGRAM_DOWNLOAD_LIMIT.
+    """
+    info = bot.get_file(file_id)
+    url = (apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}").format(bot.token, info.file_path)
+
+    store = store or get_blob_store()
+    with requests.get(url, stream=True, timeout=60) as resp:
+        resp.raise_for_status()
+        return store.put_chunks(resp.iter_content(chunk_size=256 * 1024), max_bytes=TELEGRAM_DOWNLOAD_LIMIT)
@@ -0,0 +1,169 @@
+# app/telegram/webhook.py
+from __future__ import annotations
+
+import hmac
+import os
+import queue
+import threading
+import zlib
+from typing import List, Optional
+
+import telebot
+from aiohttp import web
+
+WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "")          # публичный https URL (ставится через setWebhook)
+WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")    # X-Telegram-Bot-Api-Secret-Token, обязателен
+WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "50"))
+
+
+def update_chat_id(update: telebot.types.Update) -> Optional[int]:
+    msg = update.message or update.edited_message
+    if msg is not None:
+        return msg.chat.id
+    if update.callback_query is not None and update.callback_query.message is not None:
+        return update.callback_query.message.chat.id
+    return None
+
+
+class UpdateDispatcher:
+    """
+    Bounded worker pool for incoming updates.
+    Each worker owns a queue; updates are routed by chat_id, so one chat's
+    updates are handled in order while different chats run in parallel.
+    """
+
+    def __init__(self, bot: telebot.TeleBot, *, workers: int = WEBHOOK_WORKERS,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE) -> None:
+        self.bot = bot
+        self.queues: List[queue.Queue] = [queue.Queue(maxsize=queue_size) for _ in range(max(1, workers))]
+        self.threads: List[threading.Thread] = []
+        self.processed = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        for i, q in enumerate(self.queues):
+            t = threading.Thread(target=self._worker, args=(q,), name=f"update-worker-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def _worker(self, q: queue.Queue) -> None:
+        while True:
+            update = q.get()
+            if update is None:
+                q.task_done()
+                return
+            try:
+                self.bot.process_new_updates([update])
+            except Exception as e:
+                print(f"[Webhook] Update {update.update_id} failed: {e}")
+            finally:
+                with self._lock:
+                    self.processed += 1
+                q.task_done()
+
+    def submit(self, update: telebot.types.Update, timeout: Optional[float] = None) -> bool:
+        """
+        Non-blocking by default; with a timeout, waits for room in the chat's queue.
+        """
+        chat_id = update_chat_id(update)
+        key = str(chat_id if chat_id is not None else update.update_id).encode("utf-8")
+        q = self.queues[zlib.crc32(key) % len(self.queues)]
+        try:
+            if timeout is None:
+                q.put_nowait(update)
+            else:
+                q.put(update, timeout=timeout)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+
+    def backlog(self) -> int:
+        return sum(q.qsize() for q in self.queues)
+
+    def stop(self, timeout_s: float = 30.0) -> None:
+        # Дорабатываем уже принятые апдейты, потом гасим воркеров
+        for q in self.queues:
+            q.put(None)
+        for t in self.threads:
+            t.join(timeout=timeout_s)
+
+
+def require_secret(secret: str) -> None:
+    # Без секрета публичный эндпоинт принял бы поддельные апдейты от кого угодно
+    if not secret:
+        raise ValueError("TELEGRAM_WEBHOOK_SECRET is required in webhook and sharded modes")
+
+
+def check_secret(request: web.Request, secret: str) -> bool:
+    if not secret:
+        return False
+    got = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    return hmac.compare_digest(got, secret)
+
+
+def set_webhook(bot: telebot.TeleBot) -> None:
+    if WEBHOOK_URL:
+        bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=100,
+        )
+        print(f"Webhook set to {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+
+
+def create_app(bot: telebot.TeleBot, dispatcher: UpdateDispatcher, *, secret: str = WEBHOOK_SECRET,
+               path: str = WEBHOOK_PATH) -> web.Application:
+    require_secret(secret)
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if not check_secret(request, secret):
+            return web.Response(status=401)
+        try:
+            data = await request.json()
+            update = telebot.types.Update.de_json(data)
+        except Exception:
+            return web.Response(status=400)
+
+        # Подтверждаем сразу; если очередь полна - 503, Telegram повторит доставку позже
+        if not dispatcher.submit(update):
+            return web.Response(status=503)
+        return web.Response(status=200)
+
+    async def healthz(request: web.Request) -> web.Response:
+        return web.json_response({
+            "ok": True,
+            "workers": len(dispatcher.threads),
+            "backlog": dispatcher.backlog(),
+            "processed": dispatcher.processed,
+            "rejected": dispatcher.rejected,
+        })
+
+    async def on_shutdown(app: web.Application) -> None:
+        dispatcher.stop()
+
+    app = web.Application(client_max_size=1024 ** 2)
+    app.router.add_post(path, handle_update)
+    app.router.add_get("/healthz", healthz)
+    app.on_shutdown.append(on_shutdown)
+    return app
+
+
+def run_webhook(bot: telebot.TeleBot) -> None:
+    """
+    Webhook entry point. Handlers run in the dispatcher's threads, so create
+    the bot with threaded=False. Several replicas can run behind a load balancer;
+    only set TELEGRAM_WEBHOOK_URL on one of them (or on a deploy step).
+    """
+    dispatcher = UpdateDispatcher(bot)
+    dispatcher.start()
+
+    set_webhook(bot)
+    app = create_app(bot, dispatcher)
+    web.run_app(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
@@ -0,0 +1,194 @@
+# app/utils/diff.py
+from __future__ import annotations
+
+import difflib
+import hashlib
+import os
+import re
+import zlib
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+# Слишком мелкие секции приклеиваются к предыдущей, слишком крупные режутся по абзацам
+SECTION_MIN_CHARS = int(os.getenv("SECTION_MIN_CHARS", "300"))
+SECTION_MAX_CHARS = int(os.getenv("SECTION_MAX_CHARS", "6000"))
+
+_WS_RE = re.compile(r"\s+")
+_PARA_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+# Уровни разреза длинного текста: абзацы, строки, предложения; дальше - жесткий разрез
+_CUT_LEVELS = ((_PARA_RE, "\n\n"), (re.compile(r"\n"), "\n"), (_SENTENCE_RE, " "))
+_HEADING_RE = re.compile(
+    r"^(?:"
+    r"#{1,6}\s+\S.*"                                               # markdown
+    r"|(?:\d{1,2}(?:\.\d{1,2})*|[IVXLC]{1,6})[.)]\s+[A-ZА-ЯЁ].*"   # 1. / 2.3) / IV.
+    r"|(?i:criterion|критерий|part|section|раздел)\s+[\w.-]+\b.*"
+    r")$"
+)
+
+
+@dataclass(frozen=True)
+class Section:
+    index: int
+    title: str
+    text: str
+    # sha256 of the heading + whitespace-normalized body: formatting-only edits keep the hash
+    hash: str
+
+
+def normalize(text: str) -> str:
+    return _WS_RE.sub(" ", text).strip()
+
+
+def section_hash(title: str, text: str) -> str:
+    return hashlib.sha256(f"{normalize(title)}\n{normalize(text)}".encode("utf-8")).hexdigest()
+
+
+def _is_heading(line: str) -> bool:
+    s = line.strip()
+    if not s or len(s) > 120:
+        return False
+    if s.startswith("#"):
+        return bool(_HEADING_RE.match(s))
+    if s.endswith((".", ",", ";", ":")) and not s.endswith("::"):
+        return False
+    if _HEADING_RE.match(s):
+        return True
+    # ЗАГОЛОВОК КАПСОМ
+    letters = [c for c in s if c.isalpha()]
+    return len(letters) >= 4 and all(c.isupper() for c in letters)
+
+
+def _split_long(body: str, max_chars: int, level: int = 0) -> List[str]:
+    """
+    Content-defined cuts at paragraph boundaries: a cut depends only on the paragraph
+    itself, so an edit in one place doesn't shift every later part.
+    A paragraph that alone exceeds max_chars is cut by lines, then sentences, then hard.
+    """
+    if level == len(_CUT_LEVELS):
+        return [body[i:i + max_chars] for i in range(0, len(body), max_chars)]
+    pattern, joiner = _CUT_LEVELS[level]
+    parts, cur, size = [], [], 0
+    target = max_chars // 3
+
+    def _flush() -> None:
+        nonlocal cur, size
+        if cur:
+            parts.append(joiner.join(cur))
+        cur, size = [], 0
+
+    for p in pattern.split(body):
+        if not p.strip():
+            continue
+        if len(p) > max_chars:
+            # Абзац без разрывов (DOCX без заголовков склеен через \n) - режем мельче
+            _flush()
+            parts.extend(_split_long(p, max_chars, level + 1))
+            continue
+        if cur and size + len(p) > max_chars:
+            _flush()
+        cur.append(p)
+        size += len(p) + len(joiner)
+        if size >= target and zlib.crc32(normalize(p).encode("utf-8")) % 4 == 0:
+            _flush()
+    _flush()
+    return parts
+
+
+def split_sections(text: str, *, min_chars: int = SECTION_MIN_CHARS,
+                   max_chars: int = SECTION_MAX_CHARS) -> List[Section]:
+    """
+    Heading-delimited sections (markdown, numbered, "Criterion N", CAPS lines).
+    Text without headings becomes one "Document" section, cut into parts if long.
+    """
+    blocks: List[List[str]] = []  # [title, body]
+    title, body = "Document", []
+    for line in (text or "").splitlines():
+        if _is_heading(line):
+            if body or blocks or title != "Document":
+                blocks.append([title, "\n".join(body).strip()])
+            title, body = line.strip().lstrip("#").strip(), []
+        else:
+            body.append(line)
+    blocks.append([title, "\n".join(body).strip()])
+
+    merged: List[List[str]] = []
+    for t, b in blocks:
+        if merged and len(b) + len(t) < min_chars:
+            # Мелкий блок (или заголовок без текста) - часть предыдущей секции
+            merged[-1][1] = f"{merged[-1][1]}\n\n{t}\n{b}".strip()
+        elif b or t != "Document":
+            merged.append([t, b])
+
+    sections: List[Section] = []
+    for t, b in merged:
+        pieces = _split_long(b, max_chars) if len(b) > max_chars else [b]
+        for k, piece in enumerate(pieces):
+            label = t if len(pieces) == 1 else f"{t} (part {k + 1})"
+            sections.append(Section(index=len(sections), title=label, text=piece,
+                                    hash=section_hash(t, piece)))
+    return sections
+
+
+def render_sections(sections: List[Section]) -> str:
+    return "\n\n".join(f"### SECTION {s.index + 1}: {s.title}\n{s.text}" for s in sections)
+
+
+# -------------------- diff --------------------
+
+@dataclass
+class SectionChange:
+    status: str  # unchanged | changed | added
+    section: Section
+    previous: Optional[Section] = None
+
+
+@dataclass
+class SectionDiff:
+    changes: List[SectionChange] = field(default_factory=list)
+    removed: List[Section] = field(default_factory=list)
+
+    def count(self, status: str) -> int:
+        return sum(1 for c in self.changes if c.status == status)
+
+    def summary(self) -> str:
+        return (f"{self.count('changed')} changed, {self.count('added')} added, "
+                f"{len(self.removed)} removed, {self.count('unchanged')} unchanged")
+
+
+def diff_sections(old: Optional[List[Section]], new: List[Section]) -> SectionDiff:
+    """
+    Aligns sections by hash (difflib on the hash sequences). A replaced run is paired
+    position by position, so an edited section is "changed" with its previous text.
+    """
+    if not old:
+        return SectionDiff(changes=[SectionChange("added", s) for s in new])
+
+    out = SectionDiff()
+    sm = difflib.SequenceMatcher(None, [s.hash for s in old], [s.hash for s in new], autojunk=False)
+    for op, i1, i2, j1, j2 in sm.get_opcodes():
+        if op == "equal":
+            out.changes += [SectionChange("unchanged", s, old[i1 + k]) for k, s in enumerate(new[j1:j2])]
+        elif op == "insert":
+            out.changes += [SectionChange("added", s) for s in new[j1:j2]]
+        elif op == "delete":
+            out.removed += old[i1:i2]
+        else:
+            paired = min(i2 - i1, j2 - j1)
+            out.changes += [SectionChange("changed", new[j1 + k], old[i1 + k]) for k in range(paired)]
+            out.changes += [SectionChange("added", s) for s in new[j1 + paired:j2]]
+            out.removed += old[i1 + paired:i2]
+    return out
+
+
+def compact_diff(old_text: str, new_text: str, *, max_lines: int = 60) -> str:
+    """
+    Changed lines only (+/-), for telling the reviewer what was edited.
+    """
+    lines = [
+        line for line in difflib.unified_diff(old_text.splitlines(), new_text.splitlines(), lineterm="", n=0)
+        if not line.startswith(("---", "+++", "@@"))
+    ]
+    if len(lines) > max_lines:
+        lines = lines[:max_lines] + [f"... ({len(lines) - max_lines} more changed lines)"]
+    return "\n".join(lines)
@@ -0,0 +1,169 @@
+# app/utils/text_extract.py
+from __future__ import annotations
+
+import codecs
+import multiprocessing as mp
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, Optional
+
+from app.storage.files import get_blob_store, open_mmap
+
+# Парсеры опциональны: без них соответствующий формат просто не поддерживается
+try:
+    from pypdf import PdfReader
+except ImportError:  # pragma: no cover
+    PdfReader = None
+
+try:
+    import docx
+except ImportError:  # pragma: no cover
+    docx = None
+
+TEXT_EXTRACT_WORKERS = int(os.getenv("TEXT_EXTRACT_WORKERS", "2"))
+# Больше в LLM все равно не уйдет; защищает от гигантских файлов
+MAX_EXTRACT_CHARS = int(os.getenv("MAX_EXTRACT_CHARS", "2000000"))
+
+SUPPORTED_EXTENSIONS = {".pdf": "pdf", ".docx": "docx", ".txt": "txt", ".md": "txt"}
+
+
+class UnsupportedFileType(ValueError):
+    pass
+
+
+@dataclass
+class ExtractResult:
+    text: str
+    kind: str
+    pages: int
+    truncated: bool = False
+
+
+def detect_kind(filename: str) -> str:
+    ext = os.path.splitext(filename.lower())[1]
+    kind = SUPPORTED_EXTENSIONS.get(ext)
+    if kind is None:
+        raise UnsupportedFileType(f"Unsupported file type '{ext or filename}'. Send PDF, DOCX or TXT.")
+    if kind == "pdf" and PdfReader is None:
+        raise UnsupportedFileType("PDF support is not installed (pip install pypdf).")
+    if kind == "docx" and docx is None:
+        raise UnsupportedFileType("DOCX support is not installed (pip install python-docx).")
+    return kind
+
+
+# -------------------- per-format page iterators --------------------
+
+# Итератор отдает его, если уже отданное надо выбросить: TXT перечитывается в другой кодировке
+RESTART = object()
+
+# Все итераторы читают из бинарного потока (mmap файла из хранилища), а не по пути
+
+def iter_pdf_pages(f: BinaryIO) -> Iterator[str]:
+    # PdfReader читает объекты по мере надобности: в памяти только текущая страница
+    reader = PdfReader(f)
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+
+def _docx_text(el) -> str:
+    return "".join(t.text or "" for t in el.iter() if t.tag.endswith("}t"))
+
+
+def iter_docx_blocks(f: BinaryIO) -> Iterator[str]:
+    # В DOCX нет страниц: отдаем абзацы и строки таблиц в порядке документа
+    document = docx.Document(f)
+    for child in document.element.body.iterchildren():
+        tag = child.tag.rsplit("}", 1)[-1]
+        if tag == "p":
+            yield _docx_text(child)
+        elif tag == "tbl":
+            for row in child.iter():
+                if row.tag.endswith("}tr"):
+                    yield " | ".join(_docx_text(cell).strip() for cell in row.iter() if cell.tag.endswith("}tc"))
+
+
+def iter_txt_blocks(f: BinaryIO, block_bytes: int = 64 * 1024) -> Iterator[str]:
+    # Русские файлы из Windows бывают в cp1251: если utf-8 не подошел - перечитываем.
+    # Блоки отдаются сразу; ошибка декодирования в середине файла -> RESTART и новый проход
+    for i, (encoding, errors) in enumerate((("utf-8-sig", "strict"), ("cp1251", "strict"), ("utf-8", "replace"))):
+        if i:
+            yield RESTART
+        f.seek(0)
+        decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+        try:
+            for raw in iter(lambda: f.read(block_bytes), b""):
+                yield decoder.decode(raw)
+            yield decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            continue
+        return
+
+
+_ITERATORS = {"pdf": iter_pdf_pages, "docx": iter_docx_blocks, "txt": iter_txt_blocks}
+_SEPARATORS = {"pdf": "\n\n", "docx": "\n", "txt": ""}
+
+
+def extract_stream(f: BinaryIO, filename: str, *, max_chars: int = MAX_EXTRACT_CHARS) -> ExtractResult:
+    """
+    Page by page (PDF) / block by block (DOCX, TXT); stops at max_chars.
+    """
+    kind = detect_kind(filename)
+    sep = _SEPARATORS[kind]
+    parts, total, pages, truncated = [], 0, 0, False
+    for piece in _ITERATORS[kind](f):
+        if piece is RESTART:
+            parts, total, pages = [], 0, 0
+            continue
+        pages += 1
+        piece = piece.strip() if kind != "txt" else piece
+        if not piece:
+            continue
+        if total + len(piece) > max_chars:
+            parts.append(piece[:max_chars - total])
+            truncated = True
+            break
+        parts.append(piece)
+        total += len(piece) + len(sep)
+    return ExtractResult(text=sep.join(parts).strip(), kind=kind, pages=pages, truncated=truncated)
+
+
+def extract_text(path: str, filename: Optional[str] = None, *, max_chars: int = MAX_EXTRACT_CHARS) -> ExtractResult:
+    with open_mmap(path) as mm:
+        return extract_stream(mm, filename or path, max_chars=max_chars)
+
+
+def extract_blob(sha256: str, filename: str) -> ExtractResult:
+    """
+    Runs in the pool process: reads the blob from the file store through mmap.
+    """
+    with get_blob_store().open_mmap(sha256) as mm:
+        return extract_stream(mm, filename)
+
+
+# -------------------- process pool --------------------
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    """
+    Parsing is CPU-bound: it runs in separate processes so handler threads
+    (and the GIL) stay free. spawn: the bot process has threads, fork is unsafe there.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, TEXT_EXTRACT_WORKERS),
+                mp_context=mp.get_context("spawn"),
+                # Парсеры PDF текут памятью на кривых файлах - периодически перезапускаем процессы
+                max_tasks_per_child=50,
+            )
+        return _pool
+
+
+def submit_extraction(sha256: str, filename: str) -> "Future[ExtractResult]":
+    return get_extraction_pool().submit(extract_blob, sha256, filename)
@@ -0,0 +1,45 @@
+# scripts/archive_runs.py
+from __future__ import annotations
+
+import sys
+import os
+from dotenv import load_dotenv
+
+# Настройка путей
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+load_dotenv(os.path.join(root_dir, '.env'))
+sys.path.append(root_dir)
+
+import argparse
+import json
+import time
+
+from app.storage.db import db_session
+from app.storage.run_archive import RUN_ARCHIVE_BATCH, RUN_RETENTION_DAYS, archive_old_runs, fetch_run
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old debate runs to compressed JSONL files (cold archive).")
+    parser.add_argument("--days", type=int, default=RUN_RETENTION_DAYS, help="Keep runs newer than this in the DB.")
+    parser.add_argument("--batch-size", type=int, default=RUN_ARCHIVE_BATCH)
+    parser.add_argument("--fetch", type=int, default=None, metavar="RUN_ID",
+                        help="Print one run (hot table or archive) as JSON instead of archiving.")
+    args = parser.parse_args()
+
+    if args.fetch is not None:
+        with db_session() as session:
+            record = fetch_run(session, args.fetch)
+        if record is None:
+            print(f"Run #{args.fetch} not found")
+            sys.exit(1)
+        print(json.dumps(record, ensure_ascii=False, indent=2))
+        return
+
+    t0 = time.perf_counter()
+    stats = archive_old_runs(days=args.days, batch_size=args.batch_size)
+    print(f"Archived {stats.summary()} in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# scripts/bench_bulk_import.py
+from __future__ import annotations
+
+import sys
+import os
+from dotenv import load_dotenv
+
+# Настройка путей
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+load_dotenv(os.path.join(root_dir, '.env'))
+sys.path.append(root_dir)
+
+import argparse
+import csv
+import json
+import random
+import tempfile
+import time
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.core.criteria import CRITERIA
+from app.storage.bulk import export_file, import_file
+from app.storage.db import db_session
+from app.storage.models import Case, EvidenceItem, EvidenceStatus
+
+_FIELDS = ("case_name", "exhibit_code", "title", "description", "criterion_tags", "strength", "status", "file_ids")
+
+
+def _rows(case_name: str, n: int, *, seed: int = 0):
+    rnd = random.Random(seed)
+    words = "letter award judging panel salary media article contribution critical role evidence".split()
+    for i in range(n):
+        yield {
+            "case_name": case_name,
+            "exhibit_code": f"X-{i}",
+            "title": f"Exhibit {i}: " + " ".join(rnd.choices(words, k=6)),
+            "description": " ".join(rnd.choices(words, k=rnd.randint(20, 60))),
+            "criterion_tags": rnd.sample(CRITERIA, k=rnd.randint(1, 3)),
+            "strength": rnd.randint(1, 5),
+            "status": "draft",
+            "file_ids": [],
+        }
+
+
+def _write(path: str, rows, fmt: str) -> None:
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if fmt == "jsonl":
+            for r in rows:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            return
+        w = csv.DictWriter(f, fieldnames=_FIELDS)
+        w.writeheader()
+        for r in rows:
+            w.writerow({**r, "criterion_tags": ";".join(r["criterion_tags"]), "file_ids": ""})
+
+
+def _ensure_case(name: str) -> None:
+    with db_session() as session:
+        session.execute(pg_insert(Case).values(name=name, memo_json={}, lock_mode=True)
+                        .on_conflict_do_nothing(index_elements=[Case.name]))
+
+
+def _drop_case(name: str) -> None:
+    with db_session() as session:
+        case_id = session.execute(select(Case.id).where(Case.name == name)).scalar_one_or_none()
+        if case_id is not None:
+            session.execute(delete(EvidenceItem).where(EvidenceItem.case_id == case_id))
+            session.execute(delete(Case).where(Case.id == case_id))
+
+
+def _timed_import(path: str) -> None:
+    t0 = time.perf_counter()
+    with db_session() as session:
+        stats = import_file(session, "evidence", path)
+    dt = time.perf_counter() - t0
+    print(f"  {stats.summary()}\n  {dt:.2f}s, {stats.rows / dt:,.0f} rows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput benchmark: bulk evidence import/export vs ORM inserts.")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    parser.add_argument("--orm-sample", type=int, default=2_000, help="Rows for the one-object-at-a-time baseline.")
+    parser.add_argument("--case-name", default="__bulk_bench__")
+    parser.add_argument("--keep", action="store_true", help="Keep the synthetic cases afterwards.")
+    args = parser.parse_args()
+
+    orm_case = args.case_name + "_orm"
+    _drop_case(args.case_name)
+    _drop_case(orm_case)
+    _ensure_case(args.case_name)
+    _ensure_case(orm_case)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, f"evidence.{args.format}")
+        _write(src, _rows(args.case_name, args.rows), args.format)
+        print(f"{args.rows:,} synthetic exhibits, {os.path.getsize(src) / 1_000_000:.1f} MB {args.format}\n")
+
+        print("COPY + merge, empty case:")
+        _timed_import(src)
+        print("COPY + merge, same file again (no changes):")
+        _timed_import(src)
+
+        # 1% правок: обновляются только они
+        changed = [dict(r, strength=(r["strength"] % 5) + 1) if i % 100 == 0 else r
+                   for i, r in enumerate(_rows(args.case_name, args.rows))]
+        _write(src, changed, args.format)
+        print("COPY + merge, 1% of rows edited:")
+        _timed_import(src)
+
+        out = os.path.join(tmp, f"export.{args.format}")
+        t0 = time.perf_counter()
+        with db_session() as session:
+            n = export_file(session, "evidence", out, case_names=[args.case_name])
+        dt = time.perf_counter() - t0
+        print(f"Streaming export:\n  {n:,} rows, {os.path.getsize(out) / 1_000_000:.1f} MB in {dt:.2f}s, "
+              f"{n / dt:,.0f} rows/s")
+
+    # Базовая линия: как раньше, по одному ORM-объекту
+    t0 = time.perf_counter()
+    with db_session() as session:
+        case_id = session.execute(select(Case.id).where(Case.name == orm_case)).scalar_one()
+        for r in _rows(orm_case, args.orm_sample):
+            session.add(EvidenceItem(case_id=case_id, exhibit_code=r["exhibit_code"], title=r["title"],
+                                     description=r["description"], criterion_tags=r["criterion_tags"],
+                                     strength=r["strength"], status=EvidenceStatus.draft, file_ids=[]))
+            session.flush()
+    dt = time.perf_counter() - t0
+    print(f"ORM baseline (one object per flush):\n  {args.orm_sample:,} rows in {dt:.2f}s, "
+          f"{args.orm_sample / dt:,.0f} rows/s")
+
+    if not args.keep:
+        _drop_case(args.case_name)
+        _drop_case(orm_case)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# scripts/bench_extract.py
+from __future__ import annotations
+
+import sys
+import os
+from dotenv import load_dotenv
+
+# Настройка путей
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+load_dotenv(os.path.join(root_dir, '.env'))
+sys.path.append(root_dir)
+
+import argparse
+import glob
+import time
+
+from bs4 import BeautifulSoup
+
+from app.rag.extract import lxml_html
+from app.rag.fetcher import HTTP_CACHE_DIR
+from app.rag.indexer import parse_page, chunk_sections
+
+# Закоммиченные большие страницы в разметке Policy Manual: бенчмарк воспроизводим без сети
+FIXTURE_DIR = os.path.join(root_dir, "bench", "fixtures", "extract")
+
+
+def _load_pages(paths):
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            files += sorted(glob.glob(os.path.join(p, "*.html")))
+        else:
+            files.append(p)
+    pages = []
+    for f in files:
+        with open(f, "r", encoding="utf-8", errors="replace") as fh:
+            pages.append((f, fh.read()))
+    return pages
+
+
+def _flat_baseline(html):
+    # Старый путь для сравнения: html.parser + плоский get_text
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style", "noscript", "header", "footer", "nav"]):
+        tag.decompose()
+    return soup.get_text("\n", strip=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput benchmark: HTML extraction + chunking.")
+    parser.add_argument("paths", nargs="*", default=[FIXTURE_DIR],
+                        help="Saved .html files or directories (default: bench/fixtures/extract; "
+                             f"live pages are in the RAG HTTP cache, {HTTP_CACHE_DIR}).")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pages = _load_pages(args.paths)
+    if not pages:
+        print("No saved pages found. Run scripts/update_uscis_sources.py first or pass .html files.")
+        return
+
+    sizes = [len(html.encode("utf-8")) for _, html in pages]
+    for (path, _), size in zip(pages, sizes):
+        print(f"  {size / 1000:8.1f} KB  {os.path.relpath(path, root_dir)}")
+    total_mb = sum(sizes) / 1_000_000
+    print(f"{len(pages)} pages, {total_mb:.2f} MB, repeat={args.repeat}\n")
+
+    parsers = ["html.parser"] + (["lxml"] if lxml_html is not None else [])
+
+    t0 = time.perf_counter()
+    for _ in range(args.repeat):
+        for _, html in pages:
+            _flat_baseline(html)
+    flat_s = (time.perf_counter() - t0) / args.repeat
+    print(f"{'flat get_text (old)':<22} extract {flat_s * 1000:8.1f} ms  {total_mb / flat_s:7.2f} MB/s")
+
+    for name in parsers:
+        extract_s = 0.0
+        chunk_s = 0.0
+        n_chunks = 0
+        for _ in range(args.repeat):
+            n_chunks = 0
+            for url, html in pages:
+                t0 = time.perf_counter()
+                page = parse_page(url, html, parser=name)
+                t1 = time.perf_counter()
+                n_chunks += len(chunk_sections(page.sections))
+                t2 = time.perf_counter()
+                extract_s += t1 - t0
+                chunk_s += t2 - t1
+        extract_s /= args.repeat
+        chunk_s /= args.repeat
+        print(
+            f"{'sections/' + name:<22} extract {extract_s * 1000:8.1f} ms  {total_mb / extract_s:7.2f} MB/s"
+            f"  | chunk {chunk_s * 1000:7.1f} ms  ({n_chunks} chunks)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+# scripts/bench_retrieval.py
+from __future__ import annotations
+
+import sys
+import os
+from dotenv import load_dotenv
+
+# Настройка путей
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+load_dotenv(os.path.join(root_dir, '.env'))
+sys.path.append(root_dir)
+
+import argparse
+import glob
+import hashlib
+import heapq
+import json
+import math
+import sqlite3
+import time
+from dataclasses import dataclass, asdict
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+from app.rag.crawler import compile_rules, match_rule
+from app.rag.embedder import EMBED_MODEL, estimate_tokens
+from app.rag.fetcher import HTTP_CACHE_DIR
+from app.rag.indexer import parse_page, chunk_sections, embed_texts, make_chunk_prefix
+from app.rag.retriever import render_snippets
+from app.rag.sources import RAG_SOURCES, CRAWL_RULES
+from app.telegram.commands_rag import RAG_SYSTEM
+
+GOLDEN_PATH = os.path.join(root_dir, "bench", "golden.json")
+# Закоммиченный корпус страниц: результаты воспроизводимы и без сети (CI)
+FIXTURE_DIR = os.path.join(root_dir, "bench", "fixtures")
+EMB_CACHE_PATH = os.path.join(root_dir, "bench", ".cache", "embeddings.sqlite")
+
+# name -> (backend, max_chars, overlap_chars, top_k, use_kind_filter)
+DEFAULT_CONFIGS = [
+    ("baseline", "memory", 2000, 200, 8, True),
+    ("top_k=4", "memory", 2000, 200, 4, True),
+    ("top_k=12", "memory", 2000, 200, 12, True),
+    ("chunk=1200/150", "memory", 1200, 150, 8, True),
+    ("no_kind_filter", "memory", 2000, 200, 8, False),
+]
+
+
+@dataclass
+class BenchConfig:
+    name: str
+    backend: str
+    max_chars: int
+    overlap_chars: int
+    top_k: int
+    use_kind_filter: bool
+
+
+@dataclass
+class BenchResult:
+    name: str
+    recall: float
+    mrr: float
+    hit_rate: float
+    p50_ms: float
+    p95_ms: float
+    prompt_tokens: float
+
+
+class EmbeddingCache:
+    """
+    sqlite-кеш эмбеддингов (model+text -> vector), чтобы повторные прогоны не стоили денег.
+    """
+
+    def __init__(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS emb (key TEXT PRIMARY KEY, vec TEXT NOT NULL)")
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha256((EMBED_MODEL + "\0" + text).encode("utf-8")).hexdigest()
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(t) for t in texts]
+        found: Dict[str, List[float]] = {}
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT key, vec FROM emb WHERE key IN ({','.join('?' * len(part))})", part
+            ).fetchall()
+            found.update((k, json.loads(v)) for k, v in rows)
+
+        missing = [i for i, k in enumerate(keys) if k not in found]
+        if missing:
+            vectors = embed_texts([texts[i] for i in missing])
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO emb (key, vec) VALUES (?, ?)",
+                [(keys[i], json.dumps(v)) for i, v in zip(missing, vectors)],
+            )
+            self.conn.commit()
+            for i, v in zip(missing, vectors):
+                found[keys[i]] = v
+        return [found[k] for k in keys]
+
+
+def _normalize(v: List[float]) -> List[float]:
+    n = math.sqrt(sum(x * x for x in v)) or 1.0
+    return [x / n for x in v]
+
+
+def _read_manifest(fixture_dir: str) -> Optional[dict]:
+    path = os.path.join(fixture_dir, "index.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_fixture_corpus(cache_dir: str) -> List[Tuple[str, str, str]]:
+    """
+    (kind, url, html) for every saved page: from a fixture dir with index.json
+    (bench/fixtures), or from an HTTP cache dir for URLs that are known sources.
+    """
+    manifest = _read_manifest(cache_dir)
+    if manifest is not None:
+        corpus = []
+        for page in manifest["pages"]:
+            with open(os.path.join(cache_dir, page["file"]), "r", encoding="utf-8") as f:
+                corpus.append((page["kind"], page["url"], f.read()))
+        return corpus
+
+    kinds = {src["url"]: src["kind"] for src in RAG_SOURCES}
+    rules = compile_rules(CRAWL_RULES)
+    corpus = []
+    for meta_path in sorted(glob.glob(os.path.join(cache_dir, "*.json"))):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            url = json.load(f).get("url", "")
+        kind = kinds.get(url)
+        if kind is None:
+            rule = match_rule(url, rules)
+            kind = rule.kind if rule else None
+        body_path = meta_path[:-len(".json")] + ".html"
+        if not kind or not os.path.exists(body_path):
+            continue
+        with open(body_path, "r", encoding="utf-8") as f:
+            corpus.append((kind, url, f.read()))
+    return corpus
+
+
+def save_fixtures(cache_dir: str, fixture_dir: str) -> int:
+    """
+    Replaces fixture pages with the live copies saved in the HTTP cache (same file names).
+    """
+    manifest = _read_manifest(fixture_dir) or {"pages": []}
+    files = {p["url"]: p["file"] for p in manifest["pages"]}
+    pages = []
+    for kind, url, html in load_fixture_corpus(cache_dir):
+        name = files.get(url) or hashlib.sha1(url.encode("utf-8")).hexdigest()[:12] + ".html"
+        with open(os.path.join(fixture_dir, name), "w", encoding="utf-8") as f:
+            f.write(html)
+        pages.append({"url": url, "kind": kind, "file": name})
+    # Страницы, которых нет в кеше, остаются как были
+    saved = {p["url"] for p in pages}
+    pages += [p for p in manifest["pages"] if p["url"] not in saved]
+    manifest["pages"] = pages
+    os.makedirs(fixture_dir, exist_ok=True)
+    with open(os.path.join(fixture_dir, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+    return len(saved)
+
+
+class MemoryIndex:
+    """
+    Re-chunks the fixture corpus with the config's chunking parameters and
+    searches by brute-force cosine, mirroring the pgvector ORDER BY ... LIMIT query.
+    """
+
+    def __init__(self, corpus, emb_cache: EmbeddingCache, *, max_chars: int, overlap_chars: int) -> None:
+        self.rows = []
+        for kind, url, html in corpus:
+            page = parse_page(url, html)
+            prefix = make_chunk_prefix(kind, url)
+            for i, c in enumerate(chunk_sections(page.sections, max_chars=max_chars, overlap_chars=overlap_chars)):
+                self.rows.append(SimpleNamespace(
+                    kind=kind, source_url=url, source_title=page.title,
+                    chunk_id=f"{prefix}-{i:04d}", text=c.text,
+                ))
+        self.vectors = [_normalize(v) for v in emb_cache.embed([r.text for r in self.rows])]
+
+    def search(self, q: List[float], *, kind_filter: Optional[List[str]], top_k: int):
+        kinds = set(kind_filter or [])
+        scored = (
+            (sum(a * b for a, b in zip(q, v)), i)
+            for i, v in enumerate(self.vectors)
+            if not kinds or self.rows[i].kind in kinds
+        )
+        return [self.rows[i] for _, i in heapq.nlargest(top_k, scored)]
+
+
+def _is_relevant(row, item) -> bool:
+    if row.source_url not in item["expected_urls"]:
+        return False
+    facts = item.get("expected_facts") or []
+    text = row.text.lower()
+    return not facts or any(f.lower() in text for f in facts)
+
+
+def _recall(rows, item) -> float:
+    facts = item.get("expected_facts") or []
+    relevant_rows = [r for r in rows if r.source_url in item["expected_urls"]]
+    if not facts:
+        return 1.0 if relevant_rows else 0.0
+    text = "\n".join(r.text.lower() for r in relevant_rows)
+    return sum(1 for f in facts if f.lower() in text) / len(facts)
+
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, max(0, math.ceil(p / 100 * len(s)) - 1))]
+
+
+def run_config(cfg: BenchConfig, questions, q_vectors, *, corpus, emb_cache, indexes) -> BenchResult:
+    if cfg.backend == "memory":
+        key = (cfg.max_chars, cfg.overlap_chars)
+        if key not in indexes:
+            indexes[key] = MemoryIndex(corpus, emb_cache, max_chars=cfg.max_chars, overlap_chars=cfg.overlap_chars)
+        index = indexes[key]
+
+        def search(qv, kinds):
+            return index.search(_normalize(qv), kind_filter=kinds, top_k=cfg.top_k)
+    else:
+        # Живая БД: меряем именно SQL из retrieve_chunks (чанкинг - тот, что проиндексирован)
+        from app.storage.db import db_session
+        from app.rag.retriever import retrieve_chunks
+
+        def search(qv, kinds):
+            with db_session() as session:
+                return retrieve_chunks(session, query_embedding=qv, kind_filter=kinds, top_k=cfg.top_k)
+
+    recalls, rr, hits, latencies, tokens = [], [], [], [], []
+    for item, qv in zip(questions, q_vectors):
+        kinds = item.get("kind_filter") if cfg.use_kind_filter else None
+        t0 = time.perf_counter()
+        rows = search(qv, kinds)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+        recalls.append(_recall(rows, item))
+        first = next((i for i, r in enumerate(rows, 1) if _is_relevant(r, item)), None)
+        rr.append(1.0 / first if first else 0.0)
+        hits.append(1.0 if first else 0.0)
+
+        # Тот же промпт, что собирает _simple_rag_query
+        user_msg = f"{item['question']}\n\n=== OFFICIAL SOURCES (ENGLISH) ===\n{render_snippets(rows)}"
+        tokens.append(estimate_tokens(RAG_SYSTEM) + estimate_tokens(user_msg))
+
+    n = len(questions) or 1
+    return BenchResult(
+        name=cfg.name,
+        recall=sum(recalls) / n,
+        mrr=sum(rr) / n,
+        hit_rate=sum(hits) / n,
+        p50_ms=_percentile(latencies, 50),
+        p95_ms=_percentile(latencies, 95),
+        prompt_tokens=sum(tokens) / n,
+    )
+
+
+def _parse_config(spec: str) -> BenchConfig:
+    # name:backend=memory,max_chars=2000,overlap=200,top_k=8,kind_filter=1
+    name, _, rest = spec.partition(":")
+    opts = dict(kv.split("=", 1) for kv in rest.split(",") if kv)
+    return BenchConfig(
+        name=name,
+        backend=opts.get("backend", "memory"),
+        max_chars=int(opts.get("max_chars", 2000)),
+        overlap_chars=int(opts.get("overlap", 200)),
+        top_k=int(opts.get("top_k", 8)),
+        use_kind_filter=opts.get("kind_filter", "1") not in ("0", "false", "off"),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval quality/latency benchmark over the golden question set.")
+    parser.add_argument("--golden", default=GOLDEN_PATH)
+    parser.add_argument("--corpus", default=FIXTURE_DIR,
+                        help="Fixture dir with index.json (default: bench/fixtures) or an HTTP cache dir.")
+    parser.add_argument("--save-fixtures", action="store_true",
+                        help=f"Copy live pages from {HTTP_CACHE_DIR} into --corpus and exit.")
+    parser.add_argument("--config", action="append", default=[],
+                        help="name:backend=memory|db,max_chars=..,overlap=..,top_k=..,kind_filter=0|1 (repeatable)")
+    parser.add_argument("--json", dest="json_out", default=None, help="Write results to this JSON file.")
+    parser.add_argument("--baseline", default=None, help="Previous --json output to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.02,
+                        help="Allowed drop in recall/MRR vs baseline before failing.")
+    args = parser.parse_args()
+
+    if args.save_fixtures:
+        print(f"Saved {save_fixtures(HTTP_CACHE_DIR, args.corpus)} pages into {args.corpus}")
+        return
+
+    with open(args.golden, "r", encoding="utf-8") as f:
+        questions = json.load(f)["questions"]
+
+    configs = [_parse_config(s) for s in args.config] or [BenchConfig(*c) for c in DEFAULT_CONFIGS]
+
+    corpus = []
+    if any(c.backend == "memory" for c in configs):
+        corpus = load_fixture_corpus(args.corpus)
+        if not corpus:
+            print(f"No fixture pages in {args.corpus}.")
+            sys.exit(2)
+        print(f"Fixture corpus: {len(corpus)} pages from {args.corpus}")
+
+    emb_cache = EmbeddingCache(EMB_CACHE_PATH)
+    q_vectors = emb_cache.embed([q["question"] for q in questions])
+
+    indexes: Dict[Tuple[int, int], MemoryIndex] = {}
+    results = [run_config(c, questions, q_vectors, corpus=corpus, emb_cache=emb_cache, indexes=indexes)
+               for c in configs]
+
+    print(f"\n{len(questions)} questions\n")
+    print(f"{'config':<18} {'recall@k':>8} {'MRR':>6} {'hit@k':>6} {'p50 ms':>8} {'p95 ms':>8} {'prompt tok':>10}")
+    for r in results:
+        print(f"{r.name:<18} {r.recall:8.3f} {r.mrr:6.3f} {r.hit_rate:6.3f} "
+              f"{r.p50_ms:8.2f} {r.p95_ms:8.2f} {r.prompt_tokens:10.0f}")
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump([asdict(r) for r in results], f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            base = {r["name"]: r for r in json.load(f)}
+        failed = False
+        for r in results:
+            b = base.get(r.name)
+            if not b:
+                continue
+            for metric in ("recall", "mrr"):
+                if getattr(r, metric) < b[metric] - args.tolerance:
+                    failed = True
+                    print(f"REGRESSION [{r.name}] {metric}: {b[metric]:.3f} -> {getattr(r, metric):.3f}")
+        if failed:
+            sys.exit(1)
+        print("\nNo regressions vs baseline.")
+
+
+if __name__ == "__main__":
+    main()
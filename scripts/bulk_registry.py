@@ -0,0 +1,54 @@
+# scripts/bulk_registry.py
+from __future__ import annotations
+
+import sys
+import os
+from dotenv import load_dotenv
+
+# Настройка путей
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+load_dotenv(os.path.join(root_dir, '.env'))
+sys.path.append(root_dir)
+
+import argparse
+import time
+
+from app.storage.bulk import TABLES, export_file, import_file
+from app.storage.db import db_session
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bulk import/export of cases, evidence items and tasks (CSV or JSONL, optionally .gz)."
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    imp = sub.add_parser("import", help="COPY a file into staging and merge it (one transaction per file).")
+    imp.add_argument("table", choices=list(TABLES))
+    imp.add_argument("paths", nargs="+")
+
+    exp = sub.add_parser("export", help="Stream a table to a file in the import format.")
+    exp.add_argument("table", choices=list(TABLES))
+    exp.add_argument("path")
+    exp.add_argument("--case", action="append", default=[], help="Only this case (repeatable).")
+
+    args = parser.parse_args()
+
+    if args.command == "import":
+        for path in args.paths:
+            t0 = time.perf_counter()
+            with db_session() as session:
+                stats = import_file(session, args.table, path)
+            dt = time.perf_counter() - t0
+            print(f"{path}: {stats.summary()} in {dt:.1f}s ({stats.rows / dt if dt else 0:,.0f} rows/s)")
+        return
+
+    t0 = time.perf_counter()
+    with db_session() as session:
+        rows = export_file(session, args.table, args.path, case_names=args.case)
+    print(f"Exported {rows} {args.table} rows to {args.path} in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# scripts/check_crawler.py
+from __future__ import annotations
+
+import sys
+import os
+from dotenv import load_dotenv
+
+# Настройка путей
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+load_dotenv(os.path.join(root_dir, '.env'))
+sys.path.append(root_dir)
+
+import argparse
+import functools
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+
+from app.rag.crawler import Crawler, CrawlStats, compile_rules
+from app.rag.fetcher import HttpCache, SourceFetcher
+from app.rag.indexer import FetchedPage
+from app.rag.models import CrawlFrontier
+from app.storage.db import db_session
+
+SITE_DIR = os.path.join(root_dir, "bench", "fixtures", "site")
+MAX_DEPTH = 2
+
+# Страницы сайта-фикстуры (пути от корня), которые краулер должен проиндексировать
+EXPECTED_DONE = {"", "policy/volume-6/", "regulations/204-5.html", "policy/volume-6/part-f/chapter-2.html"}
+# Битая ссылка: 404 -> failed после max_attempts
+EXPECTED_FAILED = {"missing.html"}
+# Глубже MAX_DEPTH - в frontier не попадает; внешняя ссылка не проходит allow-правило
+NEVER_QUEUED = {"policy/volume-6/part-f/appendix.html"}
+OUTSIDE_URL = "https://www.example.com/outside.html"
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class Check:
+    def __init__(self) -> None:
+        self.failed = 0
+
+    def expect(self, label: str, ok: bool, detail: str = "") -> None:
+        if ok:
+            print(f"ok   {label}")
+        else:
+            self.failed += 1
+            print(f"FAIL {label}" + (f": {detail}" if detail else ""))
+
+
+def _frontier(session: Session, base: str) -> Dict[str, str]:
+    rows = session.execute(
+        select(CrawlFrontier.url, CrawlFrontier.status).where(CrawlFrontier.url.startswith(base))
+    ).all()
+    return {url[len(base):]: status for url, status in rows}
+
+
+def _crawl(session: Session, base: str, cache_dir: str, indexed: List[str], *, recrawl: bool = False) -> CrawlStats:
+    def index_page(session: Session, kind: str, page: FetchedPage) -> int:
+        # Проверяется обход, а не эмбеддинги: страницу только запоминаем
+        indexed.append(page.url[len(base):])
+        return 0
+
+    rules = compile_rules([{"kind": "fixture", "pattern": "^" + base.replace(".", r"\."), "max_depth": MAX_DEPTH}])
+    fetcher = SourceFetcher(cache=HttpCache(cache_dir), max_workers=2, per_host=2)
+    try:
+        crawler = Crawler(session, fetcher=fetcher, rules=rules, max_attempts=2, index_page=index_page)
+        if recrawl:
+            crawler.recrawl()
+        crawler.seed([base])
+        return crawler.run()
+    finally:
+        fetcher.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Crawl the static fixture site (bench/fixtures/site) from a local HTTP server and check "
+                    "the frontier, depth and allow rules, recrawl with 304s, and lease recovery. "
+                    "Needs the database from DATABASE_URL; embeddings are not computed.",
+    )
+    parser.parse_args()
+
+    check = Check()
+    work = tempfile.mkdtemp(prefix="crawl-check-")
+    site = os.path.join(work, "site")
+    # Копия: проверка меняет mtime страницы, фикстура в репозитории не трогается
+    shutil.copytree(SITE_DIR, site)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(_QuietHandler, directory=site))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}/"
+    cache_dir = os.path.join(work, "http_cache")
+
+    try:
+        with db_session() as session:
+            session.execute(delete(CrawlFrontier).where(CrawlFrontier.url.startswith(base)))
+            session.commit()
+
+            # 1. Первый обход
+            indexed: List[str] = []
+            stats = _crawl(session, base, cache_dir, indexed)
+            frontier = _frontier(session, base)
+            done = {u for u, st in frontier.items() if st == "done"}
+            check.expect("first crawl indexes every reachable page once",
+                         sorted(indexed) == sorted(EXPECTED_DONE), f"indexed {sorted(indexed)}")
+            check.expect("frontier marks reachable pages done", done == EXPECTED_DONE, f"done {sorted(done)}")
+            check.expect("broken link ends failed",
+                         {u for u, st in frontier.items() if st == "failed"} == EXPECTED_FAILED, str(frontier))
+            check.expect("pages below the depth limit are not queued", not NEVER_QUEUED & frontier.keys())
+            check.expect("links outside the allow rule are not queued",
+                         session.execute(select(CrawlFrontier.id).where(CrawlFrontier.url == OUTSIDE_URL))
+                         .first() is None)
+            check.expect("first crawl counts", stats.fetched == len(EXPECTED_DONE) and stats.not_modified == 0,
+                         f"fetched={stats.fetched} not_modified={stats.not_modified}")
+
+            # 2. Повторный обход без изменений: только 304, в индекс ничего не идет
+            indexed = []
+            stats = _crawl(session, base, cache_dir, indexed, recrawl=True)
+            check.expect("unchanged recrawl is all 304",
+                         stats.fetched == 0 and stats.not_modified == len(EXPECTED_DONE) and not indexed,
+                         f"fetched={stats.fetched} not_modified={stats.not_modified} indexed={indexed}")
+            check.expect("links are still followed from cached bodies",
+                         {u for u, st in _frontier(session, base).items() if st == "done"} == EXPECTED_DONE)
+
+            # 3. Одна страница изменилась: переиндексируется только она
+            changed = "policy/volume-6/part-f/chapter-2.html"
+            later = time.time() + 60
+            os.utime(os.path.join(site, *changed.split("/")), (later, later))
+            indexed = []
+            stats = _crawl(session, base, cache_dir, indexed, recrawl=True)
+            check.expect("recrawl after an edit refetches only the edited page",
+                         indexed == [changed] and stats.not_modified == len(EXPECTED_DONE) - 1,
+                         f"indexed={indexed} not_modified={stats.not_modified}")
+
+            # 4. Захват упавшего процесса возвращается в очередь, живой - нет
+            crawler = Crawler(session, fetcher=SourceFetcher(cache=HttpCache(cache_dir)), rules=[])
+            stale, live = base + "policy/volume-6/", base + "regulations/204-5.html"
+            for url, claimed_at in ((stale, datetime.utcnow() - timedelta(seconds=crawler.lease_s + 60)),
+                                    (live, datetime.utcnow())):
+                session.execute(update(CrawlFrontier).where(CrawlFrontier.url == url)
+                                .values(status="in_progress", claimed_at=claimed_at))
+            session.commit()
+            recovered = crawler.recover()
+            frontier = _frontier(session, base)
+            check.expect("recover() requeues only expired claims",
+                         recovered == 1 and frontier[stale[len(base):]] == "pending"
+                         and frontier[live[len(base):]] == "in_progress",
+                         f"recovered={recovered}")
+
+            session.execute(delete(CrawlFrontier).where(CrawlFrontier.url.startswith(base)))
+    finally:
+        server.shutdown()
+        shutil.rmtree(work, ignore_errors=True)
+
+    return 1 if check.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
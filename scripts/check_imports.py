@@ -0,0 +1,44 @@
+# scripts/check_imports.py
+from __future__ import annotations
+
+import sys
+import os
+from dotenv import load_dotenv
+
+# Настройка путей
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+load_dotenv(os.path.join(root_dir, '.env'))
+sys.path.append(root_dir)
+
+import importlib
+import traceback
+
+# Точки входа: бот (polling/webhook/sharded) и воркер очереди.
+# Битый импорт здесь = бот не стартует ни в одном режиме
+ENTRY_MODULES = (
+    "app.main",
+    "app.telegram.webhook",
+    "app.telegram.sharded",
+    "app.core.jobs",
+)
+
+
+def main() -> int:
+    # app.main без токена делает sys.exit - для проверки импортов токен не нужен
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:import-check")
+    failed = 0
+    for name in ENTRY_MODULES:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            failed += 1
+            print(f"FAIL {name}")
+            traceback.print_exc()
+        else:
+            print(f"ok   {name}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
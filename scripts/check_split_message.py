@@ -0,0 +1,75 @@
+# scripts/check_split_message.py
+from __future__ import annotations
+
+import sys
+import os
+from dotenv import load_dotenv
+
+# Настройка путей
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+load_dotenv(os.path.join(root_dir, '.env'))
+sys.path.append(root_dir)
+
+import threading
+from typing import List
+
+from app.telegram.outbox import TG_LIMIT, split_message
+
+FENCE = "```"
+
+# Тексты, на которых разбиение ломалось или может сломаться: длинные строки без пробелов
+# в блоке кода (раньше - бесконечный цикл), непарная разметка, обычный длинный текст
+CASES = {
+    "fence, unbroken run": f"{FENCE}\n" + "x" * 5000 + f"\n{FENCE}",
+    "fence with language, unbroken run": f"{FENCE}python\n" + "x" * 9000 + f"\n{FENCE}",
+    "text then fence, unbroken run": "intro\n\n" + f"{FENCE}\n" + "y" * 12000 + f"\n{FENCE}\ntail",
+    "fence, long lines": f"{FENCE}\n" + "\n".join("z" * 300 for _ in range(60)) + f"\n{FENCE}",
+    "unbroken run, no fence": "w" * 9000,
+    "unpaired markdown": "*bold " + "word " * 2000,
+    "paragraphs": "\n\n".join("sentence " * 40 for _ in range(40)),
+}
+TIMEOUT_S = 10.0
+
+
+def check(name: str, text: str) -> List[str]:
+    result: List[List[str]] = []
+    worker = threading.Thread(target=lambda: result.append(split_message(text)), daemon=True)
+    worker.start()
+    worker.join(TIMEOUT_S)
+    if not result:
+        return [f"did not finish in {TIMEOUT_S:.0f}s"]
+
+    parts = result[0]
+    errors = []
+    if not parts:
+        errors.append("no parts")
+    for i, part in enumerate(parts):
+        if len(part) > TG_LIMIT:
+            errors.append(f"part {i} has {len(part)} chars > {TG_LIMIT}")
+        if not part.strip():
+            errors.append(f"part {i} is empty")
+        if part.count(FENCE) % 2:
+            errors.append(f"part {i} leaves a code block open")
+    # Без учета переоткрытых ``` и пробелов на границах частей текст должен сохраниться
+    def _squash(s: str) -> str:
+        return "".join(s.replace(FENCE, "").split())
+    if _squash("".join(parts)) != _squash(text):
+        errors.append("text changed after splitting")
+    return errors
+
+
+def main() -> int:
+    failed = 0
+    for name, text in CASES.items():
+        errors = check(name, text)
+        if errors:
+            failed += 1
+            print(f"FAIL {name}: " + "; ".join(errors))
+        else:
+            print(f"ok   {name}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+# scripts/crawl_sources.py
+from __future__ import annotations
+
+import sys
+import os
+from dotenv import load_dotenv
+
+# Настройка путей
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+env_path = os.path.join(root_dir, '.env')
+load_dotenv(env_path)
+sys.path.append(root_dir)
+
+import argparse
+
+from app.storage.db import db_session
+from app.rag.sources import CRAWL_SEEDS, CRAWL_RULES
+from app.rag.fetcher import SourceFetcher
+from app.rag.embedder import get_embedder
+from app.rag.answer_cache import invalidate_stale
+from app.rag.crawler import Crawler, compile_rules
+
+
+def _parse_allow(values):
+    # --allow kind=REGEX[@max_depth]
+    rules = []
+    for v in values:
+        kind, _, rest = v.partition("=")
+        pattern, _, depth = rest.rpartition("@") if "@" in rest else (rest, "", "")
+        rules.append({"kind": kind, "pattern": pattern, "max_depth": int(depth) if depth else 3})
+    return rules
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Crawl allow-listed USCIS/eCFR pages into the RAG index (resumable).",
+        epilog="Local fixture: python -m http.server -d bench/fixtures/site 8000, then "
+               "--seed http://localhost:8000/ --allow 'fixture=^http://localhost:8000/@2' --delay 0. "
+               "scripts/check_crawler.py does this and checks the result.",
+    )
+    parser.add_argument("--seed", action="append", default=[],
+                        help="Seed URL (repeatable). Defaults to CRAWL_SEEDS.")
+    parser.add_argument("--allow", action="append", default=[],
+                        help="Allow rule kind=REGEX[@max_depth] (repeatable). Defaults to CRAWL_RULES.")
+    parser.add_argument("--max-depth", type=int, default=None)
+    parser.add_argument("--max-pages", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--per-host", type=int, default=2)
+    parser.add_argument("--delay", type=float, default=1.0,
+                        help="Seconds between requests to the same host.")
+    parser.add_argument("--offline", action="store_true", help="Replay from the local HTTP cache only.")
+    parser.add_argument("--recrawl", action="store_true",
+                        help="Re-queue finished pages (conditional GET keeps it cheap).")
+    args = parser.parse_args()
+
+    rules = compile_rules(_parse_allow(args.allow) if args.allow else CRAWL_RULES)
+    seeds = args.seed or CRAWL_SEEDS
+
+    fetcher = SourceFetcher(offline=args.offline, max_workers=args.workers,
+                            per_host=args.per_host, delay_s=args.delay)
+
+    with db_session() as session:
+        crawler = Crawler(session, fetcher=fetcher, rules=rules,
+                          max_depth=args.max_depth, max_pages=args.max_pages)
+
+        recovered = crawler.recover()
+        if recovered:
+            print(f"Recovered {recovered} in-progress pages with expired leases.")
+        if args.recrawl:
+            print(f"Re-queued {crawler.recrawl()} pages.")
+
+        print(f"Seeded {crawler.seed(seeds)} new URLs; {crawler.pending_count()} pending.")
+        stats = crawler.run()
+
+        # Корпус изменился - закешированные ответы по старой версии больше не нужны
+        dropped = invalidate_stale(session)
+        if dropped:
+            print(f"Invalidated {dropped} cached answers.")
+
+    fetcher.close()
+    print(f"Embeddings: {get_embedder().stats.summary()}")
+    print(
+        f"\nDone. fetched={stats.fetched} not_modified={stats.not_modified} failed={stats.failed} "
+        f"discovered={stats.discovered} chunks={stats.chunks}"
+    )
+
+
+if __name__ == "__main__":
+    main()
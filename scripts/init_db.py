@@ -20,6 +20,36 @@ from app.storage.models import Base
 import app.rag.models
 
 
+# create_all не трогает существующие таблицы: новые колонки добавляем сами
+UPGRADES = [
+    "ALTER TABLE document_versions ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "CREATE INDEX IF NOT EXISTS ix_docver_content_hash ON document_versions (content_hash)",
+    "ALTER TABLE runs ADD COLUMN IF NOT EXISTS document_version_id INTEGER REFERENCES document_versions (id)",
+    "CREATE INDEX IF NOT EXISTS ix_runs_document_version_id ON runs (document_version_id)",
+    "ALTER TABLE evidence_items ADD COLUMN IF NOT EXISTS embedding vector(1536)",
+    "ALTER TABLE evidence_items ADD COLUMN IF NOT EXISTS embedding_hash VARCHAR(32)",
+    "CREATE INDEX IF NOT EXISTS ix_evidence_embedding_hnsw ON evidence_items "
+    "USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)",
+    "CREATE INDEX IF NOT EXISTS ix_evidence_case_updated ON evidence_items (case_id, updated_at)",
+    "ALTER TABLE checkpoints ADD COLUMN IF NOT EXISTS base_id INTEGER REFERENCES checkpoints (id)",
+    "ALTER TABLE checkpoints ADD COLUMN IF NOT EXISTS depth INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE checkpoints ADD COLUMN IF NOT EXISTS delta BYTEA",
+    "ALTER TABLE checkpoints ADD COLUMN IF NOT EXISTS size_bytes INTEGER NOT NULL DEFAULT 0",
+    "CREATE INDEX IF NOT EXISTS ix_run_created ON runs (created_at)",
+    "ALTER TABLE runs ADD COLUMN IF NOT EXISTS verdict VARCHAR(16)",
+    "ALTER TABLE runs ADD COLUMN IF NOT EXISTS confidence DOUBLE PRECISION",
+    "CREATE INDEX IF NOT EXISTS ix_run_verdict_created ON runs (verdict, created_at)",
+    "ALTER TABLE run_archive_index ADD COLUMN IF NOT EXISTS verdict VARCHAR(16)",
+    "ALTER TABLE run_archive_index ADD COLUMN IF NOT EXISTS confidence DOUBLE PRECISION",
+    "ALTER TABLE rag_crawl_frontier ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP",
+    "ALTER TABLE document_versions ADD COLUMN IF NOT EXISTS file_id INTEGER REFERENCES file_objects (id)",
+    "CREATE INDEX IF NOT EXISTS ix_document_versions_file_id ON document_versions (file_id)",
+    # Версии, сохраненные до file_id: привязываем к FileObject по хешу
+    "UPDATE document_versions v SET file_id = f.id FROM file_objects f "
+    "WHERE v.file_id IS NULL AND v.content_hash = f.sha256",
+]
+
+
 def init_db():
     print("Initializing database...")
 
@@ -37,6 +67,12 @@ def init_db():
     Base.metadata.create_all(bind=engine)
     print("Tables created successfully!")
 
+    # 3. Докатываем колонки, появившиеся после первого запуска
+    with engine.begin() as conn:
+        for stmt in UPGRADES:
+            conn.execute(text(stmt))
+    print(f"Applied {len(UPGRADES)} schema upgrades.")
+
 
 if __name__ == "__main__":
     init_db()
\ No newline at end of file
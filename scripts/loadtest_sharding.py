@@ -0,0 +1,131 @@
+# scripts/loadtest_sharding.py
+from __future__ import annotations
+
+import sys
+import os
+from dotenv import load_dotenv
+
+# Настройка путей
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+load_dotenv(os.path.join(root_dir, '.env'))
+sys.path.append(root_dir)
+
+import argparse
+import random
+import threading
+import time
+
+from app.telegram.outbox import split_message
+from app.telegram.sharded import ShardedRunner
+
+BENCH_WORK_MS = float(os.getenv("BENCH_WORK_MS", "5"))
+
+_PARAGRAPH = (
+    "**Criterion 3 (published material).** The exhibit *C-12* shows coverage in a major trade "
+    "publication; `Exhibit C-12` should be cited next to the claim.\n\n"
+)
+
+
+class BenchBot:
+    """
+    Stand-in for TeleBot in shard processes: CPU-bound handler work (formatting and
+    splitting a long judge answer) and a per-chat ordering check. No network, no DB.
+    """
+
+    def __init__(self, work_ms: float) -> None:
+        self.work_ms = work_ms
+        self.last_seq = {}
+        self.violations = 0
+        self.handled = 0
+        self._lock = threading.Lock()
+
+    def process_new_updates(self, updates) -> None:
+        for update in updates:
+            chat_id = update.message.chat.id
+            seq = int(update.message.text.split()[1])
+            with self._lock:
+                if seq <= self.last_seq.get(chat_id, -1):
+                    self.violations += 1
+                self.last_seq[chat_id] = seq
+
+            # CPU-время потока, а не стенные часы: иначе вытеснение засчитывалось бы как работа
+            deadline = time.thread_time() + self.work_ms / 1000
+            while time.thread_time() < deadline:
+                split_message(_PARAGRAPH * 40, limit=1000)
+            with self._lock:
+                self.handled += 1
+
+    def report(self) -> None:
+        print(f"  [shard pid {os.getpid()}] handled={self.handled} order_violations={self.violations}")
+
+
+def make_bench_bot():
+    bot = BenchBot(BENCH_WORK_MS)
+    return bot, bot.report
+
+
+def _update(update_id: int, chat_id: int, seq: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            "text": f"/bench {seq}",
+        },
+    }
+
+
+def run(workers: int, *, updates: int, chats: int, threads: int) -> float:
+    runner = ShardedRunner(workers, factory="scripts.loadtest_sharding:make_bench_bot",
+                           queue_size=1000, threads_per_shard=threads)
+    runner.start()
+    # Ждем, пока все шарды поднимутся (первый heartbeat)
+    while not all(s.heartbeat.value for s in runner.shards):
+        time.sleep(0.05)
+
+    rnd = random.Random(42)
+    seqs = [0] * chats
+    t0 = time.perf_counter()
+    for i in range(updates):
+        c = rnd.randrange(chats)
+        runner.submit(_update(i + 1, 100000 + c, seqs[c]), timeout=60)
+        seqs[c] += 1
+    runner.drain()
+    elapsed = time.perf_counter() - t0
+
+    done = runner.processed()
+    if done != updates:
+        print(f"  WARNING: processed {done} of {updates}")
+    return updates / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the sharded runner vs number of worker processes.")
+    parser.add_argument("--workers", default="1,2,4", help="Comma-separated shard counts to try.")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=4, help="Handler threads per shard.")
+    parser.add_argument("--work-ms", type=float, default=BENCH_WORK_MS, help="CPU time per update in the handler.")
+    args = parser.parse_args()
+
+    # Шарды - отдельные процессы, параметр передаем через окружение
+    os.environ["BENCH_WORK_MS"] = str(args.work_ms)
+
+    print(f"{args.updates} updates, {args.chats} chats, {args.work_ms} ms CPU per update, "
+          f"{args.threads} threads/shard, {os.cpu_count()} CPUs")
+    counts = [int(x) for x in args.workers.split(",")]
+    if (os.cpu_count() or 1) < max(counts):
+        # На одном ядре процессы делят один CPU: проверяется порядок и полнота, не ускорение
+        print("NOTE: fewer CPUs than shards, the x-factors below do not measure scaling")
+    base = None
+    for n in counts:
+        rate = run(n, updates=args.updates, chats=args.chats, threads=args.threads)
+        base = base or rate
+        print(f"workers={n:<3} {rate:8.1f} updates/s  x{rate / base:.2f}")
+
+
+if __name__ == "__main__":
+    main()
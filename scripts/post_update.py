@@ -0,0 +1,67 @@
+# scripts/post_update.py
+from __future__ import annotations
+
+import sys
+import os
+from dotenv import load_dotenv
+
+# Настройка путей
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+load_dotenv(os.path.join(root_dir, '.env'))
+sys.path.append(root_dir)
+
+import argparse
+import json
+import time
+
+import requests
+
+
+def _synthetic_update(text: str, chat_id: int, update_id: int) -> dict:
+    now = int(time.time())
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": now,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Local"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+            if text.startswith("/") else [],
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="POST recorded (or synthetic) Telegram updates to a locally running webhook.")
+    parser.add_argument("files", nargs="*", help="JSON files with one update or a list of updates.")
+    parser.add_argument("--text", default=None, help="Build a synthetic message update with this text.")
+    parser.add_argument("--chat-id", type=int, default=1)
+    parser.add_argument("--url", default=f"http://localhost:{os.getenv('WEBHOOK_PORT', '8080')}"
+                                         f"{os.getenv('TELEGRAM_WEBHOOK_PATH', '/telegram/webhook')}")
+    parser.add_argument("--secret", default=os.getenv("TELEGRAM_WEBHOOK_SECRET", ""))
+    args = parser.parse_args()
+
+    updates = []
+    for path in args.files:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        updates += data if isinstance(data, list) else [data]
+    if args.text:
+        updates.append(_synthetic_update(args.text, args.chat_id, int(time.time() * 1000) % 2_000_000_000))
+
+    if not updates:
+        parser.error("nothing to send: pass update files or --text")
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    for upd in updates:
+        t0 = time.perf_counter()
+        r = requests.post(args.url, json=upd, headers=headers, timeout=10)
+        print(f"update {upd.get('update_id')}: HTTP {r.status_code} in {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# scripts/run_worker.py
+from __future__ import annotations
+
+import sys
+import os
+from dotenv import load_dotenv
+
+# Настройка путей
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+load_dotenv(os.path.join(root_dir, '.env'))
+sys.path.append(root_dir)
+
+import argparse
+import signal
+import socket
+import threading
+
+import telebot
+
+from app.core.jobs import ClaimedJob, JobWorker, Subscriber
+from app.telegram.commands import run_review_job
+from app.telegram.outbox import Outbox, process_rate
+
+TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+
+
+def make_callbacks(outbox: Outbox):
+    def notify(job: ClaimedJob, sub: Subscriber, text: str) -> None:
+        # Outbox режет длинный текст по безопасным границам и сам откатывается на plain text
+        outbox.send(sub.chat_id, text, parse_mode="Markdown")
+
+    def progress(job: ClaimedJob, sub: Subscriber, text: str) -> None:
+        line = f"Задача #{job.id}: {text}"
+        if sub.status_message_id:
+            outbox.edit(sub.chat_id, sub.status_message_id, line)
+        else:
+            outbox.send(sub.chat_id, line, parse_mode=None)
+
+    return notify, progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Background worker for queued jobs (/review).")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("JOB_WORKERS", "2")),
+                        help="Jobs processed in parallel by this process.")
+    parser.add_argument("--poll", type=float, default=2.0, help="Seconds between polls when the queue is empty.")
+    args = parser.parse_args()
+
+    if not TOKEN:
+        print("Error: TELEGRAM_BOT_TOKEN is not set in .env")
+        sys.exit(1)
+
+    bot = telebot.TeleBot(TOKEN, threaded=False)
+    # Бот шлет в то же время: воркер берет только свою долю общего лимита
+    outbox = Outbox(bot, global_rate=process_rate("worker"))
+    outbox.start()
+    notify, progress = make_callbacks(outbox)
+    handlers = {"review": run_review_job}
+
+    base_id = f"{socket.gethostname()}:{os.getpid()}"
+    workers = [
+        JobWorker(handlers, notify=notify, progress=progress,
+                  worker_id=f"{base_id}:{i}", poll_interval_s=args.poll)
+        for i in range(max(1, args.concurrency))
+    ]
+
+    def _shutdown(signum, frame):
+        # Текущие задачи доделываются, новые не берутся
+        print("Stopping workers...")
+        for w in workers:
+            w.stop()
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+
+    threads = [threading.Thread(target=w.run_forever, name=f"job-worker-{i}") for i, w in enumerate(workers)]
+    for t in threads:
+        t.start()
+    print(f"--- Job worker started: {len(workers)} threads ({base_id}) ---")
+    for t in threads:
+        while t.is_alive():
+            t.join(timeout=1.0)
+    outbox.stop()
+    print("Workers stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,11 @@ root_dir = os.path.dirname(current_dir)
 sys.path.append(root_dir)
 load_dotenv(os.path.join(root_dir, '.env'))
 
+from datetime import datetime
+
+from sqlalchemy import literal_column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
 from app.storage.db import db_session
 from app.storage.models import Case
 
@@ -26,29 +31,29 @@ def seed_cases():
     with open(CASES_FILE, "r", encoding="utf-8") as f:
         cases_data = json.load(f)
 
+    # Одно имя дважды в файле - берем последнее (ON CONFLICT не трогает строку дважды за запрос)
+    rows = {}
+    for c_data in cases_data:
+        name = c_data.get("name")
+        if name:
+            rows[name] = {"name": name, "memo_json": c_data.get("memo", {}), "lock_mode": True}
+    if not rows:
+        print("No cases in the file.")
+        return
+
+    # Один запрос на весь файл: новые кейсы создаются, у существующих обновляется мемо
+    now = datetime.utcnow()
+    stmt = pg_insert(Case).values([{**r, "created_at": now, "updated_at": now} for r in rows.values()])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Case.name],
+        set_={"memo_json": stmt.excluded.memo_json, "updated_at": now},
+    ).returning(Case.name, literal_column("xmax = 0"))
+
     with db_session() as session:
-        for c_data in cases_data:
-            name = c_data.get("name")
-            memo = c_data.get("memo", {})
-
-            if not name:
-                continue
-
-            existing = session.query(Case).filter(Case.name == name).one_or_none()
-            if existing:
-                print(f"Updating case '{name}'...")
-                existing.memo_json = memo
-            else:
-                print(f"Creating new case '{name}'...")
-                new_case = Case(
-                    name=name,
-                    memo_json=memo,
-                    lock_mode=True
-                )
-                session.add(new_case)
+        for name, created in session.execute(stmt).all():
+            print(f"{'Created' if created else 'Updated'} case '{name}'")
 
     print("Done seeding cases.")
 
-
 if __name__ == "__main__":
     seed_cases()
\ No newline at end of file
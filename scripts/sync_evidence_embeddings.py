@@ -0,0 +1,34 @@
+# scripts/sync_evidence_embeddings.py
+from __future__ import annotations
+
+import sys
+import os
+from dotenv import load_dotenv
+
+# Настройка путей
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+load_dotenv(os.path.join(root_dir, '.env'))
+sys.path.append(root_dir)
+
+import argparse
+import time
+
+from app.core.exhibit_links import EVIDENCE_SYNC_BATCH, sync_evidence_embeddings
+from app.rag.embedder import get_embedder
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed new or edited evidence items (exhibit linking).")
+    parser.add_argument("--case-id", type=int, default=None, help="Only this case (default: all cases).")
+    parser.add_argument("--batch-size", type=int, default=EVIDENCE_SYNC_BATCH)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    n = sync_evidence_embeddings(case_id=args.case_id, batch_size=args.batch_size)
+    print(f"Embedded {n} evidence items in {time.perf_counter() - t0:.1f}s")
+    print(f"Embedder: {get_embedder().stats.summary()}")
+
+
+if __name__ == "__main__":
+    main()
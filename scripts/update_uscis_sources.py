@@ -12,36 +12,64 @@ env_path = os.path.join(root_dir, '.env')
 load_dotenv(env_path)
 sys.path.append(root_dir)
 
+import argparse
+
 from app.storage.db import db_session
 from app.rag.sources import RAG_SOURCES
-from app.rag.indexer import fetch_page, upsert_page_into_rag
+from app.rag.fetcher import SourceFetcher
+from app.rag.embedder import get_embedder
+from app.rag.answer_cache import invalidate_stale
+from app.rag.indexer import parse_page, upsert_page_into_rag, make_chunk_prefix
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Fetch USCIS sources and upsert them into the RAG index.")
+    parser.add_argument("--offline", action="store_true",
+                        help="Replay from the local HTTP cache only (no network).")
+    parser.add_argument("--force", action="store_true",
+                        help="Ignore stored ETag/Last-Modified and download everything.")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--per-host", type=int, default=2)
+    args = parser.parse_args()
+
     print("Starting USCIS sources update...")
     total = 0
+    not_modified = 0
+
+    sources = {src["url"]: src for src in RAG_SOURCES}
+    fetcher = SourceFetcher(offline=args.offline, force=args.force,
+                            max_workers=args.workers, per_host=args.per_host)
 
     with db_session() as session:
-        for src in RAG_SOURCES:
+        # Скачиваем параллельно, а парсинг/эмбеддинги/запись в БД - в этом потоке
+        for res in fetcher.fetch_many(sources):
+            src = sources[res.url]
             kind = src["kind"]
-            url = src["url"]
             title = src.get("title", "")
 
-            print(f"Processing [{kind}] {url}...")
+            print(f"Processing [{kind}] {res.url}...")
+
+            if res.error:
+                print(f" -> ERROR fetching {res.url}: {res.error}")
+                continue
+            if res.not_modified:
+                # 304: ни парсинга, ни чанкинга, ни эмбеддингов
+                not_modified += 1
+                print(" -> Not modified (304), skipped.")
+                continue
 
             try:
-                # Скачиваем страницу
-                page = fetch_page(url, title_fallback=title)
+                page = parse_page(res.url, res.html, title_fallback=title, last_updated=res.last_modified)
 
-                # Генерируем префикс
-                prefix = kind[:3] + "-" + str(abs(hash(url)) % 10_000_000)
+                prefix = make_chunk_prefix(kind, res.url)
 
                 # Сохраняем в векторную базу
                 n = upsert_page_into_rag(session, kind=kind, page=page, chunk_prefix=prefix)
 
-                # Фиксируем успех (commit делается автоматически контекстным менеджером в конце,
-                # но можно делать flush, чтобы видеть прогресс)
-                session.flush()
+                # Коммитим постранично, чтобы ошибка на следующей странице не откатила эту
+                session.commit()
+                # Только теперь сохраненные ETag/Last-Modified начинают давать 304
+                fetcher.commit(res.url)
 
                 total += n
                 print(f" -> Upserted {n} chunks.")
@@ -50,10 +78,17 @@ def main():
                 # ВАЖНО: Если произошла ошибка, откатываем текущую транзакцию,
                 # чтобы сессия осталась живой для следующих итераций
                 session.rollback()
-                print(f" -> ERROR fetching/processing {url}: {e}")
+                print(f" -> ERROR processing {res.url}: {e}")
+
+        # Корпус изменился - закешированные ответы по старой версии больше не нужны
+        dropped = invalidate_stale(session)
+        if dropped:
+            print(f"Invalidated {dropped} cached answers.")
 
-    print(f"\nDone. Total chunks upserted/updated: {total}")
+    fetcher.close()
+    print(f"Embeddings: {get_embedder().stats.summary()}")
+    print(f"\nDone. Total chunks upserted/updated: {total} (not modified: {not_modified})")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()